@@ -30,6 +30,8 @@ import os
 import warnings
 warnings.filterwarnings('ignore')
 
+from utils import load_zone_cube, zone_time_series
+
 # ============================================================================
 # CONFIGURACIÓN DE RUTAS - Compatible con Streamlit Cloud y local
 # ============================================================================
@@ -156,6 +158,62 @@ def cargar_datos():
     
     return gdf_zonas, df_ranking, df_temporal, stats_exists
 
+@st.cache_data
+def cargar_pares():
+    """
+    Carga las estadísticas de cambio de todos los pares de años
+    (detect_changes.py --todos-pares).
+    
+    Retorna:
+        DataFrame: una fila por par (year_inicio, year_fin) o None si no existe
+    """
+    ruta_pares = BASE_DIR / 'data' / 'processed' / 'estadisticas_pares.csv'
+    if not ruta_pares.exists():
+        return None
+    return pd.read_csv(ruta_pares)
+
+@st.cache_data
+def listar_teselaciones():
+    """
+    Lista los niveles de agregación disponibles en teselaciones.gpkg
+    (zonal_analysis.py --teselaciones).
+    
+    Retorna:
+        list: nombres de capa (vacía si no existe el archivo)
+    """
+    ruta = BASE_DIR / 'data' / 'vector' / 'teselaciones.gpkg'
+    if not ruta.exists():
+        return []
+    return list(gpd.list_layers(ruta)['name'])
+
+@st.cache_data
+def cargar_teselacion(capa):
+    """
+    Carga un nivel de agregación ya calculado (mismas columnas que
+    zonas_con_datos.gpkg), sin volver a leer los rasters.
+    
+    Retorna:
+        GeoDataFrame: zonas del nivel en WGS84
+    """
+    gdf = gpd.read_file(BASE_DIR / 'data' / 'vector' / 'teselaciones.gpkg', layer=capa)
+    if gdf.crs and gdf.crs.to_string() != "EPSG:4326":
+        gdf = gdf.to_crs(epsg=4326)
+    return gdf
+
+@st.cache_resource
+def cargar_cubo_zonas():
+    """
+    Abre el cubo zona × año × índice (zonal_analysis.py) como memory-map;
+    cada zona se lee bajo demanda.
+    
+    Retorna:
+        tuple: (cubo, ejes) o (None, None) si no existe
+    """
+    ruta = BASE_DIR / 'data' / 'processed' / 'cubo_zonas_indices.npy'
+    if not ruta.exists() or not ruta.with_suffix('.json').exists():
+        return None, None
+    return load_zone_cube(ruta)
+
 @st.cache_data
 def verificar_imagenes_ndvi():
     """
@@ -179,6 +237,7 @@ def verificar_imagenes_ndvi():
 # ============================================================================
 
 zonas, ranking, temporal, stats_exists = cargar_datos()
+pares = cargar_pares()
 imagenes_ndvi = verificar_imagenes_ndvi()
 
 # ============================================================================
@@ -230,9 +289,38 @@ fecha_fin = st.sidebar.selectbox(
     index=2
 )
 
+# Estadísticas del periodo seleccionado (cubo de pares precalculado)
+par_seleccionado = None
+if fecha_fin <= fecha_inicio:
+    st.sidebar.warning("⚠️ La fecha final debe ser posterior a la inicial")
+elif pares is not None:
+    fila_par = pares[(pares['year_inicio'] == fecha_inicio) & (pares['year_fin'] == fecha_fin)]
+    if len(fila_par) > 0:
+        par_seleccionado = fila_par.iloc[0]
+if pares is None:
+    st.sidebar.caption("Ejecuta `detect_changes.py --todos-pares` para habilitar otros periodos "
+                       "(se muestra 2018-2024)")
+
 st.sidebar.markdown("---")
 st.sidebar.subheader("🗺️ Filtros Espaciales")
 
+# Nivel de agregación: grilla base o una teselación precalculada
+capas_teselacion = listar_teselaciones()
+if zonas is not None and capas_teselacion:
+    nivel = st.sidebar.selectbox(
+        "Nivel de agregación:",
+        options=["Grilla base"] + capas_teselacion,
+        index=0,
+        help="Cuadrículas jerárquicas, quadtree adaptativo o hexágonos "
+             "(zonal_analysis.py --teselaciones)"
+    )
+    if nivel != "Grilla base":
+        zonas = cargar_teselacion(nivel)
+        ranking = zonas.nlargest(10, 'urbanizacion_ha')[[
+            'zona_id', 'urbanizacion_ha', 'perdida_vegetacion_ha',
+            'ganancia_vegetacion_ha', 'cambio_total_ha', 'indice_transformacion'
+        ]].reset_index(drop=True)
+
 # Filtro de intensidad de urbanización
 if zonas is not None:
     min_urb = st.sidebar.slider(
@@ -269,35 +357,46 @@ if zonas is None:
 # SECCIÓN 1: MÉTRICAS PRINCIPALES
 # ============================================================================
 
-st.subheader("📊 Métricas Clave del Periodo 2018-2024")
+# Totales del periodo: del cubo de pares si está disponible, si no de las
+# zonas (periodo completo 2018-2024)
+if par_seleccionado is not None:
+    periodo = (int(par_seleccionado['year_inicio']), int(par_seleccionado['year_fin']))
+    total_urb = par_seleccionado['urbanizacion_ha']
+    total_perd_veg = par_seleccionado['perdida_vegetacion_ha']
+    total_gan_veg = par_seleccionado['ganancia_vegetacion_ha']
+else:
+    periodo = (2018, 2024)
+    total_urb = zonas['urbanizacion_ha'].sum()
+    total_perd_veg = zonas['perdida_vegetacion_ha'].sum()
+    total_gan_veg = zonas['ganancia_vegetacion_ha'].sum()
+n_anios = periodo[1] - periodo[0]
+
+st.subheader(f"📊 Métricas Clave del Periodo {periodo[0]}-{periodo[1]}")
 
 col_m1, col_m2, col_m3, col_m4 = st.columns(4)
 
 with col_m1:
-    total_urb = zonas['urbanizacion_ha'].sum()
     st.metric(
         "Total Urbanización",
         f"{total_urb:,.1f} ha",
-        delta=f"{total_urb/6:.1f} ha/año",
+        delta=f"{total_urb/n_anios:.1f} ha/año",
         help="Hectáreas totales de nueva urbanización detectadas"
     )
 
 with col_m2:
-    total_perd_veg = zonas['perdida_vegetacion_ha'].sum()
     st.metric(
         "Pérdida Vegetación",
         f"{total_perd_veg:,.1f} ha",
-        delta=f"-{total_perd_veg/6:.1f} ha/año",
+        delta=f"-{total_perd_veg/n_anios:.1f} ha/año",
         delta_color="inverse",
         help="Hectáreas de vegetación perdidas"
     )
 
 with col_m3:
-    total_gan_veg = zonas['ganancia_vegetacion_ha'].sum()
     st.metric(
         "Ganancia Vegetación",
         f"{total_gan_veg:,.1f} ha",
-        delta=f"+{total_gan_veg/6:.1f} ha/año",
+        delta=f"+{total_gan_veg/n_anios:.1f} ha/año",
         help="Hectáreas de nueva vegetación"
     )
 
@@ -763,6 +862,62 @@ if temporal is not None and len(temporal) > 0:
 else:
     st.warning("⚠️ No se encontraron datos de evolución temporal.")
 
+# Evolución de una zona (cubo zona × año × índice de la grilla base)
+cubo_zonas, ejes_cubo = cargar_cubo_zonas()
+if cubo_zonas is not None:
+    st.markdown("#### 🔎 Evolución por Zona")
+    
+    zonas_cubo = ejes_cubo['zona']
+    zona_defecto = ranking['zona_id'].iloc[0] if ranking is not None and len(ranking) > 0 else None
+    zona_sel = st.selectbox(
+        "Zona:",
+        options=zonas_cubo,
+        index=zonas_cubo.index(zona_defecto) if zona_defecto in ejes_cubo['posicion'] else 0,
+        help="Zonas de la grilla base (zonal_analysis.py)"
+    )
+    df_zona = zone_time_series(cubo_zonas, ejes_cubo, zona_sel)
+    
+    col_z1, col_z2 = st.columns(2)
+    
+    with col_z1:
+        fig_zona = go.Figure()
+        colores_indice = {'ndvi': 'green', 'ndbi': 'brown', 'ndwi': 'blue', 'bsi': 'orange'}
+        for indice, datos in df_zona.groupby('indice', sort=False):
+            fig_zona.add_trace(go.Scatter(
+                x=datos['year'],
+                y=datos['media'],
+                error_y=dict(type='data', array=datos['std'], visible=True),
+                mode='lines+markers',
+                name=indice.upper(),
+                line=dict(color=colores_indice.get(indice), width=3),
+                hovertemplate=f'<b>Año:</b> %{{x}}<br><b>{indice.upper()}:</b> %{{y:.3f}}<extra></extra>'
+            ))
+        fig_zona.update_layout(
+            title=f"Índices medios ± σ en {zona_sel}",
+            xaxis_title="Año",
+            yaxis_title="Valor del Índice",
+            hovermode='x unified',
+            height=400
+        )
+        st.plotly_chart(fig_zona, use_container_width=True)
+    
+    with col_z2:
+        df_cobertura = df_zona.dropna(subset=['pct_umbral'])
+        fig_zona_cob = px.line(
+            df_cobertura,
+            x='year',
+            y='pct_umbral',
+            color='indice',
+            markers=True,
+            labels={'year': 'Año', 'pct_umbral': '% de la zona sobre el umbral',
+                    'indice': 'Índice'},
+            title=f"Cobertura en {zona_sel} (" + ", ".join(
+                f"{indice.upper()} {operador} {valor}"
+                for indice, (_, operador, valor) in ejes_cubo['umbrales'].items()) + ")"
+        )
+        fig_zona_cob.update_layout(height=400)
+        st.plotly_chart(fig_zona_cob, use_container_width=True)
+
 # ============================================================================
 # SECCIÓN 5: RANKING DE HOTSPOTS
 # ============================================================================
@@ -834,6 +989,42 @@ if ranking is not None and len(ranking) > 0:
 else:
     st.info("💡 No se encontró archivo de ranking.")
 
+# Hotspots con significancia estadística (zonal_analysis.py: Gi* y Moran local)
+if zonas is not None and 'gi_bin' in zonas.columns:
+    st.markdown("#### Hotspots Estadísticos (Getis-Ord Gi*)")
+    
+    significativos = zonas[zonas['gi_bin'] >= 2].sort_values('gi_z', ascending=False)[[
+        'zona_id',
+        'urbanizacion_ha',
+        'gi_z',
+        'gi_p',
+        'moran_cluster'
+    ]].copy()
+    
+    significativos.columns = [
+        'Zona',
+        'Urbanización (ha)',
+        'Gi* (z)',
+        'p-valor',
+        'Cluster Moran'
+    ]
+    
+    st.caption(f"{len(significativos)} zonas son hotspot de urbanización con ≥ 95% de confianza "
+               f"({(zonas['moran_cluster'] == 'Alto-Alto').sum()} zonas en clusters "
+               f"Alto-Alto de Moran local)")
+    st.dataframe(
+        significativos.style.format({
+            'Urbanización (ha)': '{:.2f}',
+            'Gi* (z)': '{:.2f}',
+            'p-valor': '{:.4f}'
+        }).background_gradient(
+            subset=['Gi* (z)'],
+            cmap='Reds'
+        ),
+        use_container_width=True,
+        hide_index=True
+    )
+
 # ============================================================================
 # SIDEBAR: DESCARGA DE DATOS
 # ============================================================================
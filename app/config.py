@@ -4,6 +4,7 @@ Proyecto: Detección de Cambios Urbanos
 """
 
 import os
+import sys
 from pathlib import Path
 
 # Rutas base del proyecto
@@ -13,6 +14,13 @@ RAW_DIR = DATA_DIR / "raw"
 PROCESSED_DIR = DATA_DIR / "processed"
 VECTOR_DIR = DATA_DIR / "vector"
 OUTPUTS_DIR = BASE_DIR / "outputs"
+SCRIPTS_DIR = BASE_DIR / "scripts"
+
+# Módulos compartidos con los scripts de procesamiento
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from spectral_engine import REGISTRO_INDICES  # noqa: E402
 
 # Configuración del área de estudio - Peñaflor
 STUDY_AREA = {
@@ -31,12 +39,10 @@ ANALYSIS_DATES = [
     "2024",
 ]
 
-# Índices espectrales a calcular
+# Índices espectrales disponibles (declarados en scripts/spectral_engine.py)
 SPECTRAL_INDICES = {
-    "NDVI": "Índice de Vegetación de Diferencia Normalizada",
-    "NDBI": "Índice de Construcción de Diferencia Normalizada",
-    "NDWI": "Índice de Agua de Diferencia Normalizada",
-    "BSI": "Índice de Suelo Desnudo",
+    nombre.upper(): datos["descripcion"]
+    for nombre, datos in REGISTRO_INDICES.items()
 }
 
 # Umbrales para clasificación de cambios
@@ -3,26 +3,40 @@ Utilidades para la aplicación Streamlit
 Proyecto: Detección de Cambios Urbanos
 """
 
+import json
+import sys
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 import rasterio
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import Dict, Tuple, Optional
 
+# Motor de índices compartido con los scripts de procesamiento (scripts/)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+from raster_io import leer_reducido  # noqa: E402
+from spectral_engine import INDICES_BASE, MotorIndices  # noqa: E402
+from streaming_stats import AcumuladorEstadisticas  # noqa: E402
 
-def load_raster(filepath: str) -> Tuple[np.ndarray, dict]:
+
+def load_raster(filepath: str, max_size: Optional[int] = None) -> Tuple[np.ndarray, dict]:
     """
     Carga un archivo raster y retorna los datos y metadatos.
     
     Args:
         filepath: Ruta al archivo raster
+        max_size: Lado máximo en píxeles; si se indica se lee una versión
+            reducida (desde las overviews del COG) para visualización
         
     Returns:
         Tuple con (array de datos, diccionario de metadatos)
     """
     with rasterio.open(filepath) as src:
-        data = src.read()
+        if max_size is None:
+            data = src.read()
+        else:
+            data = np.stack([leer_reducido(src, banda, max_size)
+                             for banda in range(1, src.count + 1)])
         meta = src.meta.copy()
         bounds = src.bounds
         meta['bounds'] = bounds
@@ -42,6 +56,58 @@ def load_vector(filepath: str) -> gpd.GeoDataFrame:
     return gpd.read_file(filepath)
 
 
+def load_zone_cube(filepath: str) -> Tuple[np.ndarray, dict]:
+    """
+    Abre el cubo zona × año × índice × estadístico de zonal_analysis.py sin
+    cargarlo en memoria (memory-map): cada zona se lee por separado.
+    
+    Args:
+        filepath: Ruta al cubo (cubo_zonas_indices.npy); los ejes se leen
+            del .json con el mismo nombre
+        
+    Returns:
+        Tuple con (cubo de solo lectura, ejes); los ejes incluyen
+        'posicion', un diccionario zona_id → fila del cubo
+    """
+    ruta = Path(filepath)
+    cubo = np.load(ruta, mmap_mode='r')
+    ejes = json.loads(ruta.with_suffix('.json').read_text(encoding='utf-8'))
+    ejes['posicion'] = {zona: i for i, zona in enumerate(ejes['zona'])}
+    return cubo, ejes
+
+
+def zone_time_series(cube: np.ndarray, axes: dict, zone_id: str) -> pd.DataFrame:
+    """
+    Serie temporal de índices de una zona, leída del cubo en O(1).
+    
+    Args:
+        cube: Cubo de load_zone_cube
+        axes: Ejes de load_zone_cube
+        zone_id: Identificador de la zona (ej: 'Z_02_08')
+        
+    Returns:
+        DataFrame con una fila por año e índice y columnas year, indice y
+        un estadístico por columna (media, std, pct_umbral)
+    """
+    bloque = np.asarray(cube[axes['posicion'][zone_id]])
+    years, indices = np.meshgrid(axes['year'], axes['indice'], indexing='ij')
+    df = pd.DataFrame(bloque.reshape(-1, len(axes['estadistico'])),
+                      columns=axes['estadistico'])
+    df.insert(0, 'indice', indices.ravel())
+    df.insert(0, 'year', years.ravel())
+    return df
+
+
+def _calculate_index(indice: str, **bandas: np.ndarray) -> np.ndarray:
+    """
+    Calcula un índice con el motor compartido (float32, sin épsilon).
+    
+    Los valores no finitos (división por cero, NaN) se reemplazan por 0.
+    """
+    motor = MotorIndices((indice,), eps=0, recortar=False, relleno=0)
+    return motor.calcular(**bandas)[0]
+
+
 def calculate_ndvi(nir: np.ndarray, red: np.ndarray) -> np.ndarray:
     """
     Calcula el Índice de Vegetación de Diferencia Normalizada (NDVI).
@@ -53,10 +119,7 @@ def calculate_ndvi(nir: np.ndarray, red: np.ndarray) -> np.ndarray:
     Returns:
         Array con valores NDVI [-1, 1]
     """
-    with np.errstate(divide='ignore', invalid='ignore'):
-        ndvi = (nir.astype(float) - red.astype(float)) / (nir + red)
-        ndvi = np.where(np.isfinite(ndvi), ndvi, 0)
-    return ndvi
+    return _calculate_index('ndvi', nir=nir, red=red)
 
 
 def calculate_ndbi(swir: np.ndarray, nir: np.ndarray) -> np.ndarray:
@@ -70,10 +133,7 @@ def calculate_ndbi(swir: np.ndarray, nir: np.ndarray) -> np.ndarray:
     Returns:
         Array con valores NDBI [-1, 1]
     """
-    with np.errstate(divide='ignore', invalid='ignore'):
-        ndbi = (swir.astype(float) - nir.astype(float)) / (swir + nir)
-        ndbi = np.where(np.isfinite(ndbi), ndbi, 0)
-    return ndbi
+    return _calculate_index('ndbi', swir=swir, nir=nir)
 
 
 def calculate_ndwi(green: np.ndarray, nir: np.ndarray) -> np.ndarray:
@@ -87,10 +147,7 @@ def calculate_ndwi(green: np.ndarray, nir: np.ndarray) -> np.ndarray:
     Returns:
         Array con valores NDWI [-1, 1]
     """
-    with np.errstate(divide='ignore', invalid='ignore'):
-        ndwi = (green.astype(float) - nir.astype(float)) / (green + nir)
-        ndwi = np.where(np.isfinite(ndwi), ndwi, 0)
-    return ndwi
+    return _calculate_index('ndwi', green=green, nir=nir)
 
 
 def calculate_bsi(blue: np.ndarray, red: np.ndarray, 
@@ -107,12 +164,27 @@ def calculate_bsi(blue: np.ndarray, red: np.ndarray,
     Returns:
         Array con valores BSI
     """
-    with np.errstate(divide='ignore', invalid='ignore'):
-        numerator = (swir.astype(float) + red) - (nir + blue)
-        denominator = (swir + red) + (nir + blue)
-        bsi = numerator / denominator
-        bsi = np.where(np.isfinite(bsi), bsi, 0)
-    return bsi
+    return _calculate_index('bsi', blue=blue, red=red, nir=nir, swir=swir)
+
+
+def calculate_indices(blue: np.ndarray, green: np.ndarray, red: np.ndarray,
+                      nir: np.ndarray, swir: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Calcula NDVI, NDBI, NDWI y BSI en una sola pasada.
+    
+    Args:
+        blue: Banda del azul
+        green: Banda del verde
+        red: Banda del rojo
+        nir: Banda del infrarrojo cercano
+        swir: Banda del infrarrojo de onda corta
+        
+    Returns:
+        Diccionario {índice: array float32}
+    """
+    motor = MotorIndices(INDICES_BASE, eps=0, recortar=False, relleno=0)
+    salida = motor.calcular(blue=blue, green=green, red=red, nir=nir, swir=swir)
+    return dict(zip(INDICES_BASE, salida))
 
 
 def get_statistics(data: np.ndarray, nodata: Optional[float] = None) -> dict:
@@ -126,18 +198,11 @@ def get_statistics(data: np.ndarray, nodata: Optional[float] = None) -> dict:
     Returns:
         Diccionario con estadísticas
     """
-    if nodata is not None:
-        data = data[data != nodata]
-    
-    valid_data = data[np.isfinite(data)]
+    # Una sola pasada (histograma ajustado al rango de los datos para la mediana)
+    acumulador = AcumuladorEstadisticas(rango=None)
+    acumulador.agregar(data, None if nodata is None else data != nodata)
     
-    return {
-        "min": float(np.min(valid_data)),
-        "max": float(np.max(valid_data)),
-        "mean": float(np.mean(valid_data)),
-        "std": float(np.std(valid_data)),
-        "median": float(np.median(valid_data)),
-    }
+    return acumulador.resultado()
 
 
 def format_hectares(pixels: int, pixel_size: float = 10.0) -> float:
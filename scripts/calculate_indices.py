@@ -8,14 +8,26 @@ Este script calcula los 4 índices espectrales requeridos:
 - NDBI: Índice de Áreas Construidas
 - NDWI: Índice de Agua
 - BSI: Índice de Suelo Desnudo
+
+Otros índices del registro (SAVI, EVI, MNDWI, NDMI, ...) se pueden agregar
+con --indices; ver spectral_engine.REGISTRO_INDICES.
 """
 
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import rasterio
 import numpy as np
 import pandas as pd
 from pathlib import Path
 import matplotlib.pyplot as plt
 
+from pipeline_manifest import NOMBRE_MANIFIESTO, Manifiesto, version_codigo
+from raster_io import FILAS_VENTANA, iterar_ventanas, escribir_cog, escribir_nombres_bandas
+from spectral_engine import (BANDAS_SENTINEL2, INDICES_BASE, REGISTRO_INDICES, MotorIndices,
+                             bandas_requeridas)
+from streaming_stats import AcumuladorEstadisticas
+
 # =============================================================================
 # CONFIGURACIÓN
 # =============================================================================
@@ -24,11 +36,40 @@ INPUT_DIR = Path('data/raw')
 OUTPUT_DIR = Path('data/processed')
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Índices por defecto, en el orden de las bandas de salida
+NOMBRES_INDICES = list(INDICES_BASE)
+
+# Conversión DN -> reflectancia de Sentinel-2 L2A (reflectancia × 10000)
+ESCALA_DN = 1e-4
+
+# Valores sobre este umbral indican DN (la reflectancia está en 0-1)
+UMBRAL_DN = 1.5
+
+# Bloques leídos para decidir la escala de rasters float sin metadatos
+BLOQUES_MUESTRA = 16
+
+# Código del que dependen los productos de esta etapa (versión en el manifiesto)
+SCRIPTS_DIR = Path(__file__).resolve().parent
+ARCHIVOS_CODIGO = [SCRIPTS_DIR / nombre for nombre in
+                   ('calculate_indices.py', 'spectral_engine.py', 'raster_io.py', 'streaming_stats.py')]
+
 # =============================================================================
 # FUNCIONES
 # =============================================================================
 
-def calcular_indices(ruta_imagen, ruta_salida):
+def _nuevo_acumulador():
+    """
+    Acumulador de estadísticas de un índice.
+
+    El histograma usa rango automático en vez del rango de recorte del
+    registro: los índices registrados sin recorte (rango=None) no tienen
+    cotas conocidas, y así los parciales de distintas ventanas o procesos
+    siempre se pueden fusionar sin recortar valores.
+    """
+    return AcumuladorEstadisticas(rango=None)
+
+
+def calcular_indices(ruta_imagen, ruta_salida, nombres_indices=NOMBRES_INDICES):
     """
     Calcula índices espectrales para una imagen Sentinel-2.
     
@@ -43,6 +84,7 @@ def calcular_indices(ruta_imagen, ruta_salida):
     Args:
         ruta_imagen: Path a la imagen Sentinel-2
         ruta_salida: Path donde guardar los índices
+        nombres_indices: Índices del registro a calcular (orden de bandas)
         
     Returns:
         dict: Diccionario con arrays de cada índice y estadísticas
@@ -51,91 +93,279 @@ def calcular_indices(ruta_imagen, ruta_salida):
     print(f"  📂 Leyendo imagen: {ruta_imagen.name}")
     
     with rasterio.open(ruta_imagen) as src:
-        # Leer bandas
-        # Las imágenes de GEE ya vienen escaladas (0-1) si usamos .divide(10000)
-        # Si vienen como enteros DN, necesitamos escalar
-        blue = src.read(1).astype(float)
-        green = src.read(2).astype(float)
-        red = src.read(3).astype(float)
-        nir = src.read(4).astype(float)
-        swir = src.read(5).astype(float)
+        # Las imágenes de GEE ya vienen escaladas (0-1) si usamos .divide(10000);
+        # si vienen como enteros DN, el escalado se integra en el cálculo
+        motor = _crear_motor(src, nombres_indices)
         
-        # Verificar si necesitamos escalar (valores > 1 indican DN)
-        if np.nanmax(blue) > 1.5:
-            print("  ⚙️  Escalando valores de DN a reflectancia (0-1)")
-            blue = blue / 10000
-            green = green / 10000
-            red = red / 10000
-            nir = nir / 10000
-            swir = swir / 10000
+        # Leer solo las bandas requeridas, una vez, en su tipo original
+        # (el motor convierte a float32 dentro de cada operación)
+        bandas = src.read(_numeros_banda(motor))
         
         profile = src.profile
         bounds = src.bounds
         transform = src.transform
     
-    # Evitar división por cero
-    eps = 1e-10
-    
     print("  🧮 Calculando índices espectrales...")
     
-    # 1. NDVI (Vegetación): (NIR - Red) / (NIR + Red)
-    # Rango: -1 a 1 | >0.3 = vegetación saludable
-    ndvi = (nir - red) / (nir + red + eps)
-    
-    # 2. NDBI (Áreas construidas): (SWIR - NIR) / (SWIR + NIR)
-    # Rango: -1 a 1 | >0 = áreas urbanas/construidas
-    ndbi = (swir - nir) / (swir + nir + eps)
-    
-    # 3. NDWI (Agua): (Green - NIR) / (Green + NIR)
-    # Rango: -1 a 1 | >0 = agua
-    ndwi = (green - nir) / (green + nir + eps)
-    
-    # 4. BSI (Suelo desnudo): ((SWIR + Red) - (NIR + Blue)) / ((SWIR + Red) + (NIR + Blue))
-    # Rango: -1 a 1 | valores altos = suelo desnudo
-    bsi = ((swir + red) - (nir + blue)) / ((swir + red) + (nir + blue) + eps)
-    
-    # Aplicar máscaras para valores fuera de rango (-1 a 1)
-    indices = {
-        'ndvi': np.clip(ndvi, -1, 1),
-        'ndbi': np.clip(ndbi, -1, 1),
-        'ndwi': np.clip(ndwi, -1, 1),
-        'bsi': np.clip(bsi, -1, 1)
-    }
+    # Programa compilado: todos los índices en una pasada, en float32
+    salida = motor.calcular(**dict(zip(motor.bandas, bandas)))
+    del bandas
+    indices = dict(zip(motor.indices, salida))
     
     # Calcular estadísticas
+    # (una sola pasada por índice; la mediana se aproxima con el histograma)
     stats = {}
     for nombre, array in indices.items():
-        valid_data = array[np.isfinite(array)]
-        stats[nombre] = {
-            'mean': np.mean(valid_data),
-            'std': np.std(valid_data),
-            'min': np.min(valid_data),
-            'max': np.max(valid_data),
-            'median': np.median(valid_data)
-        }
+        acumulador = _nuevo_acumulador()
+        acumulador.agregar(array)
+        stats[nombre] = acumulador.resultado()
     
     # Guardar índices en un archivo multi-banda
     print(f"  💾 Guardando índices en: {ruta_salida.name}")
     
+    # COG teselado y comprimido con overviews (ver raster_io.escribir_cog)
+    with escribir_cog(ruta_salida, profile, count=len(motor.indices),
+                      dtype='float32', nodata=-9999) as dst:
+        dst.write(salida)
+        
+        # Registrar el nombre de cada banda (descripción + tags)
+        escribir_nombres_bandas(dst, motor.indices)
+    
+    return indices, stats
+
+
+def _numeros_banda(motor):
+    """Números de banda del archivo Sentinel-2 requeridos por el motor."""
+    return [BANDAS_SENTINEL2[banda] for banda in motor.bandas]
+
+
+def _detectar_escala(src, bandas):
+    """
+    Escala DN -> reflectancia de las bandas requeridas, sin recorrer la escena.
+    
+    Se decide, en orden, por:
+    1. Metadatos: scale/offset de banda (src.scales, src.offsets) o tags
+       `scale_factor` / `add_offset`.
+    2. Tipo de dato: bandas enteras son DN de Sentinel-2 (× 10000).
+    3. Rasters float sin metadatos: máximo de una muestra de bloques
+       repartidos por la banda (valores > 1.5 indican DN).
+    
+    Args:
+        src: Imagen Sentinel-2 abierta
+        bandas: Nombres de las bandas requeridas (ver BANDAS_SENTINEL2)
+        
+    Returns:
+        tuple: ({banda: (escala, desplazamiento)} o None, origen de la decisión)
+    """
+    escala = {}
+    for banda in bandas:
+        numero = BANDAS_SENTINEL2[banda]
+        tags = {clave.lower(): valor for clave, valor in src.tags(numero).items()}
+        factor = float(tags.get('scale_factor', src.scales[numero - 1]))
+        desplazamiento = float(tags.get('add_offset', src.offsets[numero - 1]))
+        if (factor, desplazamiento) != (1.0, 0.0):
+            escala[banda] = (factor, desplazamiento)
+    if escala:
+        return escala, 'metadatos scale/offset'
+    
+    if np.issubdtype(np.dtype(src.dtypes[0]), np.integer):
+        return {banda: (ESCALA_DN, 0.0) for banda in bandas}, f'tipo de dato {src.dtypes[0]}'
+    
+    # Muestra dispersa de bloques de la primera banda requerida
+    numero = BANDAS_SENTINEL2[bandas[0]]
+    bloques = [ventana for _, ventana in src.block_windows(numero)]
+    paso = max(1, len(bloques) // BLOQUES_MUESTRA)
+    maximo = max(
+        np.nanmax(src.read(numero, window=ventana), initial=-np.inf)
+        for ventana in bloques[::paso]
+    )
+    if maximo > UMBRAL_DN:
+        return {banda: (ESCALA_DN, 0.0) for banda in bandas}, 'muestra de bloques'
+    return None, 'muestra de bloques'
+
+
+def _crear_motor(src, nombres_indices):
+    """Motor de índices con el escalado DN -> reflectancia de `src` integrado."""
+    escala, origen = _detectar_escala(src, bandas_requeridas(nombres_indices))
+    if escala:
+        print(f"  ⚙️  Escalando valores de DN a reflectancia (0-1) "
+              f"según {origen} (integrado en las fórmulas)")
+    return MotorIndices(nombres_indices, escala=escala)
+
+
+def _perfil_salida(src, n_indices):
+    """Perfil del GeoTIFF de índices a partir del perfil de la imagen."""
+    profile = src.profile.copy()
     profile.update(
-        count=4,
+        count=n_indices,
         dtype='float32',
         nodata=-9999
     )
+    return profile
+
+
+def _indices_ventana(src, ventana, motor):
+    """
+    Lee las bandas requeridas de una ventana y retorna sus índices.
     
-    with rasterio.open(ruta_salida, 'w', **profile) as dst:
-        dst.write(indices['ndvi'].astype('float32'), 1)
-        dst.write(indices['ndbi'].astype('float32'), 2)
-        dst.write(indices['ndwi'].astype('float32'), 3)
-        dst.write(indices['bsi'].astype('float32'), 4)
+    Retorna un array float32 (n_indices, filas, columnas) que es una vista
+    de los buffers de `motor` y se sobrescribe en la siguiente ventana.
+    """
+    bandas = src.read(_numeros_banda(motor), window=ventana)
+    return motor.calcular(**dict(zip(motor.bandas, bandas)))
+
+
+def calcular_indices_streaming(ruta_imagen, ruta_salida, filas_ventana=FILAS_VENTANA,
+                               nombres_indices=NOMBRES_INDICES):
+    """
+    Calcula índices espectrales procesando la imagen por ventanas.
+    
+    Cada franja de `filas_ventana` filas se lee, se transforma en los
+    índices solicitados y se escribe directamente en el GeoTIFF de salida, por lo que
+    la memoria máxima depende del tamaño de la ventana y no de la escena.
+    Las estadísticas se acumulan ventana a ventana (ver streaming_stats.AcumuladorEstadisticas).
+    
+    Args:
+        ruta_imagen: Path a la imagen Sentinel-2
+        ruta_salida: Path donde guardar los índices
+        filas_ventana: Número de filas por ventana
+        nombres_indices: Índices del registro a calcular (orden de bandas)
         
-        # Agregar descripciones a las bandas
-        dst.set_band_description(1, 'NDVI')
-        dst.set_band_description(2, 'NDBI')
-        dst.set_band_description(3, 'NDWI')
-        dst.set_band_description(4, 'BSI')
+    Returns:
+        dict: Estadísticas de cada índice (mismo formato que calcular_indices)
+    """
     
-    return indices, stats
+    print(f"  📂 Leyendo imagen por ventanas: {ruta_imagen.name}")
+    
+    with rasterio.open(ruta_imagen) as src:
+        motor = _crear_motor(src, nombres_indices)
+        
+        acumuladores = {nombre: _nuevo_acumulador() for nombre in motor.indices}
+        
+        print(f"  🧮 Calculando índices espectrales (ventanas de {filas_ventana} filas)...")
+        print(f"  💾 Guardando índices en: {ruta_salida.name}")
+        
+        with escribir_cog(ruta_salida, _perfil_salida(src, len(motor.indices))) as dst:
+            for ventana in iterar_ventanas(src, filas_ventana):
+                bloque = _indices_ventana(src, ventana, motor)
+                dst.write(bloque, window=ventana)
+                
+                for nombre, valores in zip(motor.indices, bloque):
+                    acumuladores[nombre].agregar(valores)
+            
+            escribir_nombres_bandas(dst, motor.indices)
+    
+    stats = {nombre: acc.resultado() for nombre, acc in acumuladores.items()}
+    return stats
+
+
+# =============================================================================
+# PROCESAMIENTO PARALELO
+# =============================================================================
+
+# Datasets y motores de cada proceso trabajador (uno por imagen / por índices y escala)
+_DATASETS_TRABAJADOR = {}
+_MOTORES_TRABAJADOR = {}
+
+
+def _trabajo_ventana(ruta_imagen, ventana, escala, nombres_indices):
+    """
+    Tarea de un proceso trabajador: índices y estadísticas de una ventana.
+    
+    Retorna la ventana, un array float32 (n_indices, filas, columnas) listo
+    para escribir y los acumuladores parciales de cada índice.
+    """
+    src = _DATASETS_TRABAJADOR.get(ruta_imagen)
+    if src is None:
+        src = _DATASETS_TRABAJADOR[ruta_imagen] = rasterio.open(ruta_imagen)
+    clave = (nombres_indices, tuple(sorted(escala.items())) if escala else None)
+    motor = _MOTORES_TRABAJADOR.get(clave)
+    if motor is None:
+        motor = _MOTORES_TRABAJADOR[clave] = MotorIndices(nombres_indices, escala=escala)
+    
+    bloque = _indices_ventana(src, ventana, motor)
+    acumuladores = {}
+    for nombre, valores in zip(motor.indices, bloque):
+        acumuladores[nombre] = _nuevo_acumulador()
+        acumuladores[nombre].agregar(valores)
+    
+    return ventana, bloque, acumuladores
+
+
+def calcular_indices_paralelo(ruta_imagen, ruta_salida, executor, n_workers,
+                              filas_ventana=FILAS_VENTANA, nombres_indices=NOMBRES_INDICES):
+    """
+    Calcula índices de una imagen repartiendo sus ventanas entre procesos.
+    
+    Los trabajadores calculan cada ventana y el proceso principal escribe
+    los resultados en orden y fusiona las estadísticas parciales. Se
+    mantienen como máximo 2 × n_workers ventanas en vuelo para que la
+    memoria siga acotada por el tamaño de ventana.
+    
+    Args:
+        ruta_imagen: Path a la imagen Sentinel-2
+        ruta_salida: Path donde guardar los índices
+        executor: ProcessPoolExecutor compartido
+        n_workers: Número de procesos del pool
+        filas_ventana: Número de filas por ventana
+        nombres_indices: Índices del registro a calcular (orden de bandas)
+        
+    Returns:
+        dict: Estadísticas de cada índice (mismo formato que calcular_indices)
+    """
+    
+    print(f"  📂 Leyendo imagen por ventanas ({n_workers} procesos): {ruta_imagen.name}")
+    
+    nombres_indices = tuple(nombres_indices)
+    
+    with rasterio.open(ruta_imagen) as src:
+        motor = _crear_motor(src, nombres_indices)
+        profile = _perfil_salida(src, len(nombres_indices))
+        ventanas = list(iterar_ventanas(src, filas_ventana))
+    
+    acumuladores = {nombre: _nuevo_acumulador() for nombre in motor.indices}
+    
+    print(f"  💾 Guardando índices en: {ruta_salida.name}")
+    
+    with escribir_cog(ruta_salida, profile) as dst:
+        pendientes = deque()
+        restantes = iter(ventanas)
+        
+        for ventana in restantes:
+            pendientes.append(executor.submit(_trabajo_ventana, ruta_imagen, ventana,
+                                              motor.escala, nombres_indices))
+            if len(pendientes) >= 2 * n_workers:
+                break
+        
+        while pendientes:
+            ventana, bloque, parciales = pendientes.popleft().result()
+            dst.write(bloque, window=ventana)
+            for nombre, parcial in parciales.items():
+                acumuladores[nombre].fusionar(parcial)
+            
+            siguiente = next(restantes, None)
+            if siguiente is not None:
+                pendientes.append(executor.submit(_trabajo_ventana, ruta_imagen, siguiente,
+                                                  motor.escala, nombres_indices))
+        
+        escribir_nombres_bandas(dst, motor.indices)
+    
+    stats = {nombre: acc.resultado() for nombre, acc in acumuladores.items()}
+    return stats
+
+
+def procesar_imagen(ruta_imagen, ruta_salida, streaming=False, filas_ventana=FILAS_VENTANA,
+                    nombres_indices=NOMBRES_INDICES):
+    """
+    Procesa una imagen completa y retorna solo sus estadísticas.
+    
+    Punto de entrada usado por el pool cuando se reparten años entre
+    procesos (los arrays de índices no se devuelven al proceso principal).
+    """
+    if streaming:
+        return calcular_indices_streaming(ruta_imagen, ruta_salida, filas_ventana, nombres_indices)
+    _, stats = calcular_indices(ruta_imagen, ruta_salida, nombres_indices)
+    return stats
 
 
 def print_statistics(year, stats):
@@ -174,6 +404,29 @@ def create_summary_table(all_stats):
 def main():
     """Función principal de procesamiento."""
     
+    parser = argparse.ArgumentParser(description='Cálculo de índices espectrales (Fase 2)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Procesar cada imagen por ventanas (memoria acotada)')
+    parser.add_argument('--filas-ventana', type=int, default=FILAS_VENTANA,
+                        help=f'Filas por ventana en modo streaming (default: {FILAS_VENTANA})')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Número de procesos para repartir años/ventanas (default: 1)')
+    parser.add_argument('--indices', default=','.join(NOMBRES_INDICES),
+                        help='Índices a calcular, separados por coma '
+                             f'(disponibles: {", ".join(REGISTRO_INDICES)})')
+    parser.add_argument('--forzar', action='store_true',
+                        help='Recalcular aunque el manifiesto indique que los productos están al día')
+    args = parser.parse_args()
+    
+    nombres_indices = tuple(nombre.strip().lower() for nombre in args.indices.split(','))
+    desconocidos = [nombre for nombre in nombres_indices if nombre not in REGISTRO_INDICES]
+    if desconocidos:
+        parser.error(f"Índices no registrados: {', '.join(desconocidos)}")
+    faltantes_base = [nombre for nombre in INDICES_BASE if nombre not in nombres_indices]
+    if faltantes_base:
+        print(f"⚠️  Sin {', '.join(n.upper() for n in faltantes_base)}: "
+              "las fases siguientes requieren NDVI, NDBI, NDWI y BSI")
+    
     print("=" * 60)
     print("🧮  CÁLCULO DE ÍNDICES ESPECTRALES")
     print("    Fase 2: Procesamiento de Imágenes")
@@ -191,24 +444,78 @@ def main():
     for img in imagenes:
         print(f"   - {img.name}")
     
+    # Omitir los años cuyo producto está al día (misma imagen, índices y código)
+    manifiesto = Manifiesto(OUTPUT_DIR / NOMBRE_MANIFIESTO, forzar=args.forzar)
+    codigo = version_codigo(*ARCHIVOS_CODIGO)
+    
     # Procesar cada imagen
     all_stats = {}
-    
+    huellas = {}
+    tareas = []
     for img_path in imagenes:
         # Extraer año del nombre del archivo
         year = img_path.stem.split('_')[1]
         output_path = OUTPUT_DIR / f'indices_{year}.tif'
-        
-        print(f"\n{'='*60}")
-        print(f"⏳ Procesando año {year}...")
-        print(f"{'='*60}")
-        
-        # Calcular índices
-        indices, stats = calcular_indices(img_path, output_path)
-        all_stats[year] = stats
-        
-        # Mostrar estadísticas
-        print_statistics(year, stats)
+        huellas[year] = manifiesto.huella([img_path], {'indices': nombres_indices}, codigo)
+        if manifiesto.actualizado(output_path.name, huellas[year], [output_path]):
+            print(f"   ✓ {output_path.name} al día (sin cambios en entradas/parámetros/código)")
+            all_stats[year] = manifiesto.datos(output_path.name)
+            continue
+        tareas.append((year, img_path, output_path))
+    
+    def registrar(year, output_path, stats):
+        manifiesto.registrar(output_path.name, huellas[year], [output_path], datos=stats)
+        manifiesto.guardar()
+    
+    if args.workers > 1 and len(tareas) >= args.workers:
+        # Años independientes: un año por proceso
+        print(f"\n⚡ Procesando {len(tareas)} años en paralelo ({args.workers} procesos)...")
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futuros = [
+                executor.submit(procesar_imagen, img_path, output_path,
+                                args.streaming, args.filas_ventana, nombres_indices)
+                for _, img_path, output_path in tareas
+            ]
+            # Se recogen en el orden original para conservar el orden del CSV
+            for (year, _, output_path), futuro in zip(tareas, futuros):
+                all_stats[year] = futuro.result()
+                registrar(year, output_path, all_stats[year])
+                print_statistics(year, all_stats[year])
+    
+    elif args.workers > 1:
+        # Menos años que procesos: se reparten las ventanas de cada escena
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for year, img_path, output_path in tareas:
+                print(f"\n{'='*60}")
+                print(f"⏳ Procesando año {year}...")
+                print(f"{'='*60}")
+                
+                stats = calcular_indices_paralelo(img_path, output_path, executor,
+                                                  args.workers, args.filas_ventana,
+                                                  nombres_indices)
+                all_stats[year] = stats
+                registrar(year, output_path, stats)
+                print_statistics(year, stats)
+    
+    else:
+        for year, img_path, output_path in tareas:
+            print(f"\n{'='*60}")
+            print(f"⏳ Procesando año {year}...")
+            print(f"{'='*60}")
+            
+            # Calcular índices
+            if args.streaming:
+                stats = calcular_indices_streaming(img_path, output_path, args.filas_ventana,
+                                                   nombres_indices)
+            else:
+                indices, stats = calcular_indices(img_path, output_path, nombres_indices)
+            all_stats[year] = stats
+            registrar(year, output_path, stats)
+            
+            # Mostrar estadísticas
+            print_statistics(year, stats)
+    
+    all_stats = dict(sorted(all_stats.items()))
     
     # Crear tabla resumen
     print(f"\n{'='*60}")
@@ -228,6 +535,10 @@ def main():
     print("📊 ANÁLISIS DE TENDENCIAS")
     print(f"{'='*60}\n")
     
+    if 'ndvi' not in nombres_indices or 'ndbi' not in nombres_indices:
+        print("⚠️  Tendencias omitidas: requieren NDVI y NDBI")
+        return
+    
     # Calcular tendencias de NDVI y NDBI (indicadores clave)
     ndvi_means = [all_stats[y]['ndvi']['mean'] for y in sorted(all_stats.keys())]
     ndbi_means = [all_stats[y]['ndbi']['mean'] for y in sorted(all_stats.keys())]
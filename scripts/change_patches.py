@@ -0,0 +1,253 @@
+"""
+Parches de Cambio por Franjas
+Proyecto: Detección de Cambios Urbanos - Peñaflor
+
+Etiquetado de componentes conexas (parches) de un mapa de cambio
+clasificado recorriéndolo por franjas horizontales, sin cargar la escena
+completa:
+
+1. Cada franja se etiqueta por separado (scipy.ndimage.label, una vez por
+   clase, de modo que un parche nunca mezcla clases) y se acumulan las
+   estadísticas de cada etiqueta local: píxeles, área (ha), suma de
+   filas/columnas (centroide), caja envolvente y suma de una variable
+   auxiliar (ΔNDBI).
+2. En cada costura entre franjas se registran los pares de etiquetas que
+   se tocan (misma clase, vecindad 4 u 8).
+3. Al terminar, las etiquetas unidas por costuras se resuelven como
+   componentes conexas de un grafo disperso y sus estadísticas se
+   combinan en una tabla por parche.
+4. Una segunda pasada vuelve a etiquetar cada franja (el etiquetado es
+   determinista) y elimina los parches bajo la unidad mínima de mapeo
+   (en píxeles o en hectáreas).
+
+La memoria depende del número de etiquetas, no del tamaño de la escena.
+"""
+
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# Estructuras de vecindad de scipy.ndimage.label
+_ESTRUCTURAS = {
+    4: ndimage.generate_binary_structure(2, 1),
+    8: ndimage.generate_binary_structure(2, 2),
+}
+
+
+def _reducir(ufunc, grupos, valores, n_grupos):
+    """Reducción por grupo (min/max) con un ordenamiento y `reduceat`."""
+    orden = np.argsort(grupos, kind='stable')
+    inicios = np.searchsorted(grupos[orden], np.arange(n_grupos))
+    return ufunc.reduceat(valores[orden], inicios)
+
+
+class ParchesCambio:
+    """
+    Parches conexos de un raster de clases, acumulados franja a franja.
+
+    Uso:
+        parches = ParchesCambio(clases=[1, 2, 3])
+        for ventana in ventanas:                       # pasada 1
+            parches.agregar(clase, ventana.row_off, delta)
+        tabla = parches.resolver()
+        for i, ventana in enumerate(ventanas):         # pasada 2
+            filtrada = parches.filtrar(clase, i, min_area=0.05)
+
+    Parámetros:
+    -----------
+    clases : iterable of int
+        Clases que forman parches (el resto, ej: 'Sin cambio' y nodata, se
+        considera fondo)
+    conectividad : int
+        4 u 8 vecinos
+    """
+
+    def __init__(self, clases, conectividad=8):
+        if conectividad not in _ESTRUCTURAS:
+            raise ValueError(f"Conectividad no soportada: {conectividad} (usar 4 u 8)")
+        self.clases = [int(c) for c in clases]
+        self.conectividad = conectividad
+        self.n_etiquetas = 0
+        self.desplazamientos = []
+        self._bloques = []
+        self._uniones = []
+        self._borde_inferior = None
+        self.componente = None
+        self.pixeles = None
+        self.area = None
+
+    def etiquetar(self, clase):
+        """
+        Etiquetas locales de una franja (0 = fondo), clase por clase.
+
+        Retorna:
+        --------
+        etiquetas : ndarray int64
+            Etiquetas 1..n de la franja
+        n : int
+            Número de etiquetas
+        """
+        etiquetas = np.zeros(clase.shape, dtype=np.int64)
+        n = 0
+        for c in self.clases:
+            locales, n_clase = ndimage.label(clase == c, structure=_ESTRUCTURAS[self.conectividad])
+            if n_clase:
+                mascara = locales > 0
+                etiquetas[mascara] = locales[mascara] + n
+                n += n_clase
+        return etiquetas, n
+
+    def agregar(self, clase, fila_inicio, auxiliar=None, area=None):
+        """
+        Pasada 1: etiqueta una franja y acumula sus estadísticas.
+
+        Las franjas deben llegar en orden, de arriba hacia abajo y de ancho
+        completo (ver raster_io.iterar_ventanas).
+
+        Args:
+            clase: array 2D con la clase de cada píxel de la franja
+            fila_inicio: fila de la escena donde empieza la franja
+            auxiliar: array 2D opcional (ej: ΔNDBI) promediado por parche;
+                los NaN se ignoran
+            area: área (ha) de cada píxel, o columna (filas, 1) por
+                broadcasting (ver raster_io.area_ventana); sin ella el
+                área de los parches queda en 0
+        """
+        etiquetas, n = self.etiquetar(clase)
+        desplazamiento = self.n_etiquetas
+        self.desplazamientos.append(desplazamiento)
+        globales = np.where(etiquetas > 0, etiquetas + desplazamiento, 0)
+
+        # Costura con la franja anterior: pares de etiquetas que se tocan
+        if self._borde_inferior is not None:
+            self._unir_costura(*self._borde_inferior, globales[0], clase[0])
+        self._borde_inferior = (globales[-1].copy(), clase[-1].copy())
+
+        if n:
+            posiciones = np.flatnonzero(etiquetas)
+            grupos = etiquetas.ravel()[posiciones] - 1
+            filas, columnas = np.divmod(posiciones, clase.shape[1])
+            filas = filas + fila_inicio
+
+            bloque = {
+                'clase': np.zeros(n, dtype=np.uint8),
+                'pixeles': np.bincount(grupos, minlength=n),
+                'area': np.zeros(n),
+                'suma_fila': np.bincount(grupos, weights=filas, minlength=n),
+                'suma_columna': np.bincount(grupos, weights=columnas, minlength=n),
+                'fila_min': _reducir(np.minimum, grupos, filas, n),
+                'fila_max': _reducir(np.maximum, grupos, filas, n),
+                'columna_min': _reducir(np.minimum, grupos, columnas, n),
+                'columna_max': _reducir(np.maximum, grupos, columnas, n),
+                'suma_auxiliar': np.zeros(n),
+                'n_auxiliar': np.zeros(n, dtype=np.int64),
+            }
+            bloque['clase'][grupos] = clase.ravel()[posiciones]
+            if area is not None:
+                pesos = np.broadcast_to(area, clase.shape).ravel()[posiciones]
+                bloque['area'] = np.bincount(grupos, weights=pesos, minlength=n)
+            if auxiliar is not None:
+                valores = auxiliar.ravel()[posiciones].astype(np.float64)
+                valido = ~np.isnan(valores)
+                bloque['suma_auxiliar'] = np.bincount(grupos[valido], weights=valores[valido],
+                                                      minlength=n)
+                bloque['n_auxiliar'] = np.bincount(grupos[valido], minlength=n)
+            self._bloques.append(bloque)
+
+        self.n_etiquetas += n
+
+    def _unir_costura(self, arriba, clase_arriba, abajo, clase_abajo):
+        """Registra las etiquetas de igual clase que cruzan una costura."""
+        pares = [(slice(None), slice(None))]
+        if self.conectividad == 8:
+            pares += [(slice(None, -1), slice(1, None)), (slice(1, None), slice(None, -1))]
+        for sa, sb in pares:
+            a, b = arriba[sa], abajo[sb]
+            tocan = (a > 0) & (b > 0) & (clase_arriba[sa] == clase_abajo[sb])
+            self._uniones.append(np.stack([a[tocan], b[tocan]]))
+
+    def resolver(self):
+        """
+        Une las etiquetas conectadas por costuras y combina sus estadísticas.
+
+        Retorna:
+        --------
+        dict de arrays (uno por parche, ordenados por parche_id):
+            parche_id, clase, pixeles, area, fila_min, fila_max,
+            columna_min, columna_max, fila_media, columna_media,
+            auxiliar_media
+        """
+        n = self.n_etiquetas
+        uniones = (np.concatenate(self._uniones, axis=1) - 1 if self._uniones
+                   else np.zeros((2, 0), dtype=np.int64))
+        grafo = coo_matrix((np.ones(uniones.shape[1], dtype=np.int8), (uniones[0], uniones[1])),
+                           shape=(n, n))
+        n_parches, self.componente = connected_components(grafo, directed=False)
+
+        bloques = {clave: np.concatenate([b[clave] for b in self._bloques])
+                   if self._bloques else np.zeros(0)
+                   for clave in ('clase', 'pixeles', 'area', 'suma_fila', 'suma_columna', 'fila_min',
+                                 'fila_max', 'columna_min', 'columna_max', 'suma_auxiliar',
+                                 'n_auxiliar')}
+        comp = self.componente
+
+        def sumar(clave):
+            return np.bincount(comp, weights=bloques[clave], minlength=n_parches)
+
+        self.pixeles = sumar('pixeles').astype(np.int64)
+        self.area = sumar('area')
+        clase = np.zeros(n_parches, dtype=np.uint8)
+        clase[comp] = bloques['clase']
+        n_auxiliar = sumar('n_auxiliar')
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            auxiliar_media = sumar('suma_auxiliar') / n_auxiliar
+
+        return {
+            'parche_id': np.arange(1, n_parches + 1),
+            'clase': clase,
+            'pixeles': self.pixeles,
+            'area': self.area,
+            'fila_min': _reducir(np.minimum, comp, bloques['fila_min'], n_parches).astype(np.int64),
+            'fila_max': _reducir(np.maximum, comp, bloques['fila_max'], n_parches).astype(np.int64),
+            'columna_min': _reducir(np.minimum, comp, bloques['columna_min'], n_parches).astype(np.int64),
+            'columna_max': _reducir(np.maximum, comp, bloques['columna_max'], n_parches).astype(np.int64),
+            'fila_media': sumar('suma_fila') / self.pixeles,
+            'columna_media': sumar('suma_columna') / self.pixeles,
+            'auxiliar_media': auxiliar_media,
+        }
+
+    def filtrar(self, clase, indice_franja, min_pixeles=0, fondo=0, min_area=0):
+        """
+        Pasada 2: elimina de una franja los parches con menos de
+        `min_pixeles` o de `min_area` hectáreas (se asignan a la clase
+        `fondo`).
+
+        Args:
+            clase: la misma franja entregada a `agregar`
+            indice_franja: posición de la franja en la pasada 1
+            min_pixeles: unidad mínima de mapeo en píxeles
+            fondo: clase asignada a los parches eliminados
+            min_area: unidad mínima de mapeo en hectáreas (requiere el
+                área en `agregar`)
+
+        Returns:
+            Copia de `clase` filtrada
+        """
+        if self.componente is None:
+            raise RuntimeError("Llamar a resolver() antes de filtrar()")
+        etiquetas, _ = self.etiquetar(clase)
+        mascara = etiquetas > 0
+        globales = etiquetas[mascara] + self.desplazamientos[indice_franja] - 1
+        componente = self.componente[globales]
+        # Tolerancia relativa: 5 × 0.01 ha sumados en float no deben quedar bajo 0.05 ha
+        pequeno = ((self.pixeles[componente] < min_pixeles)
+                   | (self.area[componente] < min_area * (1 - 1e-9)))
+
+        eliminar = np.zeros(clase.shape, dtype=bool)
+        eliminar[mascara] = pequeno
+
+        filtrada = clase.copy()
+        filtrada[eliminar] = fondo
+        return filtrada
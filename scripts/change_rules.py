@@ -0,0 +1,326 @@
+"""
+Motor de Reglas de Cambio
+Proyecto: Detección de Cambios Urbanos - Peñaflor
+
+Clasificación de cambio por tabla de consulta (LUT). Cada condición de una
+regla (ej: "NDVI del año inicial > 0.3") se evalúa una sola vez y se guarda
+como un bit de un código entero por píxel; una tabla precalculada traduce
+cada código posible a su clase de cambio.
+
+Condiciones y reglas son configuración, no código:
+
+    CONDICIONES = [
+        # (nombre, índice, término, operador, umbral)
+        ('era_vegetacion', 'ndvi', 't1', '>', 'ndvi_veg'),
+        ('aumento_ndbi', 'ndbi', 'delta', '>', 'cambio_min'),
+        ...
+    ]
+    REGLAS = [
+        # (clase, condiciones que deben cumplirse), en orden de prioridad
+        (1, ('era_vegetacion', 'es_urbano', 'aumento_ndbi')),
+        ...
+    ]
+
+Términos: 't1' (año inicial), 't2' (año final), 'delta' (t2 - t1) y
+'caida' (t1 - t2). El umbral es un número o una clave del diccionario de
+umbrales. A cada píxel se le asigna la primera regla que cumple; si no
+cumple ninguna queda en la clase 0.
+
+La clasificación es una sola pasada con memoria fija: el código (uint16) y
+la condición en evaluación, en vez de una máscara por condición.
+
+BarridoUmbrales reutiliza la misma tabla para el análisis de sensibilidad:
+acumula una sola vez un histograma conjunto de los términos cuyos umbrales
+se quieren calibrar, con los umbrales candidatos como bordes de bin. Dentro
+de cada celda del histograma todas las condiciones tienen un valor fijo,
+así que la superficie por clase de cualquier combinación de umbrales se
+obtiene evaluando la tabla sobre las celdas, sin volver a leer los rasters.
+"""
+
+import itertools
+import operator
+
+import numpy as np
+
+_COMPARADORES = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+_TERMINOS = ('t1', 't2', 'delta', 'caida')
+
+# Operador equivalente al cambiar el signo del término (caida = -delta)
+_INVERSOS = {'>': '<', '>=': '<=', '<': '>', '<=': '>='}
+
+# Bits disponibles en el código por píxel (uint16)
+MAX_CONDICIONES = 16
+
+
+def _termino(bandas_t1, bandas_t2, indice, termino):
+    """Valor de un término de condición ('t1', 't2', 'delta' o 'caida')."""
+    if termino == 't1':
+        return bandas_t1[indice]
+    if termino == 't2':
+        return bandas_t2[indice]
+    if termino == 'delta':
+        return bandas_t2[indice] - bandas_t1[indice]
+    return bandas_t1[indice] - bandas_t2[indice]
+
+
+class MotorReglas:
+    """
+    Clasificador de cambio compilado a una tabla de consulta.
+
+    Parámetros:
+    -----------
+    condiciones : list of tuple
+        (nombre, índice, término, operador, umbral); el bit de cada
+        condición es su posición en la lista
+    reglas : list of tuple
+        (clase, nombres de condiciones), en orden de prioridad
+    umbrales : dict
+        Valores para los umbrales dados como clave
+    clase_nodata : int
+        Clase asignada a los píxeles sin datos
+    """
+
+    def __init__(self, condiciones, reglas, umbrales=None, clase_nodata=255):
+        if len(condiciones) > MAX_CONDICIONES:
+            raise ValueError(f"Máximo {MAX_CONDICIONES} condiciones por motor de reglas")
+        umbrales = umbrales or {}
+        self.clase_nodata = clase_nodata
+        self.condiciones = []
+        bits = {}
+        for bit, (nombre, indice, termino, op, umbral) in enumerate(condiciones):
+            if termino not in _TERMINOS:
+                raise ValueError(f"Término desconocido en '{nombre}': {termino}")
+            if op not in _COMPARADORES:
+                raise ValueError(f"Operador desconocido en '{nombre}': {op}")
+            valor = umbrales[umbral] if isinstance(umbral, str) else umbral
+            self.condiciones.append((nombre, indice.lower(), termino, op, float(valor)))
+            bits[nombre] = bit
+        self.reglas = []
+        for clase, requeridas in reglas:
+            faltantes = [c for c in requeridas if c not in bits]
+            if faltantes:
+                raise ValueError(f"Regla de clase {clase} usa condiciones no definidas: {faltantes}")
+            self.reglas.append((clase, tuple(requeridas)))
+        self.tabla = self._compilar(bits)
+
+    def _compilar(self, bits):
+        """Tabla código -> clase: primera regla cuyas condiciones están todas activas."""
+        codigos = np.arange(1 << len(self.condiciones), dtype=np.uint32)
+        tabla = np.zeros(codigos.size, dtype=np.uint8)
+        asignado = np.zeros(codigos.size, dtype=bool)
+        for clase, requeridas in self.reglas:
+            mascara = sum(1 << bits[c] for c in requeridas)
+            cumple = ((codigos & mascara) == mascara) & ~asignado
+            tabla[cumple] = clase
+            asignado |= cumple
+        return tabla
+
+    @property
+    def indices(self):
+        """Índices espectrales que leen las condiciones, en orden de aparición."""
+        return list(dict.fromkeys(indice for _, indice, *_ in self.condiciones))
+
+    def codigo(self, bandas_t1, bandas_t2):
+        """
+        Código de bits por píxel (bit i = condición i cumplida).
+
+        Parámetros:
+        -----------
+        bandas_t1, bandas_t2 : dict
+            {índice: array} de cada año (ver indices)
+
+        Retorna:
+        --------
+        array uint16
+        """
+        codigo = None
+        for bit, (_, indice, termino, op, valor) in enumerate(self.condiciones):
+            cumple = _COMPARADORES[op](_termino(bandas_t1, bandas_t2, indice, termino), valor)
+            if codigo is None:
+                codigo = np.zeros(cumple.shape, dtype=np.uint16)
+            codigo |= cumple.astype(np.uint16) << bit
+        return codigo
+
+    def clasificar(self, bandas_t1, bandas_t2, mask_valido=None):
+        """
+        Clase de cambio por píxel en una pasada (código -> tabla).
+
+        Parámetros:
+        -----------
+        bandas_t1, bandas_t2 : dict
+            {índice: array} de cada año
+        mask_valido : array bool, optional
+            Píxeles con datos; el resto recibe `clase_nodata`
+
+        Retorna:
+        --------
+        array uint8
+        """
+        clase = self.tabla[self.codigo(bandas_t1, bandas_t2)]
+        if mask_valido is not None:
+            clase[~mask_valido] = self.clase_nodata
+        return clase
+
+
+def indice_bin(valores, bordes):
+    """
+    Bin de cada valor respecto de bordes ordenados, distinguiendo empates.
+
+    Retorna 2k si bordes[k-1] < valor < bordes[k] y 2k+1 si valor == bordes[k]
+    (2·len(bordes) + 1 bins), de modo que las comparaciones >, >=, <, <=
+    contra cualquier borde se resuelven exactamente por bin.
+    """
+    return (np.searchsorted(bordes, valores, side='left')
+            + np.searchsorted(bordes, valores, side='right'))
+
+
+def bins_que_cumplen(n_bordes, op, j):
+    """Máscara de los bins de indice_bin que cumplen `valor op bordes[j]`."""
+    bins = np.arange(2 * n_bordes + 1)
+    limite = {'>': 2 * j + 2, '>=': 2 * j + 1, '<': 2 * j, '<=': 2 * j + 1}[op]
+    return bins >= limite if op in ('>', '>=') else bins <= limite
+
+
+class BarridoUmbrales:
+    """
+    Superficie por clase para una grilla de combinaciones de umbrales.
+
+    Las condiciones cuyo umbral es una clave de `grilla` definen los ejes
+    del histograma (un eje por término, ej: ΔNDVI, ΔNDBI, NDVI_t1, NDBI_t2;
+    'caida' comparte el eje de 'delta' con el signo cambiado). El resto de
+    las condiciones mantiene su umbral y se guarda como un código de bits
+    adicional por celda.
+
+    Parámetros:
+    -----------
+    condiciones, reglas : list
+        Configuración del motor de reglas (ver MotorReglas)
+    umbrales : dict
+        Umbrales de las condiciones que no se barren
+    grilla : dict
+        {clave de umbral: valores candidatos}
+    """
+
+    def __init__(self, condiciones, reglas, umbrales, grilla):
+        self.motor = MotorReglas(condiciones, reglas, umbrales)
+        self.grilla = {clave: [float(v) for v in valores] for clave, valores in grilla.items()}
+        self.ejes = []         # (índice, término) de cada eje del histograma
+        self.barridas = []     # (bit, eje, operador, clave, signo)
+        self.fijas = []        # bits de las condiciones con umbral fijo
+        for bit, (nombre, indice, termino, op, umbral) in enumerate(condiciones):
+            if not (isinstance(umbral, str) and umbral in self.grilla):
+                self.fijas.append(bit)
+                continue
+            signo = 1
+            if termino == 'caida':
+                termino, op, signo = 'delta', _INVERSOS[op], -1
+            eje = (indice.lower(), termino)
+            if eje not in self.ejes:
+                self.ejes.append(eje)
+            self.barridas.append((bit, self.ejes.index(eje), op, umbral, signo))
+        if len(self.fijas) > 8:
+            raise ValueError("Máximo 8 condiciones con umbral fijo en el barrido")
+
+        # Bordes de cada eje: todos los umbrales candidatos (float32, como se
+        # comparan contra las bandas) de las condiciones sobre ese eje
+        self.bordes = []
+        for i in range(len(self.ejes)):
+            valores = {np.float32(signo * v) for _, eje, _, clave, signo in self.barridas
+                       if eje == i for v in self.grilla[clave]}
+            self.bordes.append(np.array(sorted(valores), dtype=np.float32))
+        self.forma = tuple(2 * len(b) + 1 for b in self.bordes) + (1 << len(self.fijas),)
+
+        # Celdas no vacías del histograma (índice plano), su conteo y su
+        # superficie (ha, si se entrega el área de los píxeles)
+        self.celdas = np.zeros(0, dtype=np.int64)
+        self.conteos = np.zeros(0, dtype=np.int64)
+        self.areas = np.zeros(0, dtype=np.float64)
+
+    def agregar(self, bandas_t1, bandas_t2, mask_valido, area=None):
+        """
+        Incorpora un bloque al histograma conjunto.
+
+        Parámetros:
+        -----------
+        bandas_t1, bandas_t2 : dict
+            {índice: array} de cada año
+        mask_valido : array bool
+            Píxeles con datos
+        area : array, optional
+            Área (ha) de cada píxel o columna (filas, 1) por broadcasting;
+            si se omite, la superficie de cada celda queda en 0
+        """
+        indices = []
+        for (indice, termino), bordes in zip(self.ejes, self.bordes):
+            x = _termino(bandas_t1, bandas_t2, indice, termino)[mask_valido]
+            indices.append(indice_bin(x, bordes))
+        fijo = np.zeros(int(np.count_nonzero(mask_valido)), dtype=np.int64)
+        for posicion, bit in enumerate(self.fijas):
+            _, indice, termino, op, valor = self.motor.condiciones[bit]
+            x = _termino(bandas_t1, bandas_t2, indice, termino)[mask_valido]
+            fijo |= _COMPARADORES[op](x, valor).astype(np.int64) << posicion
+        indices.append(fijo)
+        celdas, inversa, conteos = np.unique(np.ravel_multi_index(indices, self.forma),
+                                             return_inverse=True, return_counts=True)
+        areas = np.zeros(celdas.size)
+        if area is not None:
+            pesos = np.broadcast_to(area, mask_valido.shape)[mask_valido]
+            areas = np.bincount(inversa.ravel(), weights=pesos, minlength=celdas.size)
+        self._sumar(celdas, conteos, areas)
+
+    def _sumar(self, celdas, conteos, areas):
+        """Suma conteos y superficies por celda a los acumulados."""
+        todas = np.concatenate([self.celdas, celdas])
+        self.celdas, inversa = np.unique(todas, return_inverse=True)
+        self.conteos = np.bincount(inversa, weights=np.concatenate([self.conteos, conteos]),
+                                   minlength=self.celdas.size).astype(np.int64)
+        self.areas = np.bincount(inversa, weights=np.concatenate([self.areas, areas]),
+                                 minlength=self.celdas.size)
+
+    def fusionar(self, otro):
+        """Combina el histograma de otro barrido (otra ventana o proceso)."""
+        if otro.forma != self.forma:
+            raise ValueError("Solo se pueden fusionar barridos con la misma configuración")
+        self._sumar(otro.celdas, otro.conteos, otro.areas)
+
+    def combinaciones(self):
+        """Combinaciones de la grilla en orden (producto cartesiano de las claves)."""
+        claves = list(self.grilla)
+        for valores in itertools.product(*(self.grilla[c] for c in claves)):
+            yield dict(zip(claves, valores))
+
+    def resultados(self, n_clases=256):
+        """
+        Conteo de píxeles y superficie por clase para cada combinación de
+        la grilla.
+
+        Retorna:
+        --------
+        list of (dict, array int64, array float64): combinación de umbrales,
+        píxeles y hectáreas por clase (índice = clase)
+        """
+        coordenadas = np.unravel_index(self.celdas, self.forma)
+        # Código de las condiciones fijas, con cada bit en su posición original
+        fijo = np.zeros(self.celdas.size, dtype=np.uint16)
+        for posicion, bit in enumerate(self.fijas):
+            fijo |= (((coordenadas[-1] >> posicion) & 1) << bit).astype(np.uint16)
+
+        resultados = []
+        for combinacion in self.combinaciones():
+            codigo = fijo.copy()
+            for bit, eje, op, clave, signo in self.barridas:
+                bordes = self.bordes[eje]
+                j = int(np.searchsorted(bordes, np.float32(signo * combinacion[clave])))
+                cumple = bins_que_cumplen(len(bordes), op, j)[coordenadas[eje]]
+                codigo |= cumple.astype(np.uint16) << bit
+            clase = self.motor.tabla[codigo]
+            conteo = np.bincount(clase, weights=self.conteos, minlength=n_clases)
+            hectareas = np.bincount(clase, weights=self.areas, minlength=n_clases)
+            resultados.append((combinacion, conteo.astype(np.int64), hectareas))
+        return resultados
@@ -13,6 +13,7 @@ Autor: Byron Caices
 Fecha: Enero 2026
 """
 
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
@@ -24,6 +25,10 @@ from pathlib import Path
 import warnings
 warnings.filterwarnings('ignore')
 
+from pipeline_manifest import NOMBRE_MANIFIESTO, Manifiesto, version_codigo
+from raster_io import indice_banda, iterar_ventanas, leer_reducido
+from streaming_stats import AcumuladorEstadisticas
+
 # Configuración
 BASE_DIR = Path(__file__).parent.parent
 DATA_DIR = BASE_DIR / 'data' / 'processed'
@@ -33,6 +38,10 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 # Años disponibles
 YEARS = ['2018', '2020', '2022', '2024']
 
+# Código del que dependen las animaciones (versión en el manifiesto)
+ARCHIVOS_CODIGO = [Path(__file__).resolve().parent / nombre
+                   for nombre in ('create_animation.py', 'raster_io.py', 'streaming_stats.py')]
+
 def create_custom_colormap():
     """Crear colormap personalizado para NDBI (gris -> rojo)"""
     colors = [
@@ -50,14 +59,11 @@ def read_ndbi_band(tif_path):
     """
     Leer banda NDBI de archivo TIFF
     
-    Estructura de bandas según Fase 2:
-    Banda 1: NDVI
-    Banda 2: NDBI
-    Banda 3: NDWI
-    Banda 4: BSI
+    La banda se ubica por nombre (descripción/tags escritos en la Fase 2) y
+    se lee a la resolución del cuadro, usando las overviews del COG.
     """
     with rasterio.open(tif_path) as src:
-        ndbi = src.read(2)  # Banda 2 = NDBI
+        ndbi = leer_reducido(src, indice_banda(src, 'ndbi'))
         profile = src.profile
         bounds = src.bounds
         transform = src.transform
@@ -70,7 +76,7 @@ def read_ndbi_band(tif_path):
 def read_ndvi_band(tif_path):
     """Leer banda NDVI"""
     with rasterio.open(tif_path) as src:
-        ndvi = src.read(1)  # Banda 1 = NDVI
+        ndvi = leer_reducido(src, indice_banda(src, 'ndvi'))
     
     ndvi = np.where((ndvi < -1) | (ndvi > 1), np.nan, ndvi)
     return ndvi
@@ -179,44 +185,35 @@ def create_gif_with_pillow(frame_paths, output_path, duration=1000):
         optimize=False
     )
 
-def calculate_statistics(ndbi_data):
-    """Calcular estadísticas del NDBI"""
-    valid_data = ndbi_data[~np.isnan(ndbi_data)]
-    urban_pixels = np.sum(valid_data > 0.2)
-    total_pixels = len(valid_data)
-    urban_percentage = (urban_pixels / total_pixels) * 100 if total_pixels > 0 else 0
+def calculate_statistics(tif_path):
+    """
+    Calcular estadísticas del NDBI
+    
+    Se calculan a resolución completa, ventana a ventana: la banda reducida
+    de read_ndbi_band solo se usa para dibujar el cuadro (promediar antes
+    de aplicar el umbral cambiaría el % urbano).
+    """
+    acumulador = AcumuladorEstadisticas(umbrales={'urbano': ('>', 0.2)})
+    with rasterio.open(tif_path) as src:
+        banda = indice_banda(src, 'ndbi')
+        for ventana in iterar_ventanas(src):
+            ndbi = src.read(banda, window=ventana)
+            # Mismo criterio que read_ndbi_band: fuera de -1 a 1 no es válido
+            acumulador.agregar(ndbi, mascara=(ndbi >= -1) & (ndbi <= 1))
     
     return {
-        'mean': np.mean(valid_data),
-        'std': np.std(valid_data),
-        'urban_pixels': urban_pixels,
-        'urban_percentage': urban_percentage
+        'mean': float(acumulador.media) if acumulador.n else float('nan'),
+        'std': acumulador.std,
+        'urban_pixels': acumulador.conteos['urbano'],
+        'urban_percentage': 100 * acumulador.fraccion('urbano') if acumulador.n else 0
     }
 
-def main():
-    """Función principal"""
-    print("\n" + "="*70)
-    print("   GENERACIÓN DE ANIMACIÓN TEMPORAL - URBANIZACIÓN PEÑAFLOR")
-    print("="*70)
-    
-    # Verificar archivos disponibles
-    print("\n📂 Verificando archivos de índices...")
-    available_years = []
-    for year in YEARS:
-        tif_path = DATA_DIR / f'indices_{year}.tif'
-        if tif_path.exists():
-            available_years.append(year)
-            print(f"   ✓ {year}: {tif_path.name}")
-        else:
-            print(f"   ✗ {year}: Archivo no encontrado")
-    
-    if len(available_years) < 2:
-        print("\n❌ Error: Se necesitan al menos 2 años de datos para crear animación")
-        return None
-    
-    print(f"\n✅ {len(available_years)} años disponibles para animación\n")
+def generate_ndbi_gif(available_years):
+    """
+    Método 1: GIF Principal (NDBI Evolution)
     
-    # Método 1: GIF Principal (NDBI Evolution)
+    Retorna la ruta del GIF y las estadísticas NDBI por año.
+    """
     print("🎬 Generando Animación 1: Evolución NDBI...")
     print("-" * 70)
     
@@ -231,8 +228,8 @@ def main():
         tif_path = DATA_DIR / f'indices_{year}.tif'
         ndbi, profile, bounds, transform = read_ndbi_band(tif_path)
         
-        # Calcular estadísticas
-        stats = calculate_statistics(ndbi)
+        # Calcular estadísticas (resolución completa)
+        stats = calculate_statistics(tif_path)
         stats_by_year[year] = stats
         print(f"      NDBI medio: {stats['mean']:.3f} | Urbano: {stats['urban_percentage']:.2f}%")
         
@@ -260,7 +257,10 @@ def main():
     for temp_path in temp_paths_ndbi:
         temp_path.unlink()
     
-    # Método 2: GIF Comparativo (NDVI vs NDBI)
+    return gif_path_ndbi, stats_by_year
+
+def generate_comparison_gif(available_years):
+    """Método 2: GIF Comparativo (NDVI vs NDBI)"""
     print("\n🎬 Generando Animación 2: NDVI vs NDBI...")
     print("-" * 70)
     
@@ -298,6 +298,53 @@ def main():
     for temp_path in temp_paths_comparison:
         temp_path.unlink()
     
+    return gif_path_comparison
+
+def main(forzar=False):
+    """Función principal"""
+    print("\n" + "="*70)
+    print("   GENERACIÓN DE ANIMACIÓN TEMPORAL - URBANIZACIÓN PEÑAFLOR")
+    print("="*70)
+    
+    # Verificar archivos disponibles
+    print("\n📂 Verificando archivos de índices...")
+    available_years = []
+    for year in YEARS:
+        tif_path = DATA_DIR / f'indices_{year}.tif'
+        if tif_path.exists():
+            available_years.append(year)
+            print(f"   ✓ {year}: {tif_path.name}")
+        else:
+            print(f"   ✗ {year}: Archivo no encontrado")
+    
+    if len(available_years) < 2:
+        print("\n❌ Error: Se necesitan al menos 2 años de datos para crear animación")
+        return None
+    
+    print(f"\n✅ {len(available_years)} años disponibles para animación\n")
+    
+    gif_path_ndbi = OUTPUT_DIR / 'evolucion_urbanizacion_penaflor.gif'
+    gif_path_comparison = OUTPUT_DIR / 'comparacion_ndvi_ndbi.gif'
+    
+    # Omitir las animaciones si los índices, parámetros y código no cambiaron
+    manifiesto = Manifiesto(DATA_DIR / NOMBRE_MANIFIESTO, forzar=forzar)
+    huella = manifiesto.huella(
+        [DATA_DIR / f'indices_{year}.tif' for year in available_years],
+        {'years': available_years},
+        version_codigo(*ARCHIVOS_CODIGO)
+    )
+    
+    if manifiesto.actualizado('animaciones', huella, [gif_path_ndbi, gif_path_comparison]):
+        print("✓ Animaciones al día (sin cambios en índices/parámetros/código), se omiten")
+        stats_by_year = manifiesto.datos('animaciones')
+    else:
+        gif_path_ndbi, stats_by_year = generate_ndbi_gif(available_years)
+        gif_path_comparison = generate_comparison_gif(available_years)
+        
+        manifiesto.registrar('animaciones', huella, [gif_path_ndbi, gif_path_comparison],
+                             datos=stats_by_year)
+        manifiesto.guardar()
+    
     # Resumen de estadísticas
     print("\n" + "="*70)
     print("📊 RESUMEN DE EVOLUCIÓN TEMPORAL")
@@ -343,8 +390,12 @@ def main():
     return gif_path_ndbi, gif_path_comparison
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Animación temporal de urbanización')
+    parser.add_argument('--forzar', action='store_true',
+                        help='Regenerar aunque el manifiesto indique que las animaciones están al día')
+    args = parser.parse_args()
     try:
-        gif_ndbi, gif_comp = main()
+        gif_ndbi, gif_comp = main(forzar=args.forzar)
     except Exception as e:
         print(f"\n❌ ERROR: {e}")
         import traceback
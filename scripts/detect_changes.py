@@ -12,16 +12,30 @@ Fecha: Enero 2025
 Universidad de Santiago de Chile
 """
 
+import argparse
+import time
+from contextlib import ExitStack, contextmanager
 import numpy as np
-import rasterio
 from pathlib import Path
 import pandas as pd
+import matplotlib.pyplot as plt
 from scipy import stats
 
+from change_rules import BarridoUmbrales, MotorReglas, bins_que_cumplen, indice_bin
+from pipeline_manifest import NOMBRE_MANIFIESTO, Manifiesto, version_codigo
+from raster_io import FILAS_VENTANA, PilaRaster, area_ventana, escribir_cog
+from streaming_stats import AcumuladorEstadisticas, AcumuladorPorPixel, ConteoClases
+
 # Configuración
 BASE_DIR = Path(__file__).parent.parent
 INPUT_DIR = BASE_DIR / 'data' / 'processed'
 OUTPUT_DIR = BASE_DIR / 'data' / 'processed'
+OUTPUT_DIR_FIG = BASE_DIR / 'outputs' / 'figures'
+
+# Código del que dependen los productos de esta etapa (versión en el manifiesto)
+ARCHIVOS_CODIGO = [Path(__file__).resolve().parent / nombre
+                   for nombre in ('detect_changes.py', 'change_rules.py', 'raster_io.py',
+                                  'streaming_stats.py')]
 
 # Años a analizar
 YEAR_INICIO = 2018
@@ -47,6 +61,57 @@ CLASES_CAMBIO = {
     5: 'Pérdida agua'
 }
 
+# Condiciones del Método 2: (nombre, índice, término, operador, umbral)
+# término: 't1', 't2', 'delta' (t2 - t1) o 'caida' (t1 - t2); el umbral
+# puede ser una clave de UMBRALES (ver change_rules.py)
+CONDICIONES_CAMBIO = [
+    ('era_vegetacion', 'ndvi', 't1', '>', 'ndvi_veg'),
+    ('es_urbano', 'ndbi', 't2', '>', 'ndbi_urbano'),
+    ('aumento_ndbi', 'ndbi', 'delta', '>', 'cambio_min'),
+    ('perdio_veg', 'ndvi', 'caida', '>', 'cambio_min'),
+    ('gano_veg', 'ndvi', 'delta', '>', 'cambio_min'),
+    ('era_no_agua', 'ndwi', 't1', '<', 0),
+    ('es_agua', 'ndwi', 't2', '>', 'ndwi_agua'),
+    ('era_agua', 'ndwi', 't1', '>', 'ndwi_agua'),
+    ('no_es_agua', 'ndwi', 't2', '<', 0),
+]
+
+# Cubo de todos los pares de años: el ΔNDVI se guarda cuantizado en uint8,
+# Δ = valor * CUBO_DELTA_ESCALA + CUBO_DELTA_DESPLAZAMIENTO ([-1, 1] → 0-254;
+# 255 = nodata). La resolución (~0.008) alcanza para visualizar y filtrar
+CUBO_DELTA_ESCALA = 2 / 254
+CUBO_DELTA_DESPLAZAMIENTO = -1.0
+
+# Clases de trayectoria (--trayectorias), según los pasos entre años
+# consecutivos con |ΔNDVI| > cambio_min ("pasos significativos")
+CLASES_TRAYECTORIA = {
+    0: 'Estable',      # sin pasos significativos ni cambio neto
+    1: 'Abrupto',      # un único paso significativo concentra el cambio
+    2: 'Gradual',      # cambio neto por varios pasos en el mismo sentido
+    3: 'Reversión'     # pasos en ambos sentidos o cambio que no se sostuvo
+}
+
+# Escala de la magnitud de trayectoria (ΔNDVI neto × 1000 en int16)
+ESCALA_MAGNITUD = 1000
+
+# Valores candidatos para el análisis de sensibilidad (--sensibilidad)
+GRILLA_SENSIBILIDAD = {
+    'cambio_min': [0.05, 0.10, 0.15, 0.20, 0.25, 0.30, 0.35, 0.40],
+    'ndvi_veg': [0.1, 0.2, 0.3, 0.4, 0.5, 0.6],
+    'ndbi_urbano': [-0.2, -0.1, 0.0, 0.1, 0.2, 0.3],
+    'zscore_umbral': [1.0, 1.5, 2.0, 2.5, 3.0, 3.5],
+}
+
+# Reglas del Método 2 en orden de prioridad: (clase, condiciones requeridas).
+# Cada píxel recibe la primera regla que cumple; si ninguna, 'Sin cambio'
+REGLAS_CAMBIO = [
+    (1, ('era_vegetacion', 'es_urbano', 'aumento_ndbi')),  # Urbanización
+    (2, ('perdio_veg',)),                                  # Pérdida de vegetación
+    (3, ('gano_veg',)),                                    # Ganancia de vegetación
+    (4, ('era_no_agua', 'es_agua')),                       # Nuevo cuerpo de agua
+    (5, ('era_agua', 'no_es_agua')),                       # Pérdida de agua
+]
+
 print("="*70)
 print("🔍  DETECCIÓN DE CAMBIOS URBANOS")
 print("    Fase 3: Análisis Multi-Temporal")
@@ -59,7 +124,58 @@ for key, val in UMBRALES.items():
 print()
 
 
-def detectar_cambio_diferencia(ruta_t1, ruta_t2, umbral=0.15):
+def _ventanas_metodo(pila, ruta, salidas, filas_ventana):
+    """
+    Ventanas que recorre un método: la escena completa (None) si no se
+    indican `salidas`, o franjas de `filas_ventana` filas en modo por ventanas.
+    """
+    if salidas is None:
+        return [None]
+    return pila.ventanas(ruta, filas_ventana)
+
+
+@contextmanager
+def _abrir_salidas(salidas, profile):
+    """
+    Abre los COG de salida de un método en modo por ventanas.
+
+    `salidas` es una lista de (ruta, dtype, nodata, nombre_banda); retorna
+    los datasets abiertos en el mismo orden (lista vacía si salidas es None).
+    """
+    if salidas is None:
+        yield []
+        return
+    with ExitStack() as pila_archivos:
+        destinos = []
+        for ruta, dtype, nodata, banda_nombre in salidas:
+            dst = pila_archivos.enter_context(
+                escribir_cog(ruta, profile, count=1, dtype=dtype, nodata=nodata))
+            dst.set_band_description(1, banda_nombre)
+            destinos.append(dst)
+        yield destinos
+        for ruta, *_ in salidas:
+            print(f"   ✓ Guardado: {Path(ruta).name}")
+
+
+def _kernel_diferencia(ndvi_t1, ndvi_t2, umbral):
+    """Clasificación -1/0/1 y ΔNDVI de un bloque (escena completa o ventana)."""
+    # Aplicar máscara de nodata
+    mask_valido = (ndvi_t1 != -9999) & (ndvi_t2 != -9999)
+    
+    # Calcular diferencia
+    diferencia = np.where(mask_valido, ndvi_t2 - ndvi_t1, -9999).astype(np.float32)
+    
+    # Clasificar cambios
+    cambio = np.zeros_like(diferencia, dtype=np.int8)
+    cambio[diferencia < -umbral] = -1  # Pérdida de vegetación
+    cambio[diferencia > umbral] = 1    # Ganancia de vegetación
+    cambio[~mask_valido] = -128        # Nodata
+    
+    return cambio, diferencia, mask_valido
+
+
+def detectar_cambio_diferencia(ruta_t1, ruta_t2, umbral=0.15, pila=None, salidas=None,
+                               filas_ventana=FILAS_VENTANA):
     """
     MÉTODO 1: Diferencia Simple de NDVI
     ====================================
@@ -73,13 +189,22 @@ def detectar_cambio_diferencia(ruta_t1, ruta_t2, umbral=0.15):
         Ruta al archivo de índices del año final
     umbral : float
         Magnitud mínima de cambio significativo
+    pila : PilaRaster, optional
+        Caché de bandas compartida entre métodos
+    salidas : tuple of Path, optional
+        (ruta_clasificacion, ruta_diferencia). Si se indica, el método corre
+        por ventanas de `filas_ventana` filas y escribe cada ventana en los
+        COG de salida en vez de retornar los arrays
+    filas_ventana : int
+        Filas por ventana en modo por ventanas
         
     Retorna:
     --------
     cambio : array
         Clasificación: -1 (pérdida), 0 (sin cambio), 1 (ganancia)
+        (None en modo por ventanas)
     diferencia : array
-        Valores continuos de diferencia NDVI
+        Valores continuos de diferencia NDVI (None en modo por ventanas)
     stats_dict : dict
         Estadísticas del análisis
     """
@@ -88,40 +213,49 @@ def detectar_cambio_diferencia(ruta_t1, ruta_t2, umbral=0.15):
     print("MÉTODO 1: DIFERENCIA SIMPLE (ΔNDVI)")
     print("="*70)
     
-    # Leer índices año inicial
-    with rasterio.open(ruta_t1) as src1:
-        ndvi_t1 = src1.read(1).astype(np.float32)  # Banda 1 = NDVI
-        profile = src1.profile.copy()
-        
-    # Leer índices año final
-    with rasterio.open(ruta_t2) as src2:
-        ndvi_t2 = src2.read(1).astype(np.float32)
-    
-    # Aplicar máscara de nodata
-    mask_valido = (ndvi_t1 != -9999) & (ndvi_t2 != -9999)
-    
-    # Calcular diferencia
-    diferencia = np.where(mask_valido, ndvi_t2 - ndvi_t1, -9999)
-    
-    # Clasificar cambios
-    cambio = np.zeros_like(diferencia, dtype=np.int8)
-    cambio[diferencia < -umbral] = -1  # Pérdida de vegetación
-    cambio[diferencia > umbral] = 1    # Ganancia de vegetación
-    cambio[~mask_valido] = -128        # Nodata
-    
-    # Calcular estadísticas
-    pixeles_validos = np.sum(mask_valido)
-    pixeles_perdida = np.sum(cambio == -1)
-    pixeles_ganancia = np.sum(cambio == 1)
-    pixeles_sin_cambio = np.sum(cambio == 0)
-    
-    # Convertir píxeles a hectáreas (píxel Sentinel-2 = 10m × 10m = 100 m² = 0.01 ha)
-    ha_perdida = pixeles_perdida * 0.01
-    ha_ganancia = pixeles_ganancia * 0.01
-    ha_sin_cambio = pixeles_sin_cambio * 0.01
-    
-    # Estadísticas de la diferencia (solo píxeles válidos)
-    diff_valida = diferencia[mask_valido]
+    pila = pila if pila is not None else PilaRaster()
+    ventanas = _ventanas_metodo(pila, ruta_t1, salidas, filas_ventana)
+    especificacion = None
+    if salidas is not None:
+        especificacion = [
+            (salidas[0], 'int8', -128, f'Diferencia_NDVI_{YEAR_INICIO}_{YEAR_FIN}'),
+            (salidas[1], 'float32', -9999, f'Delta_NDVI_{YEAR_INICIO}_{YEAR_FIN}'),
+        ]
+    
+    # Conteos por clase y estadísticas de la diferencia, acumulados ventana a ventana
+    conteo = ConteoClases(nodata=-128)
+    acumulador = AcumuladorEstadisticas(rango=(-2, 2))
+    
+    with _abrir_salidas(especificacion, pila.perfil(ruta_t1)) as destinos:
+        for ventana in ventanas:
+            # Leer índices año inicial y final (decodificados una vez por la pila)
+            ndvi_t1 = pila.leer(ruta_t1, 'ndvi', ventana)
+            ndvi_t2 = pila.leer(ruta_t2, 'ndvi', ventana)
+            
+            cambio, diferencia, mask_valido = _kernel_diferencia(ndvi_t1, ndvi_t2, umbral)
+            
+            # Calcular estadísticas (conteo y hectáreas de las 3 clases en una pasada)
+            conteo.agregar(cambio, area=area_ventana(pila.area_filas(ruta_t1), ventana))
+            
+            # Estadísticas de la diferencia (solo píxeles válidos)
+            acumulador.agregar(diferencia, mask_valido)
+            
+            if destinos:
+                destinos[0].write(cambio, 1, window=ventana)
+                destinos[1].write(diferencia, 1, window=ventana)
+                cambio = diferencia = None
+    
+    pixeles_validos = conteo.validos
+    pixeles_perdida = conteo.pixeles(-1)
+    pixeles_ganancia = conteo.pixeles(1)
+    pixeles_sin_cambio = conteo.pixeles(0)
+    
+    # Hectáreas: suma del área de cada píxel (por fila, ver raster_io.area_filas_ha)
+    ha_perdida = conteo.hectareas(-1)
+    ha_ganancia = conteo.hectareas(1)
+    ha_sin_cambio = conteo.hectareas(0)
+    
+    stats_dif = acumulador.resultado()
     
     stats_dict = {
         'metodo': 'Diferencia Simple',
@@ -129,16 +263,16 @@ def detectar_cambio_diferencia(ruta_t1, ruta_t2, umbral=0.15):
         'pixeles_perdida': pixeles_perdida,
         'pixeles_ganancia': pixeles_ganancia,
         'pixeles_sin_cambio': pixeles_sin_cambio,
-        'pct_perdida': 100 * pixeles_perdida / pixeles_validos if pixeles_validos > 0 else 0,
-        'pct_ganancia': 100 * pixeles_ganancia / pixeles_validos if pixeles_validos > 0 else 0,
-        'pct_sin_cambio': 100 * pixeles_sin_cambio / pixeles_validos if pixeles_validos > 0 else 0,
+        'pct_perdida': conteo.porcentaje(-1),
+        'pct_ganancia': conteo.porcentaje(1),
+        'pct_sin_cambio': conteo.porcentaje(0),
         'ha_perdida': ha_perdida,
         'ha_ganancia': ha_ganancia,
         'ha_sin_cambio': ha_sin_cambio,
-        'diferencia_media': float(np.mean(diff_valida)),
-        'diferencia_std': float(np.std(diff_valida)),
-        'diferencia_min': float(np.min(diff_valida)),
-        'diferencia_max': float(np.max(diff_valida))
+        'diferencia_media': stats_dif['mean'],
+        'diferencia_std': stats_dif['std'],
+        'diferencia_min': stats_dif['min'],
+        'diferencia_max': stats_dif['max']
     }
     
     print(f"\n📊 Resultados:")
@@ -152,7 +286,19 @@ def detectar_cambio_diferencia(ruta_t1, ruta_t2, umbral=0.15):
     return cambio, diferencia, stats_dict
 
 
-def clasificar_cambio_urbano(ruta_t1, ruta_t2, umbrales=None):
+def _kernel_multicriterio(motor, bandas_t1, bandas_t2):
+    """Clases de cambio 0-5 (255 = nodata) de un bloque (escena completa o ventana)."""
+    # Máscara de datos válidos
+    mask_valido = (bandas_t1['ndvi'] != -9999) & (bandas_t2['ndvi'] != -9999)
+    
+    # Condiciones -> código de bits -> clase, en una pasada por tabla de consulta
+    clase = motor.clasificar(bandas_t1, bandas_t2, mask_valido)
+    
+    return clase, mask_valido
+
+
+def clasificar_cambio_urbano(ruta_t1, ruta_t2, umbrales=None, pila=None, salidas=None,
+                             filas_ventana=FILAS_VENTANA):
     """
     MÉTODO 2: Clasificación Multicriterio
     ======================================
@@ -165,6 +311,9 @@ def clasificar_cambio_urbano(ruta_t1, ruta_t2, umbrales=None):
         3: Ganancia de vegetación
         4: Nuevo cuerpo de agua
         5: Pérdida de agua
+    
+    Las reglas (CONDICIONES_CAMBIO, REGLAS_CAMBIO) se compilan a una tabla
+    de consulta y cada píxel se clasifica en una sola pasada.
         
     Parámetros:
     -----------
@@ -174,11 +323,18 @@ def clasificar_cambio_urbano(ruta_t1, ruta_t2, umbrales=None):
         Ruta al archivo de índices del año final
     umbrales : dict
         Diccionario con umbrales de clasificación
+    pila : PilaRaster, optional
+        Caché de bandas compartida entre métodos
+    salidas : Path, optional
+        Ruta del COG de clases; si se indica, el método corre por ventanas
+        y escribe cada una en vez de retornar el array
+    filas_ventana : int
+        Filas por ventana en modo por ventanas
         
     Retorna:
     --------
     clase : array
-        Clasificación de cambio (0-5)
+        Clasificación de cambio (0-5) (None en modo por ventanas)
     stats_dict : dict
         Estadísticas por clase
     """
@@ -190,85 +346,91 @@ def clasificar_cambio_urbano(ruta_t1, ruta_t2, umbrales=None):
     if umbrales is None:
         umbrales = UMBRALES
     
-    # Leer todos los índices año inicial
-    with rasterio.open(ruta_t1) as src1:
-        ndvi_t1 = src1.read(1).astype(np.float32)
-        ndbi_t1 = src1.read(2).astype(np.float32)
-        ndwi_t1 = src1.read(3).astype(np.float32)
-        profile = src1.profile.copy()
-    
-    # Leer todos los índices año final
-    with rasterio.open(ruta_t2) as src2:
-        ndvi_t2 = src2.read(1).astype(np.float32)
-        ndbi_t2 = src2.read(2).astype(np.float32)
-        ndwi_t2 = src2.read(3).astype(np.float32)
-    
-    # Máscara de datos válidos
-    mask_valido = (ndvi_t1 != -9999) & (ndvi_t2 != -9999)
-    
-    # Inicializar clasificación
-    clase = np.zeros_like(ndvi_t1, dtype=np.uint8)
-    
-    # REGLA 1: Urbanización (era vegetación, ahora es urbano)
-    era_vegetacion = ndvi_t1 > umbrales['ndvi_veg']
-    es_urbano = ndbi_t2 > umbrales['ndbi_urbano']
-    aumento_ndbi = (ndbi_t2 - ndbi_t1) > umbrales['cambio_min']
-    clase[era_vegetacion & es_urbano & aumento_ndbi & mask_valido] = 1
-    
-    # REGLA 2: Pérdida de vegetación (no necesariamente urbanización)
-    perdio_veg = (ndvi_t1 - ndvi_t2) > umbrales['cambio_min']
-    clase[(perdio_veg & mask_valido) & (clase == 0)] = 2
-    
-    # REGLA 3: Ganancia de vegetación
-    gano_veg = (ndvi_t2 - ndvi_t1) > umbrales['cambio_min']
-    clase[(gano_veg & mask_valido) & (clase == 0)] = 3
-    
-    # REGLA 4: Nuevo cuerpo de agua
-    era_no_agua = ndwi_t1 < 0
-    es_agua = ndwi_t2 > umbrales['ndwi_agua']
-    clase[(era_no_agua & es_agua & mask_valido) & (clase == 0)] = 4
-    
-    # REGLA 5: Pérdida de agua
-    era_agua = ndwi_t1 > umbrales['ndwi_agua']
-    no_es_agua = ndwi_t2 < 0
-    clase[(era_agua & no_es_agua & mask_valido) & (clase == 0)] = 5
-    
-    # Marcar nodata
-    clase[~mask_valido] = 255
+    # Reglas compiladas a una tabla código -> clase
+    motor = MotorReglas(CONDICIONES_CAMBIO, REGLAS_CAMBIO, umbrales)
+    indices = list(dict.fromkeys(['ndvi'] + motor.indices))
+    
+    pila = pila if pila is not None else PilaRaster()
+    ventanas = _ventanas_metodo(pila, ruta_t1, salidas, filas_ventana)
+    especificacion = None
+    if salidas is not None:
+        especificacion = [(salidas, 'uint8', 255, f'Clasificacion_Cambio_{YEAR_INICIO}_{YEAR_FIN}')]
+    
+    # Conteo por clase acumulado ventana a ventana
+    conteo = ConteoClases(nodata=255)
+    
+    with _abrir_salidas(especificacion, pila.perfil(ruta_t1)) as destinos:
+        for ventana in ventanas:
+            # Leer los índices que usan las reglas en ambos años (NDVI ya
+            # decodificado si se comparte la pila con el Método 1)
+            bandas_t1 = {nombre: pila.leer(ruta_t1, nombre, ventana) for nombre in indices}
+            bandas_t2 = {nombre: pila.leer(ruta_t2, nombre, ventana) for nombre in indices}
+            
+            clase, mask_valido = _kernel_multicriterio(motor, bandas_t1, bandas_t2)
+            
+            conteo.agregar(clase, area=area_ventana(pila.area_filas(ruta_t1), ventana))
+            
+            if destinos:
+                destinos[0].write(clase, 1, window=ventana)
+                clase = None
     
     # Calcular estadísticas por clase
-    pixeles_validos = np.sum(mask_valido)
-    stats_list = []
+    stats_list = conteo.tabla(CLASES_CAMBIO)
     
     print(f"\n📊 Resultados por clase:")
     print(f"   {'Clase':<5} {'Tipo de cambio':<25} {'Píxeles':<12} {'%':<8} {'Hectáreas':<10}")
     print(f"   {'-'*70}")
     
-    for clase_id, nombre in CLASES_CAMBIO.items():
-        pixeles = np.sum(clase == clase_id)
-        pct = 100 * pixeles / pixeles_validos if pixeles_validos > 0 else 0
-        ha = pixeles * 0.01
-        
-        stats_list.append({
-            'clase_id': clase_id,
-            'nombre': nombre,
-            'pixeles': pixeles,
-            'porcentaje': pct,
-            'hectareas': ha
-        })
-        
-        print(f"   {clase_id:<5} {nombre:<25} {pixeles:<12,} {pct:<7.2f}% {ha:<10.2f}")
+    for fila in stats_list:
+        print(f"   {fila['clase_id']:<5} {fila['nombre']:<25} {fila['pixeles']:<12,} "
+              f"{fila['porcentaje']:<7.2f}% {fila['hectareas']:<10.2f}")
     
     stats_dict = {
         'metodo': 'Clasificación Multicriterio',
         'clases': stats_list,
-        'pixeles_validos': pixeles_validos
+        'pixeles_validos': conteo.validos
     }
     
     return clase, stats_dict
 
 
-def analisis_zscore(rutas_serie_temporal, indice_analisis=-1):
+def _historico_ndvi(pila, rutas_historicas, ventana):
+    """
+    Media y desviación estándar histórica del NDVI de un bloque, leyendo
+    un año a la vez (Welford por píxel: memoria constante en el largo de la serie).
+    """
+    acumulador = None
+    for ruta in rutas_historicas:
+        ndvi = pila.leer(ruta, 'ndvi', ventana)
+        if acumulador is None:
+            acumulador = AcumuladorPorPixel(ndvi.shape)
+        acumulador.agregar(ndvi)
+    return acumulador.resultado()
+
+
+def _kernel_zscore(actual, media_hist, std_hist, umbral_z):
+    """Z-score y dirección de la anomalía de un bloque (escena completa o ventana)."""
+    # Máscara de datos válidos
+    mask_valido = actual != -9999
+    
+    # Calcular Z-score
+    z_score = np.where(
+        mask_valido,
+        (actual - media_hist) / (std_hist + 1e-10),
+        -9999
+    ).astype(np.float32)
+    
+    # Clasificar dirección del cambio
+    direccion = np.zeros_like(z_score, dtype=np.int8)
+    direccion[z_score < -umbral_z] = -1  # Muy por debajo de lo normal
+    direccion[z_score > umbral_z] = 1    # Muy por encima de lo normal
+    direccion[~mask_valido] = -128       # Nodata
+    
+    return z_score, direccion, mask_valido
+
+
+def analisis_zscore(rutas_serie_temporal, indice_analisis=-1, pila=None, salidas=None,
+                    filas_ventana=FILAS_VENTANA):
     """
     MÉTODO 3: Análisis Z-score (Anomalías Estadísticas)
     ====================================================
@@ -276,21 +438,34 @@ def analisis_zscore(rutas_serie_temporal, indice_analisis=-1):
     
     Z-score = (actual - media_histórica) / (std_histórica + ε)
     
+    La media y la desviación histórica se acumulan por píxel leyendo un año
+    a la vez (Welford) y el año analizado se evalúa en una segunda pasada,
+    por lo que la memoria no crece con el largo de la serie.
+    
     Parámetros:
     -----------
     rutas_serie_temporal : list of Path
         Lista de rutas a archivos de índices (ordenados cronológicamente)
     indice_analisis : int
         Índice del año a analizar (default: -1 = último año)
+    pila : PilaRaster, optional
+        Caché de bandas compartida entre métodos
+    salidas : tuple of Path, optional
+        (ruta_direccion, ruta_valores). Si se indica, el método corre por
+        ventanas y escribe cada una en vez de retornar los arrays
+    filas_ventana : int
+        Filas por ventana en modo por ventanas
         
     Retorna:
     --------
     z_score : array
-        Valores Z-score del NDVI
+        Valores Z-score del NDVI (None en modo por ventanas)
     cambio_significativo : array
         Máscara booleana de cambios significativos (|Z| > 2)
+        (None en modo por ventanas)
     direccion : array
         Dirección del cambio: -1 (negativo), 0 (normal), 1 (positivo)
+        (None en modo por ventanas)
     stats_dict : dict
         Estadísticas del análisis
     """
@@ -299,61 +474,62 @@ def analisis_zscore(rutas_serie_temporal, indice_analisis=-1):
     print("MÉTODO 3: ANÁLISIS Z-SCORE (ANOMALÍAS ESTADÍSTICAS)")
     print("="*70)
     
-    # Leer todos los años
-    stack_ndvi = []
-    for i, ruta in enumerate(rutas_serie_temporal):
-        with rasterio.open(ruta) as src:
-            ndvi = src.read(1).astype(np.float32)
-            stack_ndvi.append(ndvi)
-            if i == indice_analisis or (indice_analisis == -1 and i == len(rutas_serie_temporal) - 1):
-                profile = src.profile.copy()
-    
-    stack_ndvi = np.array(stack_ndvi)
-    
-    # Calcular estadísticas históricas (excluir año de análisis)
-    historico = np.delete(stack_ndvi, indice_analisis, axis=0)
-    
-    # Máscara de datos válidos
-    mask_valido = stack_ndvi[indice_analisis] != -9999
-    
-    # Calcular media y desviación estándar del histórico
-    media_hist = np.nanmean(historico, axis=0)
-    std_hist = np.nanstd(historico, axis=0)
-    
-    # Imagen a analizar
-    actual = stack_ndvi[indice_analisis]
-    
-    # Calcular Z-score
-    z_score = np.where(
-        mask_valido,
-        (actual - media_hist) / (std_hist + 1e-10),
-        -9999
-    )
-    
-    # Detectar cambios significativos (|Z| > umbral)
+    pila = pila if pila is not None else PilaRaster()
+    ventanas = _ventanas_metodo(pila, rutas_serie_temporal[0], salidas, filas_ventana)
     umbral_z = UMBRALES['zscore_umbral']
-    cambio_significativo = np.abs(z_score) > umbral_z
-    cambio_significativo[~mask_valido] = False
+    especificacion = None
+    if salidas is not None:
+        especificacion = [
+            (salidas[0], 'int8', -128, f'Zscore_Direccion_{YEAR_FIN}'),
+            (salidas[1], 'float32', -9999, f'Zscore_Valores_{YEAR_FIN}'),
+        ]
+    
+    # Año a analizar y serie histórica (el resto de los años)
+    indice_analisis %= len(rutas_serie_temporal)
+    ruta_actual = rutas_serie_temporal[indice_analisis]
+    rutas_historicas = [ruta for i, ruta in enumerate(rutas_serie_temporal) if i != indice_analisis]
+    
+    # Conteos por dirección y estadísticas del Z-score, acumulados ventana a ventana
+    conteo = ConteoClases(nodata=-128)
+    acumulador = AcumuladorEstadisticas(rango=None)
+    
+    with _abrir_salidas(especificacion, pila.perfil(rutas_serie_temporal[0])) as destinos:
+        for ventana in ventanas:
+            # Pasada 1: media y desviación histórica, un año a la vez (los
+            # ya usados por los Métodos 1 y 2 no se vuelven a decodificar)
+            media_hist, std_hist = _historico_ndvi(pila, rutas_historicas, ventana)
+            
+            # Pasada 2: Z-score del año a analizar
+            actual = pila.leer(ruta_actual, 'ndvi', ventana)
+            z_score, direccion, mask_valido = _kernel_zscore(actual, media_hist, std_hist, umbral_z)
+            del media_hist, std_hist
+            
+            # Estadísticas
+            conteo.agregar(direccion, area=area_ventana(pila.area_filas(ruta_actual), ventana))
+            acumulador.agregar(z_score, mask_valido)
+            
+            if destinos:
+                destinos[0].write(direccion, 1, window=ventana)
+                destinos[1].write(z_score, 1, window=ventana)
+                z_score = direccion = None
+    
+    pixeles_validos = conteo.validos
+    pixeles_anomalia_negativa = conteo.pixeles(-1)
+    pixeles_anomalia_positiva = conteo.pixeles(1)
+    pixeles_normal = conteo.pixeles(0)
     
-    # Clasificar dirección del cambio
-    direccion = np.zeros_like(z_score, dtype=np.int8)
-    direccion[z_score < -umbral_z] = -1  # Muy por debajo de lo normal
-    direccion[z_score > umbral_z] = 1    # Muy por encima de lo normal
-    direccion[~mask_valido] = -128       # Nodata
-    
-    # Estadísticas
-    pixeles_validos = np.sum(mask_valido)
-    pixeles_anomalia_negativa = np.sum(direccion == -1)
-    pixeles_anomalia_positiva = np.sum(direccion == 1)
-    pixeles_normal = pixeles_validos - pixeles_anomalia_negativa - pixeles_anomalia_positiva
+    # Detectar cambios significativos (|Z| > umbral)
+    cambio_significativo = None
+    if direccion is not None:
+        cambio_significativo = (direccion == -1) | (direccion == 1)
     
     # Hectáreas
-    ha_anomalia_neg = pixeles_anomalia_negativa * 0.01
-    ha_anomalia_pos = pixeles_anomalia_positiva * 0.01
-    ha_normal = pixeles_normal * 0.01
+    ha_anomalia_neg = conteo.hectareas(-1)
+    ha_anomalia_pos = conteo.hectareas(1)
+    ha_normal = conteo.hectareas(0)
     
     # Estadísticas de Z-score
-    z_validos = z_score[mask_valido]
+    stats_z = acumulador.resultado()
     
     stats_dict = {
         'metodo': 'Análisis Z-score',
@@ -361,16 +537,16 @@ def analisis_zscore(rutas_serie_temporal, indice_analisis=-1):
         'pixeles_anomalia_negativa': pixeles_anomalia_negativa,
         'pixeles_anomalia_positiva': pixeles_anomalia_positiva,
         'pixeles_normal': pixeles_normal,
-        'pct_anomalia_negativa': 100 * pixeles_anomalia_negativa / pixeles_validos if pixeles_validos > 0 else 0,
-        'pct_anomalia_positiva': 100 * pixeles_anomalia_positiva / pixeles_validos if pixeles_validos > 0 else 0,
-        'pct_normal': 100 * pixeles_normal / pixeles_validos if pixeles_validos > 0 else 0,
+        'pct_anomalia_negativa': conteo.porcentaje(-1),
+        'pct_anomalia_positiva': conteo.porcentaje(1),
+        'pct_normal': conteo.porcentaje(0),
         'ha_anomalia_negativa': ha_anomalia_neg,
         'ha_anomalia_positiva': ha_anomalia_pos,
         'ha_normal': ha_normal,
-        'zscore_media': float(np.mean(z_validos)),
-        'zscore_std': float(np.std(z_validos)),
-        'zscore_min': float(np.min(z_validos)),
-        'zscore_max': float(np.max(z_validos)),
+        'zscore_media': stats_z['mean'],
+        'zscore_std': stats_z['std'],
+        'zscore_min': stats_z['min'],
+        'zscore_max': stats_z['max'],
         'umbral_utilizado': umbral_z
     }
     
@@ -385,17 +561,522 @@ def analisis_zscore(rutas_serie_temporal, indice_analisis=-1):
     return z_score, cambio_significativo, direccion, stats_dict
 
 
-def guardar_raster(array, ruta_salida, profile, banda_nombre="cambio", dtype='int8', nodata=-128):
+def _nombre_columna(nombre):
+    """Nombre de clase normalizado para columnas (sin tildes ni espacios)."""
+    return (nombre.lower()
+            .replace('á', 'a').replace('é', 'e').replace('í', 'i')
+            .replace('ó', 'o').replace('ú', 'u').replace(' ', '_'))
+
+
+def cubo_cambios_pares(rutas_por_year, salidas, umbrales=None, pila=None, por_ventanas=False,
+                       filas_ventana=FILAS_VENTANA):
+    """
+    MODO LOTE: Cubo de Cambios para Todos los Pares de Años
+    ========================================================
+    Calcula la clasificación multicriterio y el ΔNDVI de cada par ordenado
+    de años (inicial < final) en una sola ejecución. Cada año se lee una
+    sola vez y se comparte entre todos los pares en que participa.
+    
+    Salidas (una banda por par, descripción 'AAAA_AAAA'):
+        - cubo de clases uint8 (0-5, 255 = nodata)
+        - cubo de ΔNDVI cuantizado uint8 (escala/desplazamiento en los
+          metadatos de banda, ver CUBO_DELTA_ESCALA)
+    
+    Parámetros:
+    -----------
+    rutas_por_year : dict
+        {año: ruta al archivo de índices}
+    salidas : tuple of Path
+        (ruta_cubo_clases, ruta_cubo_delta)
+    umbrales : dict
+        Diccionario con umbrales de clasificación
+    pila : PilaRaster, optional
+        Caché de bandas compartida entre métodos
+    por_ventanas : bool
+        Recorrer la escena por ventanas en vez de bandas completas
+    filas_ventana : int
+        Filas por ventana en modo por ventanas
+        
+    Retorna:
+    --------
+    df_pares : DataFrame
+        Una fila por par: píxeles, hectáreas y % por clase y ΔNDVI medio
+    """
+    
+    print("\n" + "="*70)
+    print("MODO LOTE: CUBO DE CAMBIOS PARA TODOS LOS PARES DE AÑOS")
+    print("="*70)
+    
+    if umbrales is None:
+        umbrales = UMBRALES
+    
+    years = sorted(rutas_por_year)
+    pares = [(a, b) for i, a in enumerate(years) for b in years[i + 1:]]
+    print(f"\n📅 {len(pares)} pares de {len(years)} años: "
+          + ', '.join(f'{a}→{b}' for a, b in pares))
+    
+    motor = MotorReglas(CONDICIONES_CAMBIO, REGLAS_CAMBIO, umbrales)
+    indices = list(dict.fromkeys(['ndvi'] + motor.indices))
+    
+    pila = pila if pila is not None else PilaRaster()
+    ruta_ref = rutas_por_year[years[0]]
+    ventanas = pila.ventanas(ruta_ref, filas_ventana) if por_ventanas else [None]
+    
+    conteos = {par: ConteoClases(nodata=255) for par in pares}
+    acumuladores = {par: AcumuladorEstadisticas(rango=(-2, 2)) for par in pares}
+    
+    profile = pila.perfil(ruta_ref)
+    with ExitStack() as archivos:
+        dst_clases = archivos.enter_context(
+            escribir_cog(salidas[0], profile, count=len(pares), dtype='uint8', nodata=255))
+        dst_delta = archivos.enter_context(
+            escribir_cog(salidas[1], profile, remuestreo='average', count=len(pares),
+                         dtype='uint8', nodata=255))
+        for k, (a, b) in enumerate(pares, start=1):
+            dst_clases.set_band_description(k, f'{a}_{b}')
+            dst_delta.set_band_description(k, f'{a}_{b}')
+        dst_delta.scales = [CUBO_DELTA_ESCALA] * len(pares)
+        dst_delta.offsets = [CUBO_DELTA_DESPLAZAMIENTO] * len(pares)
+        
+        for ventana in ventanas:
+            # Bandas de cada año, leídas una vez por ventana para todos los pares
+            bandas = {year: {nombre: pila.leer(rutas_por_year[year], nombre, ventana)
+                             for nombre in indices}
+                      for year in years}
+            
+            area = area_ventana(pila.area_filas(ruta_ref), ventana)
+            
+            for k, par in enumerate(pares, start=1):
+                bandas_t1, bandas_t2 = bandas[par[0]], bandas[par[1]]
+                clase, mask_valido = _kernel_multicriterio(motor, bandas_t1, bandas_t2)
+                conteos[par].agregar(clase, area=area)
+                dst_clases.write(clase, k, window=ventana)
+                
+                # ΔNDVI cuantizado (redondeo al entero más cercano)
+                delta = np.where(mask_valido, bandas_t2['ndvi'] - bandas_t1['ndvi'], np.nan)
+                acumuladores[par].agregar(delta, mask_valido)
+                q = np.clip((delta - CUBO_DELTA_DESPLAZAMIENTO) / CUBO_DELTA_ESCALA + 0.5, 0, 254)
+                delta_q = np.where(mask_valido, q, 255).astype(np.uint8)
+                dst_delta.write(delta_q, k, window=ventana)
+    
+    for ruta in salidas:
+        print(f"   ✓ Guardado: {Path(ruta).name}")
+    
+    # Tabla por par
+    filas = []
+    for a, b in pares:
+        conteo = conteos[(a, b)]
+        fila = {'year_inicio': a, 'year_fin': b, 'pixeles_validos': conteo.validos}
+        for info in conteo.tabla(CLASES_CAMBIO):
+            col = _nombre_columna(info['nombre'])
+            fila[f'{col}_px'] = info['pixeles']
+            fila[f'{col}_ha'] = info['hectareas']
+            fila[f'{col}_pct'] = info['porcentaje']
+        stats_delta = acumuladores[(a, b)].resultado()
+        fila['delta_ndvi_media'] = stats_delta['mean']
+        fila['delta_ndvi_std'] = stats_delta['std']
+        filas.append(fila)
+    df_pares = pd.DataFrame(filas)
+    
+    print(f"\n📊 Resultados por par:")
+    print(f"   {'Par':<11} {'Urbanización':>14} {'Pérdida veg.':>14} {'Ganancia veg.':>14} {'ΔNDVI':>8}")
+    print(f"   {'-'*65}")
+    for fila in filas:
+        print(f"   {fila['year_inicio']}→{fila['year_fin']:<6} {fila['urbanizacion_ha']:>11.2f} ha "
+              f"{fila['perdida_vegetacion_ha']:>11.2f} ha {fila['ganancia_vegetacion_ha']:>11.2f} ha "
+              f"{fila['delta_ndvi_media']:>+8.4f}")
+    
+    return df_pares
+
+
+def sensibilidad_umbrales(ruta_t1, ruta_t2, rutas_serie=None, grilla=None, pila=None,
+                          por_ventanas=False, filas_ventana=FILAS_VENTANA):
+    """
+    ANÁLISIS DE SENSIBILIDAD DE UMBRALES
+    =====================================
+    Superficie por clase de cambio para toda una grilla de umbrales, a
+    partir de histogramas calculados en una sola lectura de los rasters.
+    
+    - Método 2: histograma conjunto de los términos con umbral en la grilla
+      (ΔNDVI, ΔNDBI, NDVI_t1, NDBI_t2) con los umbrales candidatos como
+      bordes de bin; cada combinación se evalúa con la tabla de reglas
+      sobre las celdas del histograma (ver change_rules.BarridoUmbrales).
+    - Método 3: histograma del Z-score con bordes en ±zscore_umbral.
+    
+    Los conteos son exactos: coinciden con los de una ejecución completa
+    con esos umbrales.
+    
+    Parámetros:
+    -----------
+    ruta_t1, ruta_t2 : Path
+        Archivos de índices del año inicial y final
+    rutas_serie : list of Path, optional
+        Serie para el Z-score (se omite con menos de 3 años)
+    grilla : dict
+        {clave de UMBRALES: valores candidatos} (default: GRILLA_SENSIBILIDAD)
+    pila : PilaRaster, optional
+        Caché de bandas compartida entre métodos
+    por_ventanas : bool
+        Recorrer la escena por ventanas en vez de bandas completas
+    filas_ventana : int
+        Filas por ventana en modo por ventanas
+        
+    Retorna:
+    --------
+    df_clases : DataFrame
+        Una fila por combinación de umbrales con las hectáreas por clase
+    df_z : DataFrame or None
+        Hectáreas de anomalía negativa/positiva por zscore_umbral
+    """
+    
+    print("\n" + "="*70)
+    print("ANÁLISIS DE SENSIBILIDAD DE UMBRALES")
+    print("="*70)
+    
+    grilla = dict(grilla if grilla is not None else GRILLA_SENSIBILIDAD)
+    grilla_z = grilla.pop('zscore_umbral', None)
+    rutas_serie = rutas_serie or []
+    usar_z = grilla_z is not None and len(rutas_serie) >= 3
+    
+    barrido = BarridoUmbrales(CONDICIONES_CAMBIO, REGLAS_CAMBIO, UMBRALES, grilla)
+    indices = list(dict.fromkeys(['ndvi'] + barrido.motor.indices))
+    n_combinaciones = int(np.prod([len(v) for v in grilla.values()]))
+    print(f"\n🎚️  {n_combinaciones} combinaciones de umbrales ({', '.join(grilla)})")
+    
+    if usar_z:
+        bordes_z = np.array(sorted({np.float32(s * z) for z in grilla_z for s in (-1, 1)}),
+                            dtype=np.float32)
+        histograma_z = np.zeros(2 * len(bordes_z) + 1)
+        rutas_historicas = rutas_serie[:-1]
+    
+    pila = pila if pila is not None else PilaRaster()
+    ventanas = pila.ventanas(ruta_t1, filas_ventana) if por_ventanas else [None]
+    
+    # Única lectura de los rasters: histogramas (píxeles y hectáreas)
+    for ventana in ventanas:
+        area = area_ventana(pila.area_filas(ruta_t1), ventana)
+        bandas_t1 = {nombre: pila.leer(ruta_t1, nombre, ventana) for nombre in indices}
+        bandas_t2 = {nombre: pila.leer(ruta_t2, nombre, ventana) for nombre in indices}
+        mask_valido = (bandas_t1['ndvi'] != -9999) & (bandas_t2['ndvi'] != -9999)
+        barrido.agregar(bandas_t1, bandas_t2, mask_valido, area)
+        
+        if usar_z:
+            media_hist, std_hist = _historico_ndvi(pila, rutas_historicas, ventana)
+            actual = pila.leer(rutas_serie[-1], 'ndvi', ventana)
+            z_score, _, mask_z = _kernel_zscore(actual, media_hist, std_hist, 0)
+            mask_z &= np.isfinite(z_score)
+            histograma_z += np.bincount(indice_bin(z_score[mask_z], bordes_z),
+                                        weights=np.broadcast_to(area, mask_z.shape)[mask_z],
+                                        minlength=histograma_z.size)
+    
+    print(f"   Celdas no vacías del histograma: {barrido.celdas.size:,}")
+    
+    # Evaluación de la grilla completa sobre el histograma
+    inicio = time.perf_counter()
+    filas = []
+    for combinacion, conteo, hectareas in barrido.resultados():
+        fila = dict(combinacion)
+        fila['pixeles_validos'] = int(conteo[:255].sum())
+        for clase_id, nombre in CLASES_CAMBIO.items():
+            fila[f'{_nombre_columna(nombre)}_ha'] = hectareas[clase_id]
+        filas.append(fila)
+    df_clases = pd.DataFrame(filas)
+    
+    df_z = None
+    if usar_z:
+        filas_z = []
+        for z in grilla_z:
+            j_neg = int(np.searchsorted(bordes_z, np.float32(-z)))
+            j_pos = int(np.searchsorted(bordes_z, np.float32(z)))
+            negativa = histograma_z[bins_que_cumplen(len(bordes_z), '<', j_neg)].sum()
+            positiva = histograma_z[bins_que_cumplen(len(bordes_z), '>', j_pos)].sum()
+            filas_z.append({'zscore_umbral': z,
+                            'anomalia_negativa_ha': negativa,
+                            'anomalia_positiva_ha': positiva})
+        df_z = pd.DataFrame(filas_z)
+    
+    print(f"   Grilla evaluada en {1000 * (time.perf_counter() - inicio):.1f} ms")
+    
+    # Resumen: sensibilidad de la urbanización a cada umbral (resto fijo)
+    print(f"\n📊 Urbanización (ha) variando un umbral (resto según UMBRALES):")
+    for clave, valores in grilla.items():
+        fijos = {c: _mas_cercano(v, UMBRALES[c]) for c, v in grilla.items() if c != clave}
+        sel = df_clases
+        for c, v in fijos.items():
+            sel = sel[sel[c] == v]
+        serie = ', '.join(f"{fila[clave]:g}→{fila['urbanizacion_ha']:.0f}" for _, fila in sel.iterrows())
+        print(f"   {clave:<12} {serie}")
+    if df_z is not None:
+        serie = ', '.join(f"{fila['zscore_umbral']:g}→{fila['anomalia_negativa_ha']:.0f}"
+                          for _, fila in df_z.iterrows())
+        print(f"   {'zscore (neg)':<12} {serie}")
+    
+    return df_clases, df_z
+
+
+def _mas_cercano(valores, objetivo):
+    """Valor de la grilla más cercano a `objetivo`."""
+    return min(valores, key=lambda v: abs(v - objetivo))
+
+
+def graficar_sensibilidad(df_clases, df_z, ruta_salida, grilla=None):
+    """
+    Gráfico de sensibilidad: hectáreas por clase en función de cada umbral,
+    con los demás fijos en su valor de UMBRALES (línea punteada = valor actual).
+    
+    Parámetros:
+    -----------
+    df_clases, df_z : DataFrame
+        Resultados de sensibilidad_umbrales
+    ruta_salida : Path
+        Ruta del PNG
+    grilla : dict
+        Grilla utilizada (default: GRILLA_SENSIBILIDAD)
+    """
+    grilla = grilla if grilla is not None else GRILLA_SENSIBILIDAD
+    actual = {c: _mas_cercano(grilla[c], UMBRALES[c]) for c in grilla}
+    
+    def seleccionar(**fijos):
+        sel = df_clases
+        for c, v in fijos.items():
+            sel = sel[sel[c] == v]
+        return sel
+    
+    fig, axes = plt.subplots(2, 2, figsize=(14, 10))
+    
+    # Urbanización vs cambio_min, una curva por ndvi_veg
+    ax = axes[0, 0]
+    for v in grilla['ndvi_veg']:
+        sel = seleccionar(ndvi_veg=v, ndbi_urbano=actual['ndbi_urbano'])
+        ax.plot(sel['cambio_min'], sel['urbanizacion_ha'], marker='o', label=f'ndvi_veg={v:g}')
+    ax.axvline(UMBRALES['cambio_min'], color='gray', linestyle='--')
+    ax.set_xlabel('cambio_min')
+    ax.set_ylabel('Urbanización (ha)', fontweight='bold')
+    ax.set_title(f"Urbanización vs cambio_min (ndbi_urbano={actual['ndbi_urbano']:g})",
+                 fontsize=12, fontweight='bold')
+    ax.legend(fontsize=8)
+    ax.grid(True, alpha=0.3)
+    
+    # Urbanización vs ndbi_urbano, una curva por ndvi_veg
+    ax = axes[0, 1]
+    for v in grilla['ndvi_veg']:
+        sel = seleccionar(ndvi_veg=v, cambio_min=actual['cambio_min'])
+        ax.plot(sel['ndbi_urbano'], sel['urbanizacion_ha'], marker='o', label=f'ndvi_veg={v:g}')
+    ax.axvline(UMBRALES['ndbi_urbano'], color='gray', linestyle='--')
+    ax.set_xlabel('ndbi_urbano')
+    ax.set_ylabel('Urbanización (ha)', fontweight='bold')
+    ax.set_title(f"Urbanización vs ndbi_urbano (cambio_min={actual['cambio_min']:g})",
+                 fontsize=12, fontweight='bold')
+    ax.legend(fontsize=8)
+    ax.grid(True, alpha=0.3)
+    
+    # Pérdida y ganancia de vegetación vs cambio_min
+    ax = axes[1, 0]
+    sel = seleccionar(ndvi_veg=actual['ndvi_veg'], ndbi_urbano=actual['ndbi_urbano'])
+    ax.plot(sel['cambio_min'], sel['perdida_vegetacion_ha'], marker='o', color='red',
+            label='Pérdida vegetación')
+    ax.plot(sel['cambio_min'], sel['ganancia_vegetacion_ha'], marker='o', color='green',
+            label='Ganancia vegetación')
+    ax.axvline(UMBRALES['cambio_min'], color='gray', linestyle='--')
+    ax.set_xlabel('cambio_min')
+    ax.set_ylabel('Hectáreas', fontweight='bold')
+    ax.set_title('Vegetación vs cambio_min', fontsize=12, fontweight='bold')
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    
+    # Anomalías Z-score vs zscore_umbral
+    ax = axes[1, 1]
+    if df_z is not None:
+        ax.plot(df_z['zscore_umbral'], df_z['anomalia_negativa_ha'], marker='o', color='red',
+                label='Anomalía negativa')
+        ax.plot(df_z['zscore_umbral'], df_z['anomalia_positiva_ha'], marker='o', color='green',
+                label='Anomalía positiva')
+        ax.axvline(UMBRALES['zscore_umbral'], color='gray', linestyle='--')
+        ax.legend()
+    ax.set_xlabel('zscore_umbral')
+    ax.set_ylabel('Hectáreas', fontweight='bold')
+    ax.set_title('Anomalías Z-score vs zscore_umbral', fontsize=12, fontweight='bold')
+    ax.grid(True, alpha=0.3)
+    
+    plt.suptitle(f'Sensibilidad de Umbrales - Peñaflor {YEAR_INICIO}-{YEAR_FIN}',
+                 fontsize=16, fontweight='bold')
+    plt.tight_layout()
+    
+    ruta_salida.parent.mkdir(parents=True, exist_ok=True)
+    plt.savefig(ruta_salida, dpi=150, bbox_inches='tight')
+    print(f"   ✓ Guardado: {ruta_salida.name}")
+    
+    plt.close()
+
+
+def _kernel_trayectoria(pila, rutas_por_year, ventana, umbral):
+    """
+    Trayectoria del NDVI de un bloque recorriendo los años en orden, uno a la
+    vez: solo se guarda el primer y el último valor válido, el año del primer
+    paso significativo, el primer año en que el NDVI se aleja más de `umbral`
+    del valor inicial (año de cambio de las trayectorias graduales) y el
+    número de pasos significativos por sentido.
+    """
+    primero = previo = anio_cambio = anio_desvio = pasos_pos = pasos_neg = None
+    for year, ruta in sorted(rutas_por_year.items()):
+        ndvi = pila.leer(ruta, 'ndvi', ventana)
+        valido = ndvi != -9999
+        if primero is None:
+            primero = np.where(valido, ndvi, np.nan).astype(np.float32)
+            previo = primero.copy()
+            anio_cambio = np.zeros(ndvi.shape, dtype=np.int16)
+            anio_desvio = np.zeros(ndvi.shape, dtype=np.int16)
+            pasos_pos = np.zeros(ndvi.shape, dtype=np.uint8)
+            pasos_neg = np.zeros(ndvi.shape, dtype=np.uint8)
+            continue
+        
+        # Paso respecto del último año válido del píxel (NaN si falta alguno)
+        actual = np.where(valido, ndvi, np.nan)
+        paso = actual - previo
+        sube = paso > umbral
+        baja = paso < -umbral
+        pasos_pos += sube
+        pasos_neg += baja
+        anio_cambio[(sube | baja) & (anio_cambio == 0)] = year
+        anio_desvio[(np.abs(actual - primero) > umbral) & (anio_desvio == 0)] = year
+        
+        # Años sin dato no cortan la trayectoria
+        nuevo = valido & np.isnan(primero)
+        primero[nuevo] = ndvi[nuevo]
+        previo[valido] = ndvi[valido]
+    
+    mask_valido = ~np.isnan(primero)
+    neto = previo - primero
+    significativo = np.abs(neto) > umbral
+    pasos = pasos_pos.astype(np.int16) + pasos_neg
+    
+    clase = np.zeros(neto.shape, dtype=np.uint8)
+    clase[significativo & (pasos != 1)] = 2
+    clase[significativo & (pasos == 1)] = 1
+    clase[((pasos_pos > 0) & (pasos_neg > 0)) | ((pasos > 0) & ~significativo)] = 3
+    clase[~mask_valido] = 255
+    
+    # Graduales: el cambio ocurre cuando el NDVI se aleja del inicial, aunque
+    # ningún paso aislado supere el umbral
+    gradual = clase == 2
+    anio_cambio[gradual] = anio_desvio[gradual]
+    
+    magnitud = np.full(neto.shape, -32768, dtype=np.int16)
+    magnitud[mask_valido] = np.round(
+        np.clip(neto[mask_valido], -2, 2) * ESCALA_MAGNITUD).astype(np.int16)
+    anio_cambio[~mask_valido] = -1
+    
+    return anio_cambio, magnitud, clase
+
+
+def trayectorias_cambio(rutas_por_year, salidas, umbral=0.15, pila=None, por_ventanas=False,
+                        filas_ventana=FILAS_VENTANA):
     """
-    Guarda un array como archivo GeoTIFF.
+    MODO TRAYECTORIAS: Año de Cambio y Tipo de Trayectoria por Píxel
+    =================================================================
+    Recorre todos los años disponibles en orden, leyendo uno a la vez (la
+    memoria no depende del largo de la serie), y clasifica la trayectoria
+    del NDVI de cada píxel.
+    
+    Salidas (enteros compactos):
+        - año del primer paso significativo; en trayectorias graduales, primer
+          año en que |NDVI − NDVI inicial| > umbral (int16; 0 = sin cambio,
+          -1 = nodata)
+        - magnitud: ΔNDVI neto primer → último año × ESCALA_MAGNITUD
+          (int16; -32768 = nodata)
+        - clase de trayectoria (uint8, ver CLASES_TRAYECTORIA; 255 = nodata)
+    
+    Parámetros:
+    -----------
+    rutas_por_year : dict
+        {año: ruta al archivo de índices}
+    salidas : tuple of Path
+        (ruta_anio_cambio, ruta_magnitud, ruta_clase)
+    umbral : float
+        |ΔNDVI| mínimo de un paso (o del cambio neto) significativo
+    pila : PilaRaster, optional
+        Caché de bandas compartida entre métodos
+    por_ventanas : bool
+        Recorrer la escena por ventanas en vez de bandas completas
+    filas_ventana : int
+        Filas por ventana en modo por ventanas
+        
+    Retorna:
+    --------
+    df_trayectorias : DataFrame
+        Hectáreas por año de cambio (filas) y clase de trayectoria (columnas)
     """
-    profile.update({
-        'count': 1,
-        'dtype': dtype,
-        'nodata': nodata
-    })
     
-    with rasterio.open(ruta_salida, 'w', **profile) as dst:
+    print("\n" + "="*70)
+    print("MODO TRAYECTORIAS: AÑO DE CAMBIO Y TIPO DE TRAYECTORIA")
+    print("="*70)
+    
+    years = sorted(rutas_por_year)
+    print(f"\n📅 Serie: {', '.join(str(y) for y in years)} (umbral de paso: {umbral})")
+    
+    pila = pila if pila is not None else PilaRaster()
+    ruta_ref = rutas_por_year[years[0]]
+    ventanas = pila.ventanas(ruta_ref, filas_ventana) if por_ventanas else [None]
+    
+    # Conteo y superficie conjunta año de cambio × clase (año 0 = sin cambio)
+    anios = [0] + years[1:]
+    conteo = np.zeros((len(anios), len(CLASES_TRAYECTORIA)), dtype=np.int64)
+    hectareas = np.zeros(conteo.shape)
+    posicion_anio = np.zeros(max(years) + 1, dtype=np.int64)
+    posicion_anio[anios] = np.arange(len(anios))
+    
+    profile = pila.perfil(ruta_ref)
+    with ExitStack() as archivos:
+        destinos = [
+            archivos.enter_context(escribir_cog(salidas[0], profile, count=1, dtype='int16', nodata=-1)),
+            archivos.enter_context(escribir_cog(salidas[1], profile, remuestreo='average', count=1,
+                                                dtype='int16', nodata=-32768)),
+            archivos.enter_context(escribir_cog(salidas[2], profile, count=1, dtype='uint8', nodata=255)),
+        ]
+        destinos[0].set_band_description(1, f'Anio_Primer_Cambio_{years[0]}_{years[-1]}')
+        destinos[1].set_band_description(1, f'Magnitud_NDVI_x{ESCALA_MAGNITUD}_{years[0]}_{years[-1]}')
+        destinos[2].set_band_description(1, f'Clase_Trayectoria_{years[0]}_{years[-1]}')
+        
+        for ventana in ventanas:
+            anio_cambio, magnitud, clase = _kernel_trayectoria(pila, rutas_por_year, ventana, umbral)
+            for dst, datos in zip(destinos, (anio_cambio, magnitud, clase)):
+                dst.write(datos, 1, window=ventana)
+            
+            valido = clase != 255
+            area = np.broadcast_to(area_ventana(pila.area_filas(ruta_ref), ventana), valido.shape)
+            celda = posicion_anio[anio_cambio[valido]] * conteo.shape[1] + clase[valido]
+            conteo += np.bincount(celda, minlength=conteo.size).reshape(conteo.shape)
+            hectareas += np.bincount(celda, weights=area[valido],
+                                     minlength=conteo.size).reshape(conteo.shape)
+    
+    for ruta in salidas:
+        print(f"   ✓ Guardado: {Path(ruta).name}")
+    
+    df_trayectorias = pd.DataFrame(
+        hectareas,
+        index=pd.Index(anios, name='anio_cambio'),
+        columns=[f'{_nombre_columna(n)}_ha' for n in CLASES_TRAYECTORIA.values()]
+    ).reset_index()
+    
+    total = conteo.sum()
+    print(f"\n📊 Resultados por tipo de trayectoria:")
+    for clase_id, nombre in CLASES_TRAYECTORIA.items():
+        pixeles = int(conteo[:, clase_id].sum())
+        pct = 100 * pixeles / total if total > 0 else 0
+        print(f"   {nombre:<10} {pixeles:>10,} px ({pct:5.2f}%) = {hectareas[:, clase_id].sum():.2f} ha")
+    print(f"\n   Primer año de cambio (ha):")
+    for i, anio in enumerate(anios[1:], start=1):
+        print(f"   {anio}: {hectareas[i].sum():.2f} ha")
+    
+    return df_trayectorias
+
+
+def guardar_raster(array, ruta_salida, profile, banda_nombre="cambio", dtype='int8', nodata=-128):
+    """
+    Guarda un array como Cloud-Optimized GeoTIFF (teselado, comprimido y
+    con overviews: promedio para valores continuos, moda para clases).
+    """
+    with escribir_cog(ruta_salida, profile, count=1, dtype=dtype, nodata=nodata) as dst:
         dst.write(array.astype(dtype), 1)
         dst.set_band_description(1, banda_nombre)
     
@@ -407,6 +1088,25 @@ def main():
     Función principal: ejecuta los 3 métodos de detección de cambios.
     """
     
+    parser = argparse.ArgumentParser(description='Detección de cambios urbanos (Fase 3)')
+    parser.add_argument('--forzar', action='store_true',
+                        help='Recalcular aunque el manifiesto indique que los productos están al día')
+    parser.add_argument('--por-ventanas', action='store_true',
+                        help='Procesar cada método por ventanas y escribir las salidas de forma '
+                             'incremental (escenas que no caben en memoria)')
+    parser.add_argument('--filas-ventana', type=int, default=FILAS_VENTANA,
+                        help=f'Filas por ventana con --por-ventanas (default: {FILAS_VENTANA})')
+    parser.add_argument('--sensibilidad', action='store_true',
+                        help='Análisis de sensibilidad de UMBRALES sobre GRILLA_SENSIBILIDAD '
+                             '(sensibilidad_umbrales.csv, sensibilidad_zscore.csv y gráfico)')
+    parser.add_argument('--trayectorias', action='store_true',
+                        help='Año del primer cambio, magnitud y tipo de trayectoria por píxel '
+                             'recorriendo todos los años (trayectoria_*.tif)')
+    parser.add_argument('--todos-pares', action='store_true',
+                        help='Calcular además clasificación y ΔNDVI para todos los pares de años '
+                             '(cubo_cambio_clases.tif, cubo_delta_ndvi.tif, estadisticas_pares.csv)')
+    args = parser.parse_args()
+    
     # Rutas de archivos
     file_t1 = INPUT_DIR / f'indices_{YEAR_INICIO}.tif'
     file_t2 = INPUT_DIR / f'indices_{YEAR_FIN}.tif'
@@ -418,56 +1118,99 @@ def main():
         print(f"   Buscado: {file_t2}")
         return
     
+    # Manifiesto: cada método se omite si sus entradas, umbrales y código no cambiaron
+    manifiesto = Manifiesto(OUTPUT_DIR / NOMBRE_MANIFIESTO, forzar=args.forzar)
+    codigo = version_codigo(*ARCHIVOS_CODIGO)
+    
     # Almacenar estadísticas de todos los métodos
     todas_stats = []
     
+    # Pila compartida: cada año/banda se decodifica una sola vez en la ejecución
+    # (en modo por ventanas solo se leen ventanas, sin decodificar la escena)
+    pila = PilaRaster(directorio=OUTPUT_DIR)
+    profile = pila.perfil(file_t1)
+    if args.por_ventanas:
+        print(f"🧩 Modo por ventanas: {args.filas_ventana} filas por ventana\n")
+    
+    def en_ventanas(salidas):
+        """Argumentos de modo por ventanas para un método (vacío si no aplica)."""
+        if not args.por_ventanas:
+            return {}
+        return {'salidas': salidas, 'filas_ventana': args.filas_ventana}
+    
     # =========================================================================
     # MÉTODO 1: Diferencia Simple
     # =========================================================================
-    cambio_dif, diferencia, stats_dif = detectar_cambio_diferencia(
-        file_t1, 
-        file_t2, 
-        umbral=UMBRALES['cambio_min']
-    )
-    
-    # Guardar resultados Método 1
-    with rasterio.open(file_t1) as src:
-        profile = src.profile.copy()
-    
-    guardar_raster(
-        cambio_dif, 
-        OUTPUT_DIR / 'cambio_diferencia.tif', 
-        profile, 
-        banda_nombre=f'Diferencia_NDVI_{YEAR_INICIO}_{YEAR_FIN}',
-        dtype='int8',
-        nodata=-128
-    )
-    
-    guardar_raster(
-        diferencia, 
-        OUTPUT_DIR / 'cambio_diferencia_continua.tif', 
-        profile, 
-        banda_nombre=f'Delta_NDVI_{YEAR_INICIO}_{YEAR_FIN}',
-        dtype='float32',
-        nodata=-9999
-    )
+    salidas_dif = [OUTPUT_DIR / 'cambio_diferencia.tif', OUTPUT_DIR / 'cambio_diferencia_continua.tif']
+    huella = manifiesto.huella([file_t1, file_t2], {'umbral': UMBRALES['cambio_min']}, codigo)
+    
+    if manifiesto.actualizado('cambio_diferencia', huella, salidas_dif):
+        print("✓ Método 1 (Diferencia Simple) al día, se omite")
+        stats_dif = manifiesto.datos('cambio_diferencia')
+    else:
+        cambio_dif, diferencia, stats_dif = detectar_cambio_diferencia(
+            file_t1, 
+            file_t2, 
+            umbral=UMBRALES['cambio_min'],
+            pila=pila,
+            **en_ventanas(salidas_dif)
+        )
+        
+        # Guardar resultados Método 1 (en modo por ventanas ya se escribieron)
+        if cambio_dif is not None:
+            guardar_raster(
+                cambio_dif, 
+                salidas_dif[0], 
+                profile, 
+                banda_nombre=f'Diferencia_NDVI_{YEAR_INICIO}_{YEAR_FIN}',
+                dtype='int8',
+                nodata=-128
+            )
+            
+            guardar_raster(
+                diferencia, 
+                salidas_dif[1], 
+                profile, 
+                banda_nombre=f'Delta_NDVI_{YEAR_INICIO}_{YEAR_FIN}',
+                dtype='float32',
+                nodata=-9999
+            )
+        del cambio_dif, diferencia
+        
+        manifiesto.registrar('cambio_diferencia', huella, salidas_dif, datos=stats_dif)
+        manifiesto.guardar()
     
     todas_stats.append(stats_dif)
     
     # =========================================================================
     # MÉTODO 2: Clasificación Multicriterio
     # =========================================================================
-    clase, stats_multi = clasificar_cambio_urbano(file_t1, file_t2, UMBRALES)
-    
-    # Guardar resultados Método 2
-    guardar_raster(
-        clase, 
-        OUTPUT_DIR / 'cambio_clasificado.tif', 
-        profile, 
-        banda_nombre=f'Clasificacion_Cambio_{YEAR_INICIO}_{YEAR_FIN}',
-        dtype='uint8',
-        nodata=255
-    )
+    salidas_multi = [OUTPUT_DIR / 'cambio_clasificado.tif']
+    huella = manifiesto.huella([file_t1, file_t2], {'umbrales': UMBRALES,
+                                                   'condiciones': CONDICIONES_CAMBIO,
+                                                   'reglas': REGLAS_CAMBIO}, codigo)
+    
+    if manifiesto.actualizado('cambio_clasificado', huella, salidas_multi):
+        print("✓ Método 2 (Clasificación Multicriterio) al día, se omite")
+        stats_multi = manifiesto.datos('cambio_clasificado')
+    else:
+        clase, stats_multi = clasificar_cambio_urbano(file_t1, file_t2, UMBRALES, pila=pila,
+                                                      **en_ventanas(salidas_multi[0]))
+        
+        # Guardar resultados Método 2
+        if clase is not None:
+            guardar_raster(
+                clase, 
+                salidas_multi[0], 
+                profile, 
+                banda_nombre=f'Clasificacion_Cambio_{YEAR_INICIO}_{YEAR_FIN}',
+                dtype='uint8',
+                nodata=255
+            )
+        del clase
+        
+        manifiesto.registrar('cambio_clasificado', huella, salidas_multi, datos=stats_multi)
+        manifiesto.guardar()
     
     todas_stats.append(stats_multi)
     
@@ -478,32 +1221,131 @@ def main():
     rutas_existentes = [r for r in rutas_serie if r.exists()]
     
     if len(rutas_existentes) >= 3:  # Necesitamos al menos 3 años para histórico
-        z_score, cambio_sig, direccion, stats_z = analisis_zscore(rutas_existentes, indice_analisis=-1)
+        salidas_z = [OUTPUT_DIR / 'cambio_zscore.tif', OUTPUT_DIR / 'cambio_zscore_valores.tif']
+        huella = manifiesto.huella(rutas_existentes, {'zscore_umbral': UMBRALES['zscore_umbral']}, codigo)
         
-        # Guardar resultados Método 3
-        guardar_raster(
-            direccion, 
-            OUTPUT_DIR / 'cambio_zscore.tif', 
-            profile, 
-            banda_nombre=f'Zscore_Direccion_{YEAR_FIN}',
-            dtype='int8',
-            nodata=-128
-        )
-        
-        guardar_raster(
-            z_score, 
-            OUTPUT_DIR / 'cambio_zscore_valores.tif', 
-            profile, 
-            banda_nombre=f'Zscore_Valores_{YEAR_FIN}',
-            dtype='float32',
-            nodata=-9999
-        )
+        if manifiesto.actualizado('cambio_zscore', huella, salidas_z):
+            print("✓ Método 3 (Análisis Z-score) al día, se omite")
+            stats_z = manifiesto.datos('cambio_zscore')
+        else:
+            z_score, cambio_sig, direccion, stats_z = analisis_zscore(
+                rutas_existentes, indice_analisis=-1, pila=pila, **en_ventanas(salidas_z))
+            
+            # Guardar resultados Método 3
+            if z_score is not None:
+                guardar_raster(
+                    direccion, 
+                    salidas_z[0], 
+                    profile, 
+                    banda_nombre=f'Zscore_Direccion_{YEAR_FIN}',
+                    dtype='int8',
+                    nodata=-128
+                )
+                guardar_raster(
+                    z_score, 
+                    salidas_z[1], 
+                    profile, 
+                    banda_nombre=f'Zscore_Valores_{YEAR_FIN}',
+                    dtype='float32',
+                    nodata=-9999
+                )
+            del z_score, cambio_sig, direccion
+            
+            manifiesto.registrar('cambio_zscore', huella, salidas_z, datos=stats_z)
+            manifiesto.guardar()
         
         todas_stats.append(stats_z)
     else:
         print(f"\n⚠️  Advertencia: Se necesitan al menos 3 años para Z-score.")
         print(f"   Años disponibles: {len(rutas_existentes)}")
     
+    # =========================================================================
+    # MODO TRAYECTORIAS: Todos los años, un año a la vez
+    # =========================================================================
+    if args.trayectorias:
+        rutas_tray = {year: INPUT_DIR / f'indices_{year}.tif' for year in YEARS_ALL
+                      if (INPUT_DIR / f'indices_{year}.tif').exists()}
+        salidas_tray = [OUTPUT_DIR / 'trayectoria_anio_cambio.tif',
+                        OUTPUT_DIR / 'trayectoria_magnitud.tif',
+                        OUTPUT_DIR / 'trayectoria_clase.tif',
+                        OUTPUT_DIR / 'estadisticas_trayectorias.csv']
+        huella = manifiesto.huella(list(rutas_tray.values()),
+                                   {'umbral': UMBRALES['cambio_min'],
+                                    'escala_magnitud': ESCALA_MAGNITUD}, codigo)
+        
+        if len(rutas_tray) < 2:
+            print(f"\n⚠️  Advertencia: Se necesitan al menos 2 años para las trayectorias.")
+        elif manifiesto.actualizado('trayectorias', huella, salidas_tray):
+            print("\n✓ Trayectorias al día, se omite")
+        else:
+            df_tray = trayectorias_cambio(rutas_tray, salidas_tray[:3], UMBRALES['cambio_min'],
+                                          pila=pila, por_ventanas=args.por_ventanas,
+                                          filas_ventana=args.filas_ventana)
+            df_tray.to_csv(salidas_tray[3], index=False)
+            print(f"   ✓ Guardado: {salidas_tray[3].name}")
+            
+            manifiesto.registrar('trayectorias', huella, salidas_tray)
+            manifiesto.guardar()
+    
+    # =========================================================================
+    # ANÁLISIS DE SENSIBILIDAD DE UMBRALES
+    # =========================================================================
+    if args.sensibilidad:
+        rutas_serie_z = rutas_existentes if rutas_existentes[-1:] == [file_t2] else []
+        salidas_sens = [OUTPUT_DIR / 'sensibilidad_umbrales.csv',
+                        OUTPUT_DIR / 'sensibilidad_zscore.csv',
+                        OUTPUT_DIR_FIG / 'sensibilidad_umbrales.png']
+        huella = manifiesto.huella([file_t1, file_t2] + rutas_serie_z,
+                                   {'umbrales': UMBRALES, 'condiciones': CONDICIONES_CAMBIO,
+                                    'reglas': REGLAS_CAMBIO, 'grilla': GRILLA_SENSIBILIDAD},
+                                   codigo)
+        
+        if manifiesto.actualizado('sensibilidad', huella, salidas_sens[:1] + salidas_sens[2:]):
+            print("\n✓ Análisis de sensibilidad al día, se omite")
+        else:
+            df_sens, df_sens_z = sensibilidad_umbrales(file_t1, file_t2, rutas_serie_z, pila=pila,
+                                                       por_ventanas=args.por_ventanas,
+                                                       filas_ventana=args.filas_ventana)
+            df_sens.to_csv(salidas_sens[0], index=False)
+            print(f"   ✓ Guardado: {salidas_sens[0].name}")
+            if df_sens_z is not None:
+                df_sens_z.to_csv(salidas_sens[1], index=False)
+                print(f"   ✓ Guardado: {salidas_sens[1].name}")
+            graficar_sensibilidad(df_sens, df_sens_z, salidas_sens[2])
+            
+            manifiesto.registrar('sensibilidad', huella, salidas_sens[:1] + salidas_sens[2:])
+            manifiesto.guardar()
+    
+    # =========================================================================
+    # MODO LOTE: Todos los pares de años
+    # =========================================================================
+    if args.todos_pares:
+        rutas_por_year = {year: INPUT_DIR / f'indices_{year}.tif' for year in YEARS_ALL
+                          if (INPUT_DIR / f'indices_{year}.tif').exists()}
+        salidas_pares = [OUTPUT_DIR / 'cubo_cambio_clases.tif', OUTPUT_DIR / 'cubo_delta_ndvi.tif',
+                         OUTPUT_DIR / 'estadisticas_pares.csv']
+        huella = manifiesto.huella(list(rutas_por_year.values()),
+                                   {'umbrales': UMBRALES, 'condiciones': CONDICIONES_CAMBIO,
+                                    'reglas': REGLAS_CAMBIO,
+                                    'delta': [CUBO_DELTA_ESCALA, CUBO_DELTA_DESPLAZAMIENTO]},
+                                   codigo)
+        
+        if len(rutas_por_year) < 2:
+            print(f"\n⚠️  Advertencia: Se necesitan al menos 2 años para el cubo de pares.")
+        elif manifiesto.actualizado('cubo_pares', huella, salidas_pares):
+            print("\n✓ Cubo de pares de años al día, se omite")
+        else:
+            df_pares = cubo_cambios_pares(rutas_por_year, salidas_pares[:2], UMBRALES, pila=pila,
+                                          por_ventanas=args.por_ventanas,
+                                          filas_ventana=args.filas_ventana)
+            df_pares.to_csv(salidas_pares[2], index=False)
+            print(f"   ✓ Guardado: {salidas_pares[2].name}")
+            
+            manifiesto.registrar('cubo_pares', huella, salidas_pares)
+            manifiesto.guardar()
+    
+    pila.cerrar()
+    
     # =========================================================================
     # RESUMEN FINAL Y EXPORTAR ESTADÍSTICAS
     # =========================================================================
@@ -580,7 +1422,16 @@ def main():
         'cambio_clasificado.tif',
         'cambio_zscore.tif',
         'cambio_zscore_valores.tif',
-        'estadisticas_cambios.csv'
+        'estadisticas_cambios.csv',
+        'cubo_cambio_clases.tif',
+        'cubo_delta_ndvi.tif',
+        'estadisticas_pares.csv',
+        'trayectoria_anio_cambio.tif',
+        'trayectoria_magnitud.tif',
+        'trayectoria_clase.tif',
+        'estadisticas_trayectorias.csv',
+        'sensibilidad_umbrales.csv',
+        'sensibilidad_zscore.csv'
     ]
     
     for archivo in archivos_generados:
@@ -7,12 +7,17 @@ Uso:
     python scripts/generate_ndvi_images.py
 """
 
+import argparse
 import rasterio
 import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
 import sys
 
+from pipeline_manifest import NOMBRE_MANIFIESTO, Manifiesto, version_codigo
+from raster_io import indice_banda, iterar_ventanas, leer_reducido
+from streaming_stats import AcumuladorEstadisticas
+
 # Configuración
 BASE_DIR = Path(__file__).parent.parent
 DATA_DIR = BASE_DIR / 'data' / 'processed'
@@ -21,20 +26,36 @@ FIGURES_DIR.mkdir(parents=True, exist_ok=True)
 
 YEARS = [2018, 2020, 2022, 2024]
 
-def generate_ndvi_image(year):
-    """Generar imagen NDVI para un año específico"""
+# Código del que dependen las imágenes (versión en el manifiesto)
+ARCHIVOS_CODIGO = [Path(__file__).resolve().parent / nombre
+                   for nombre in ('generate_ndvi_images.py', 'raster_io.py', 'streaming_stats.py')]
+
+def generate_ndvi_image(year, manifiesto=None):
+    """
+    Generar imagen NDVI para un año específico
+    
+    Si se entrega un manifiesto, la imagen se omite cuando el archivo de
+    índices y el código no cambiaron desde la última generación.
+    """
     
     # Ruta del archivo de índices
     indices_file = DATA_DIR / f'indices_{year}.tif'
+    output_file = FIGURES_DIR / f'ndvi_{year}.png'
     
     if not indices_file.exists():
         print(f"   ⚠️  Archivo no encontrado: {indices_file}")
         return False
     
+    if manifiesto is not None:
+        huella = manifiesto.huella([indices_file], {}, version_codigo(*ARCHIVOS_CODIGO))
+        if manifiesto.actualizado(output_file.name, huella, [output_file]):
+            print(f"   ✓ {year}: {output_file.name} al día, se omite")
+            return True
+    
     try:
-        # Leer banda NDVI (banda 1)
+        # Leer banda NDVI (ubicada por nombre) a resolución de figura
         with rasterio.open(indices_file) as src:
-            ndvi = src.read(1)
+            ndvi = leer_reducido(src, indice_banda(src, 'ndvi'))
             bounds = src.bounds
         
         # Crear figura
@@ -80,27 +101,36 @@ def generate_ndvi_image(year):
         plt.tight_layout()
         
         # Guardar imagen
-        output_file = FIGURES_DIR / f'ndvi_{year}.png'
         plt.savefig(output_file, dpi=150, bbox_inches='tight', facecolor='white')
         plt.close()
         
-        # Calcular estadísticas
-        ndvi_valid = ndvi[(ndvi >= -1) & (ndvi <= 1)]
-        ndvi_mean = np.mean(ndvi_valid)
-        ndvi_std = np.std(ndvi_valid)
-        veg_area_pct = np.sum(ndvi_valid > 0.3) / len(ndvi_valid) * 100
+        # Calcular estadísticas a resolución completa, ventana a ventana
+        # (la banda reducida es solo para la figura)
+        acumulador = AcumuladorEstadisticas(umbrales={'vegetacion': ('>', 0.3)})
+        with rasterio.open(indices_file) as src:
+            banda = indice_banda(src, 'ndvi')
+            for ventana in iterar_ventanas(src):
+                datos = src.read(banda, window=ventana)
+                acumulador.agregar(datos, mascara=(datos >= -1) & (datos <= 1))
+        ndvi_mean = acumulador.media
+        ndvi_std = acumulador.std
+        veg_area_pct = acumulador.fraccion('vegetacion') * 100
         
         print(f"   ✓ {year}: {output_file.name}")
         print(f"      NDVI medio: {ndvi_mean:.3f} ± {ndvi_std:.3f}")
         print(f"      Vegetación: {veg_area_pct:.1f}%")
         
+        if manifiesto is not None:
+            manifiesto.registrar(output_file.name, huella, [output_file])
+            manifiesto.guardar()
+        
         return True
         
     except Exception as e:
         print(f"   ❌ Error al procesar {year}: {e}")
         return False
 
-def main():
+def main(forzar=False):
     """Función principal"""
     print("\n" + "="*70)
     print("   GENERACIÓN DE IMÁGENES NDVI PARA DASHBOARD")
@@ -110,9 +140,10 @@ def main():
     print(f"\n🔄 Procesando {len(YEARS)} años...\n")
     
     success_count = 0
+    manifiesto = Manifiesto(DATA_DIR / NOMBRE_MANIFIESTO, forzar=forzar)
     
     for year in YEARS:
-        if generate_ndvi_image(year):
+        if generate_ndvi_image(year, manifiesto):
             success_count += 1
         print()
     
@@ -132,5 +163,9 @@ def main():
     return success_count == len(YEARS)
 
 if __name__ == "__main__":
-    success = main()
+    parser = argparse.ArgumentParser(description='Imágenes NDVI para el dashboard')
+    parser.add_argument('--forzar', action='store_true',
+                        help='Regenerar aunque el manifiesto indique que las imágenes están al día')
+    args = parser.parse_args()
+    success = main(forzar=args.forzar)
     sys.exit(0 if success else 1)
@@ -0,0 +1,202 @@
+"""
+Manifiesto de Productos del Pipeline
+Proyecto: Detección de Cambios Urbanos - Peñaflor
+
+Registro compartido (JSON) de cada producto generado por los scripts:
+hash de contenido de sus archivos de entrada, parámetros utilizados
+(umbrales, tamaño de grilla, índices, ...) y versión del código que lo
+produjo. Cada etapa consulta el manifiesto antes de recalcular un producto
+y lo omite si nada de eso cambió, de modo que al agregar un año nuevo en
+data/raw solo se reconstruye lo que depende de él.
+
+Uso típico:
+    manifiesto = Manifiesto(OUTPUT_DIR / 'manifiesto_pipeline.json')
+    huella = manifiesto.huella([entrada], {'umbral': 0.15}, version_codigo(__file__))
+    if not manifiesto.actualizado('cambio_diferencia', huella, [salida]):
+        ...  # recalcular
+        manifiesto.registrar('cambio_diferencia', huella, [salida], datos=stats)
+        manifiesto.guardar()
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+NOMBRE_MANIFIESTO = 'manifiesto_pipeline.json'
+
+# Tamaño de lectura para calcular hashes (no se carga el archivo completo)
+_BLOQUE_HASH = 1 << 20
+
+
+def _a_json(valor):
+    """Convierte escalares y arrays de numpy / Path a tipos serializables."""
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if isinstance(valor, np.ndarray):
+        return valor.tolist()
+    if isinstance(valor, Path):
+        return str(valor)
+    raise TypeError(f"Tipo no serializable en el manifiesto: {type(valor).__name__}")
+
+
+def _normalizar(valor, ordenar=True):
+    """
+    Pasa un valor por JSON (tipos nativos). Con `ordenar` las claves se
+    ordenan para comparar parámetros de forma estable; sin él se conserva
+    el orden original (ej: orden de los índices en las estadísticas).
+    """
+    return json.loads(json.dumps(valor, sort_keys=ordenar, default=_a_json))
+
+
+def hash_archivo(ruta):
+    """SHA-256 del contenido de un archivo, leído por bloques."""
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(_BLOQUE_HASH), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def version_codigo(*rutas):
+    """
+    Versión del código que genera un producto.
+
+    Parámetros:
+    -----------
+    *rutas : str or Path
+        Archivos fuente involucrados (el script y los módulos compartidos
+        que usa)
+
+    Retorna:
+    --------
+    str : hash corto del contenido de los archivos
+    """
+    sha = hashlib.sha256()
+    for ruta in rutas:
+        sha.update(Path(ruta).read_bytes())
+    return sha.hexdigest()[:16]
+
+
+class Manifiesto:
+    """
+    Manifiesto JSON con la huella de cada producto del pipeline.
+
+    Estructura del archivo:
+        {
+          "productos": {nombre: {"entradas": {ruta: sha256},
+                                 "parametros": {...},
+                                 "codigo": str,
+                                 "salidas": [ruta, ...],
+                                 "datos": {...}}},
+          "hashes": {ruta: {"tamano": int, "mtime_ns": int, "sha256": str}}
+        }
+
+    Los hashes de archivos se cachean por (tamaño, mtime), por lo que un
+    archivo sin modificar no se vuelve a leer en la siguiente ejecución.
+
+    Parámetros:
+    -----------
+    ruta : Path
+        Ruta del archivo JSON del manifiesto
+    forzar : bool
+        Si es True ningún producto se considera actualizado
+    """
+
+    def __init__(self, ruta, forzar=False):
+        self.ruta = Path(ruta)
+        self.forzar = forzar
+        self.productos = {}
+        self.hashes = {}
+        if self.ruta.exists():
+            try:
+                contenido = json.loads(self.ruta.read_text(encoding='utf-8'))
+                self.productos = contenido.get('productos', {})
+                self.hashes = contenido.get('hashes', {})
+            except (json.JSONDecodeError, OSError):
+                print(f"⚠️  Manifiesto ilegible, se reconstruirá: {self.ruta}")
+
+    def hash(self, ruta):
+        """Hash de contenido de `ruta`, reutilizando el cacheado si no cambió."""
+        ruta = Path(ruta)
+        info = ruta.stat()
+        clave = str(ruta.resolve())
+        cache = self.hashes.get(clave)
+        if cache and cache['tamano'] == info.st_size and cache['mtime_ns'] == info.st_mtime_ns:
+            return cache['sha256']
+        sha = hash_archivo(ruta)
+        self.hashes[clave] = {'tamano': info.st_size, 'mtime_ns': info.st_mtime_ns, 'sha256': sha}
+        return sha
+
+    def huella(self, entradas, parametros, codigo):
+        """
+        Huella de un producto: hash de entradas + parámetros + código.
+
+        Parámetros:
+        -----------
+        entradas : list of Path
+            Archivos de los que depende el producto
+        parametros : dict
+            Parámetros que afectan el resultado
+        codigo : str
+            Versión del código (ver version_codigo)
+
+        Retorna:
+        --------
+        dict : huella comparable con la registrada en el manifiesto
+        """
+        return {
+            'entradas': {Path(e).name: self.hash(e) for e in entradas},
+            'parametros': _normalizar(parametros),
+            'codigo': codigo,
+        }
+
+    def actualizado(self, nombre, huella, salidas):
+        """
+        True si el producto `nombre` ya existe con la misma huella.
+
+        Parámetros:
+        -----------
+        nombre : str
+            Identificador del producto
+        huella : dict
+            Huella actual (ver huella)
+        salidas : list of Path
+            Archivos que debe haber dejado el producto
+        """
+        if self.forzar:
+            return False
+        registro = self.productos.get(nombre)
+        if registro is None or any(not Path(s).exists() for s in salidas):
+            return False
+        return all(registro.get(clave) == valor for clave, valor in huella.items())
+
+    def registrar(self, nombre, huella, salidas, datos=None):
+        """
+        Registra (o reemplaza) la huella de un producto recién generado.
+
+        `datos` permite guardar resultados livianos (ej: estadísticas) que
+        la etapa necesita cuando omite el recálculo.
+        """
+        self.productos[nombre] = dict(
+            huella,
+            salidas=[Path(s).name for s in salidas],
+            datos=_normalizar(datos, ordenar=False) if datos is not None else None,
+        )
+
+    def datos(self, nombre):
+        """Datos guardados con el producto `nombre` (None si no hay)."""
+        return self.productos.get(nombre, {}).get('datos')
+
+    def guardar(self):
+        """Escribe el manifiesto de forma atómica (archivo temporal + rename)."""
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.ruta.with_suffix('.tmp')
+        tmp.write_text(
+            json.dumps({'productos': self.productos, 'hashes': self.hashes},
+                       indent=2, default=_a_json),
+            encoding='utf-8'
+        )
+        os.replace(tmp, self.ruta)
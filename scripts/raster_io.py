@@ -0,0 +1,506 @@
+"""
+Utilidades de Lectura/Escritura Raster por Ventanas
+Proyecto: Detección de Cambios Urbanos - Peñaflor
+
+Funciones compartidas por los scripts de procesamiento para recorrer
+rasters grandes por ventanas, de modo que la memoria utilizada dependa
+del tamaño de la ventana y no del tamaño de la escena.
+
+El área de los píxeles se calcula por fila (area_filas_ha) desde el
+transform y el CRS: en coordenadas geográficas cada fila tiene un área
+distinta, y todas las cifras en hectáreas se obtienen como sumas
+ponderadas por ese vector.
+
+Todos los productos raster se escriben como Cloud-Optimized GeoTIFF
+(COG): teselas de 512×512, compresión DEFLATE con predictor y pirámide
+de overviews interna, para que los lectores posteriores (animación,
+imágenes NDVI, dashboard) puedan pedir un nivel reducido o una sola
+ventana sin decodificar la escena completa.
+"""
+
+import math
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from pyproj import CRS
+from rasterio.enums import Resampling
+from rasterio.shutil import copy as copiar_raster
+from rasterio.windows import Window
+
+# Orden de bandas de los archivos indices_*.tif generados antes de registrar
+# los nombres de banda (compatibilidad con archivos antiguos)
+INDICES_LEGADO = ('ndvi', 'ndbi', 'ndwi', 'bsi')
+
+# Número de filas por ventana (múltiplo del alto de bloque interno)
+FILAS_VENTANA = 512
+
+# Tamaño de tesela de los COG de salida (coincide con FILAS_VENTANA)
+TAMANO_TESELA = 512
+
+# Lado máximo (píxeles) de las lecturas reducidas para figuras y miniaturas
+LADO_MAX_FIGURA = 1600
+
+
+def filas_por_ventana(src, filas=FILAS_VENTANA):
+    """
+    Ajusta el alto de ventana a un múltiplo del bloque interno del raster.
+
+    Parámetros:
+    -----------
+    src : rasterio.DatasetReader
+        Raster abierto
+    filas : int
+        Número de filas deseado por ventana
+
+    Retorna:
+    --------
+    int : número de filas por ventana alineado a los bloques del archivo
+    """
+    alto_bloque = src.block_shapes[0][0]
+    return max(alto_bloque, (filas // alto_bloque) * alto_bloque)
+
+
+def iterar_ventanas(src, filas=FILAS_VENTANA):
+    """
+    Recorre el raster en franjas horizontales de ancho completo.
+
+    Las franjas se alinean a los bloques internos del archivo, por lo que
+    cada bloque se decodifica una sola vez.
+
+    Parámetros:
+    -----------
+    src : rasterio.DatasetReader
+        Raster abierto
+    filas : int
+        Número de filas por ventana
+
+    Retorna:
+    --------
+    generator de rasterio.windows.Window
+    """
+    paso = filas_por_ventana(src, filas)
+    for fila in range(0, src.height, paso):
+        yield Window(0, fila, src.width, min(paso, src.height - fila))
+
+
+def iterar_teselas(src, lado=TAMANO_TESELA):
+    """
+    Recorre el raster en teselas cuadradas alineadas a los bloques internos
+    (las de los COG de salida), fila de teselas por fila de teselas.
+
+    Parámetros:
+    -----------
+    src : rasterio.DatasetReader
+        Raster abierto
+    lado : int
+        Lado deseado de la tesela en píxeles
+
+    Retorna:
+    --------
+    generator de rasterio.windows.Window
+    """
+    alto_bloque, ancho_bloque = src.block_shapes[0]
+    paso_filas = max(alto_bloque, (lado // alto_bloque) * alto_bloque)
+    paso_columnas = max(ancho_bloque, (lado // ancho_bloque) * ancho_bloque)
+    for fila in range(0, src.height, paso_filas):
+        for columna in range(0, src.width, paso_columnas):
+            yield Window(columna, fila, min(paso_columnas, src.width - columna),
+                         min(paso_filas, src.height - fila))
+
+
+def _q_autalica(latitud, e):
+    """
+    Función q(φ) de la latitud autálica (Snyder 1987, ec. 3-12): el área
+    del elipsoide entre el ecuador y φ, por radián de longitud, es a²·q/2.
+    """
+    seno = np.sin(latitud)
+    if e == 0:
+        return 2 * seno
+    return (1 - e ** 2) * (seno / (1 - (e * seno) ** 2)
+                           - np.log((1 - e * seno) / (1 + e * seno)) / (2 * e))
+
+
+def area_filas_ha(crs, transform, alto):
+    """
+    Área de los píxeles de cada fila, en hectáreas.
+
+    En un CRS geográfico el área de una celda lat/lon es exacta sobre el
+    elipsoide (fórmula autálica, sin reproyectar píxeles): a²·Δλ·|q(φ₂) -
+    q(φ₁)| / 2. En un CRS proyectado se usa el área planar del píxel
+    (constante; en UTM la distorsión de área es < 0.1 %).
+
+    Parámetros:
+    -----------
+    crs : rasterio.crs.CRS or str
+        CRS del raster
+    transform : affine.Affine
+        Transform del raster (norte arriba)
+    alto : int
+        Número de filas
+
+    Retorna:
+    --------
+    ndarray float64 (alto,)
+    """
+    crs = CRS.from_user_input(crs.to_wkt() if hasattr(crs, 'to_wkt') else crs)
+    if not crs.is_geographic:
+        factor = crs.axis_info[0].unit_conversion_factor if crs.axis_info else 1.0
+        return np.full(alto, abs(transform.a * transform.e) * factor ** 2 / 10000)
+
+    elipsoide = crs.ellipsoid
+    a = elipsoide.semi_major_metre
+    f = 1 / elipsoide.inverse_flattening if elipsoide.inverse_flattening else 0.0
+    e = np.sqrt(f * (2 - f))
+
+    bordes = np.deg2rad(transform.f + np.arange(alto + 1) * transform.e)
+    q = _q_autalica(bordes, e)
+    return a ** 2 * np.deg2rad(abs(transform.a)) * np.abs(np.diff(q)) / 2 / 10000
+
+
+def area_ventana(area_filas, ventana):
+    """
+    Área por píxel de una ventana como columna (filas, 1), para ponderar
+    arrays de la ventana por broadcasting. ventana=None: escena completa.
+    """
+    if ventana is not None:
+        area_filas = area_filas[ventana.row_off:ventana.row_off + ventana.height]
+    return area_filas[:, np.newaxis]
+
+
+def escribir_nombres_bandas(dst, nombres):
+    """
+    Registra el nombre de cada banda en un raster abierto para escritura.
+
+    Guarda el nombre como descripción de banda (en mayúsculas), como tag
+    `indice` de cada banda y como tag `indices` del dataset (lista
+    separada por comas), para que los scripts posteriores ubiquen cada
+    banda por nombre.
+    """
+    for banda, nombre in enumerate(nombres, start=1):
+        dst.set_band_description(banda, nombre.upper())
+        dst.update_tags(banda, indice=nombre.lower())
+    dst.update_tags(indices=','.join(nombre.lower() for nombre in nombres))
+
+
+def indice_banda(src, nombre):
+    """
+    Número de banda (1-indexado) que contiene el índice `nombre`.
+
+    Busca en las descripciones de banda y luego en el tag `indices`; si el
+    archivo no tiene nombres registrados, asume el orden legado
+    NDVI, NDBI, NDWI, BSI.
+
+    Parámetros:
+    -----------
+    src : rasterio.DatasetReader
+        Raster de índices abierto
+    nombre : str
+        Nombre del índice (ej: 'ndvi')
+
+    Retorna:
+    --------
+    int : número de banda
+    """
+    nombre = nombre.lower()
+
+    descripciones = [(d or '').lower() for d in src.descriptions]
+    if nombre in descripciones:
+        return descripciones.index(nombre) + 1
+
+    tag = src.tags().get('indices')
+    if tag:
+        nombres = tag.split(',')
+        if nombre in nombres:
+            return nombres.index(nombre) + 1
+
+    if not any(descripciones) and nombre in INDICES_LEGADO[:src.count]:
+        return INDICES_LEGADO.index(nombre) + 1
+
+    raise KeyError(f"El raster {src.name} no contiene la banda '{nombre}'")
+
+
+def _es_flotante(dtype):
+    """True si el tipo de dato es de punto flotante."""
+    return np.issubdtype(np.dtype(dtype), np.floating)
+
+
+def perfil_tiled(profile, **cambios):
+    """
+    Perfil GeoTIFF teselado a partir de un perfil existente.
+
+    Parámetros:
+    -----------
+    profile : dict
+        Perfil base (normalmente src.profile de la imagen de entrada)
+    **cambios :
+        Claves a actualizar (count, dtype, nodata, ...)
+
+    Retorna:
+    --------
+    dict : perfil con teselas TAMANO_TESELA × TAMANO_TESELA, sin compresión
+    (archivo intermedio que luego se convierte a COG)
+    """
+    perfil = dict(profile)
+    perfil.update(cambios)
+    for clave in ('compress', 'predictor', 'photometric', 'blockxsize', 'blockysize'):
+        perfil.pop(clave, None)
+    perfil.update(
+        driver='GTiff',
+        tiled=True,
+        blockxsize=TAMANO_TESELA,
+        blockysize=TAMANO_TESELA,
+        interleave='band',
+        BIGTIFF='IF_SAFER'
+    )
+    return perfil
+
+
+def factores_overview(alto, ancho):
+    """
+    Factores de reducción de la pirámide (2, 4, 8, ...) hasta que el nivel
+    más chico quepa en una tesela.
+    """
+    factores = []
+    factor = 2
+    while max(alto, ancho) / (factor // 2) > TAMANO_TESELA:
+        factores.append(factor)
+        factor *= 2
+    return factores
+
+
+def opciones_cog(dtype):
+    """
+    Opciones de creación del COG según el tipo de dato.
+
+    - float32: predictor de punto flotante (3)
+    - enteros (clases): predictor horizontal (2)
+
+    Parámetros:
+    -----------
+    dtype : str
+        Tipo de dato del raster
+
+    Retorna:
+    --------
+    dict : opciones para rasterio.shutil.copy(driver='GTiff')
+    """
+    return {
+        'tiled': True,
+        'blockxsize': TAMANO_TESELA,
+        'blockysize': TAMANO_TESELA,
+        'interleave': 'band',
+        'compress': 'deflate',
+        'predictor': 3 if _es_flotante(dtype) else 2,
+        'copy_src_overviews': True,
+        'BIGTIFF': 'IF_SAFER',
+        'NUM_THREADS': 'ALL_CPUS',
+    }
+
+
+@contextmanager
+def escribir_cog(ruta_salida, profile, remuestreo=None, **cambios):
+    """
+    Abre un raster para escritura y al cerrarlo lo convierte en COG.
+
+    Se escribe primero un GeoTIFF teselado sin comprimir (admite escritura
+    por ventanas) junto al destino; al salir del bloque `with` se generan
+    las overviews y se copia con COPY_SRC_OVERVIEWS, que deja la pirámide
+    antes de los datos (estructura COG) y comprime con predictor. Las
+    descripciones y tags de banda se conservan y el temporal se elimina.
+
+    Parámetros:
+    -----------
+    ruta_salida : Path
+        Ruta del COG final
+    profile : dict
+        Perfil base
+    remuestreo : str, optional
+        Remuestreo de overviews (por defecto 'average' para float y 'mode'
+        para clases)
+    **cambios :
+        Claves del perfil a actualizar (count, dtype, nodata, ...)
+
+    Retorna:
+    --------
+    context manager que entrega el rasterio.DatasetWriter temporal
+    """
+    ruta_salida = Path(ruta_salida)
+    ruta_tmp = ruta_salida.with_name(ruta_salida.stem + '.tmp.tif')
+    perfil = perfil_tiled(profile, **cambios)
+    if remuestreo is None:
+        remuestreo = 'average' if _es_flotante(perfil['dtype']) else 'mode'
+
+    try:
+        with rasterio.open(ruta_tmp, 'w', **perfil) as dst:
+            yield dst
+            dst.build_overviews(factores_overview(dst.height, dst.width),
+                                Resampling[remuestreo])
+        copiar_raster(ruta_tmp, ruta_salida, driver='GTiff',
+                      **opciones_cog(perfil['dtype']))
+    finally:
+        if ruta_tmp.exists():
+            os.remove(ruta_tmp)
+
+
+def leer_reducido(src, banda, lado_max=LADO_MAX_FIGURA, remuestreo=Resampling.average):
+    """
+    Lee una banda a resolución reducida para visualización.
+
+    Si el raster tiene overviews, GDAL usa el nivel más cercano en vez de
+    decodificar la resolución completa.
+
+    Parámetros:
+    -----------
+    src : rasterio.DatasetReader
+        Raster abierto
+    banda : int
+        Número de banda (1-indexado)
+    lado_max : int
+        Máximo de filas/columnas del resultado
+    remuestreo : rasterio.enums.Resampling
+        Método de remuestreo (promedio para índices continuos)
+
+    Retorna:
+    --------
+    array 2D con a lo más `lado_max` píxeles por lado
+    """
+    factor = max(1, math.ceil(max(src.height, src.width) / lado_max))
+    forma = (math.ceil(src.height / factor), math.ceil(src.width / factor))
+    return src.read(banda, out_shape=forma, resampling=remuestreo)
+
+
+class PilaRaster:
+    """
+    Caché de bandas compartida entre métodos de un mismo proceso.
+
+    Cada banda (archivo, índice) se decodifica una sola vez, de forma
+    perezosa la primera vez que se pide, y se guarda como array float32
+    mapeado en memoria (np.memmap sobre un .npy temporal). Las lecturas
+    siguientes, desde cualquier método, reutilizan ese mapa sin volver a
+    descomprimir el GeoTIFF, y el sistema operativo decide cuánto mantener
+    en RAM. Los temporales se eliminan al cerrar la pila.
+
+    Uso:
+        with PilaRaster() as pila:
+            ndvi_t1 = pila.banda(ruta_t1, 'ndvi')
+            profile = pila.perfil(ruta_t1)
+
+    Parámetros:
+    -----------
+    directorio : str or Path, optional
+        Carpeta donde crear los temporales (por defecto, la del sistema)
+    filas : int
+        Filas por ventana al decodificar (memoria de la decodificación)
+    """
+
+    def __init__(self, directorio=None, filas=FILAS_VENTANA):
+        self._tmp = tempfile.TemporaryDirectory(prefix='pila_raster_', dir=directorio)
+        self.filas = filas
+        self._bandas = {}
+        self._perfiles = {}
+        self._abiertos = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def perfil(self, ruta):
+        """Perfil (copia) del raster `ruta`; solo lee la cabecera."""
+        clave = str(Path(ruta).resolve())
+        if clave not in self._perfiles:
+            with rasterio.open(ruta) as src:
+                self._perfiles[clave] = src.profile
+        return self._perfiles[clave].copy()
+
+    def banda(self, ruta, nombre):
+        """
+        Banda `nombre` del raster `ruta` como array float32 de solo lectura.
+
+        Parámetros:
+        -----------
+        ruta : Path
+            Raster de índices
+        nombre : str
+            Nombre del índice (ver indice_banda)
+
+        Retorna:
+        --------
+        np.memmap float32 (filas, columnas)
+        """
+        clave = (str(Path(ruta).resolve()), nombre.lower())
+        if clave not in self._bandas:
+            self._bandas[clave] = self._decodificar(ruta, nombre)
+        return self._bandas[clave]
+
+    def leer(self, ruta, nombre, ventana=None):
+        """
+        Banda `nombre` completa (ventana=None) o solo una ventana.
+
+        La banda completa se decodifica y cachea (ver banda). Una ventana se
+        toma del mapa si la banda ya estaba cacheada; si no, se lee
+        directamente del archivo sin decodificar el resto de la escena
+        (modo por ventanas para escenas mayores que la RAM o el disco
+        temporal).
+
+        Retorna:
+        --------
+        array float32 (filas, columnas)
+        """
+        if ventana is None:
+            return self.banda(ruta, nombre)
+        clave = (str(Path(ruta).resolve()), nombre.lower())
+        if clave in self._bandas:
+            return self._bandas[clave][ventana.toslices()]
+        src = self._abrir(ruta)
+        return src.read(indice_banda(src, nombre), window=ventana, out_dtype='float32')
+
+    def area_filas(self, ruta):
+        """Área por fila (ha) de `ruta` (ver area_filas_ha), cacheada."""
+        clave = ('area', str(Path(ruta).resolve()))
+        if clave not in self._perfiles:
+            perfil = self.perfil(ruta)
+            self._perfiles[clave] = area_filas_ha(perfil['crs'], perfil['transform'],
+                                                  perfil['height'])
+        return self._perfiles[clave]
+
+    def ventanas(self, ruta, filas=None):
+        """
+        Franjas de ancho completo de `ruta` alineadas a sus bloques
+        (ver iterar_ventanas), para recorrer la escena con leer().
+        """
+        return list(iterar_ventanas(self._abrir(ruta), filas or self.filas))
+
+    def _abrir(self, ruta):
+        """Dataset abierto de `ruta`, reutilizado entre lecturas por ventana."""
+        clave = str(Path(ruta).resolve())
+        if clave not in self._abiertos:
+            self._abiertos[clave] = rasterio.open(ruta)
+        return self._abiertos[clave]
+
+    def _decodificar(self, ruta, nombre):
+        """Decodifica una banda por ventanas hacia un .npy mapeado en memoria."""
+        destino = Path(self._tmp.name) / f'{len(self._bandas):03d}_{Path(ruta).stem}_{nombre}.npy'
+        with rasterio.open(ruta) as src:
+            banda = indice_banda(src, nombre)
+            mapa = np.lib.format.open_memmap(destino, mode='w+', dtype=np.float32,
+                                             shape=(src.height, src.width))
+            for ventana in iterar_ventanas(src, self.filas):
+                filas = slice(ventana.row_off, ventana.row_off + ventana.height)
+                mapa[filas] = src.read(banda, window=ventana, out_dtype='float32')
+            mapa.flush()
+            del mapa
+        return np.load(destino, mmap_mode='r')
+
+    def cerrar(self):
+        """Libera los mapas, cierra los archivos y elimina los temporales."""
+        for src in self._abiertos.values():
+            src.close()
+        self._abiertos.clear()
+        self._bandas.clear()
+        self._tmp.cleanup()
@@ -0,0 +1,422 @@
+"""
+Motor de Índices Espectrales
+Proyecto: Detección de Cambios Urbanos - Peñaflor
+
+Registro de índices espectrales y kernel único, en float32, que los evalúa
+en una sola pasada sobre las bandas. Lo usan tanto el script de la Fase 2
+(calculate_indices.py) como las utilidades del dashboard (app/utils.py),
+de modo que ambas rutas comparten exactamente las mismas fórmulas.
+
+Cada índice se declara una sola vez como expresión de bandas, por ejemplo:
+
+    registrar_indice('ndmi', '(nir - swir) / (nir + swir)', 'Índice de Humedad')
+
+Las expresiones de todos los índices solicitados se compilan juntas en un
+único programa vectorizado: las subexpresiones comunes (como `nir + red`,
+compartida por NDVI y SAVI) se evalúan una sola vez, cada banda se lee una
+sola vez y todas las operaciones escriben sobre buffers preasignados
+(`out=`), sin arrays temporales por operación. Las bandas enteras (uint16)
+se convierten a float32 elemento a elemento dentro de cada operación.
+
+Toda división se evalúa como a / (b + eps) para evitar división por cero.
+
+El paso de DN a reflectancia (ej: dividir por 10000) también se integra en
+las expresiones: los índices normalizados son invariantes a la escala y no
+lo necesitan, y en los demás solo cambian las constantes (ver _escalar).
+"""
+
+import ast
+
+import numpy as np
+
+# Evitar división por cero
+EPS = 1e-10
+
+# Bandas Sentinel-2 en el orden de descarga (número de banda en el archivo)
+BANDAS_SENTINEL2 = {
+    'blue': 1,    # B2  (490nm)
+    'green': 2,   # B3  (560nm)
+    'red': 3,     # B4  (665nm)
+    'nir': 4,     # B8  (842nm)
+    'swir': 5,    # B11 (1610nm)
+    'swir2': 6,   # B12 (2190nm) - opcional
+}
+
+# Índices calculados por defecto, en el orden de las bandas de salida
+INDICES_BASE = ('ndvi', 'ndbi', 'ndwi', 'bsi')
+
+# Registro de índices: nombre -> {'expresion', 'descripcion', 'rango'}
+REGISTRO_INDICES = {}
+
+_OPERADORES = {
+    ast.Add: 'add',
+    ast.Sub: 'sub',
+    ast.Mult: 'mul',
+    ast.Div: 'div',
+}
+
+
+def _nodo(op, a, b):
+    """
+    Nodo binario canónico: pliega operaciones entre constantes y ordena
+    los operandos de add/mul.
+    """
+    if a[0] == 'const' and b[0] == 'const':
+        valores = {'add': a[1] + b[1], 'sub': a[1] - b[1],
+                   'mul': a[1] * b[1], 'div': a[1] / b[1]}
+        return ('const', valores[op])
+    if op in ('add', 'mul'):
+        a, b = sorted((a, b), key=repr)
+    return (op, a, b)
+
+
+def _parsear(expresion):
+    """
+    Convierte una expresión de bandas en un árbol canónico de tuplas.
+
+    Nodos: ('banda', nombre), ('const', valor), ('neg', x) y
+    (op, a, b) con op en add/sub/mul/div. Los operandos de add/mul se
+    ordenan para que `nir + red` y `red + nir` sean el mismo nodo, y las
+    operaciones entre constantes se pliegan.
+    """
+
+    def convertir(nodo):
+        if isinstance(nodo, ast.Name):
+            if nodo.id not in BANDAS_SENTINEL2:
+                raise ValueError(f"Banda desconocida en '{expresion}': {nodo.id}")
+            return ('banda', nodo.id)
+
+        if isinstance(nodo, ast.Constant) and isinstance(nodo.value, (int, float)):
+            return ('const', float(nodo.value))
+
+        if isinstance(nodo, ast.UnaryOp) and isinstance(nodo.op, (ast.USub, ast.UAdd)):
+            operando = convertir(nodo.operand)
+            if isinstance(nodo.op, ast.UAdd):
+                return operando
+            if operando[0] == 'const':
+                return ('const', -operando[1])
+            return ('neg', operando)
+
+        if isinstance(nodo, ast.BinOp) and type(nodo.op) in _OPERADORES:
+            op = _OPERADORES[type(nodo.op)]
+            return _nodo(op, convertir(nodo.left), convertir(nodo.right))
+
+        raise ValueError(f"Expresión no soportada en '{expresion}': {ast.dump(nodo)}")
+
+    return convertir(ast.parse(expresion, mode='eval').body)
+
+
+def _escalar(arbol, escala):
+    """
+    Integra el escalado de bandas (reflectancia = DN * escala + desplazamiento)
+    en un árbol de expresión, sin reescalar las bandas.
+
+    Retorna (nodo, k) tal que el valor del árbol original evaluado sobre
+    bandas escaladas es k * valor de `nodo` evaluado sobre las bandas DN.
+    El factor k se propaga por grado de homogeneidad: en una suma, las
+    constantes se dividen por el factor de los demás términos; en un
+    cociente los factores se cancelan. Así los índices normalizados (NDVI,
+    NDBI, ...) quedan con k = 1 y no requieren ninguna operación extra, y en
+    SAVI/EVI solo cambia la constante (0.5 → 0.5 / escala).
+
+    Parámetros:
+    -----------
+    arbol : tuple
+        Árbol canónico (ver _parsear)
+    escala : dict
+        {banda: (escala, desplazamiento)}
+    """
+    tipo = arbol[0]
+    if tipo == 'banda':
+        factor, desplazamiento = escala.get(arbol[1], (1.0, 0.0))
+        if desplazamiento:
+            # Escalado afín: no se puede factorizar, se aplica a la banda
+            return _nodo('add', _nodo('mul', arbol, ('const', factor)),
+                         ('const', desplazamiento)), 1.0
+        return arbol, factor
+    if tipo == 'const':
+        return arbol, 1.0
+    if tipo == 'neg':
+        nodo, k = _escalar(arbol[1], escala)
+        return ('neg', nodo), k
+
+    op = tipo
+    a, ka = _escalar(arbol[1], escala)
+    b, kb = _escalar(arbol[2], escala)
+    if op == 'mul':
+        return _nodo(op, a, b), ka * kb
+    if op == 'div':
+        return _nodo(op, a, b), ka / kb
+
+    # add / sub: llevar ambos términos al factor del término no constante
+    k = kb if a[0] == 'const' else ka
+    a = _reescalar(a, ka / k)
+    b = _reescalar(b, kb / k)
+    return _nodo(op, a, b), k
+
+
+def _reescalar(nodo, factor):
+    """Multiplica un nodo por una constante (plegada si es constante)."""
+    if factor == 1.0:
+        return nodo
+    return _nodo('mul', nodo, ('const', factor))
+
+
+def _bandas_de(arbol):
+    """Conjunto de bandas usadas por un árbol de expresión."""
+    if arbol[0] == 'banda':
+        return {arbol[1]}
+    if arbol[0] == 'const':
+        return set()
+    return set().union(*(_bandas_de(hijo) for hijo in arbol[1:]))
+
+
+def registrar_indice(nombre, expresion, descripcion, rango=(-1, 1)):
+    """
+    Declara un índice espectral como expresión de bandas.
+
+    Parámetros:
+    -----------
+    nombre : str
+        Identificador del índice (se guarda en minúsculas)
+    expresion : str
+        Expresión aritmética sobre las bandas de BANDAS_SENTINEL2
+    descripcion : str
+        Nombre descriptivo (se usa en el dashboard)
+    rango : tuple or None
+        Rango al que se recorta el resultado (None = sin recorte)
+    """
+    _parsear(expresion)  # Validar la expresión al registrarla
+    REGISTRO_INDICES[nombre.lower()] = {
+        'expresion': expresion,
+        'descripcion': descripcion,
+        'rango': rango,
+    }
+
+
+registrar_indice('ndvi', '(nir - red) / (nir + red)',
+                 'Índice de Vegetación de Diferencia Normalizada')
+registrar_indice('ndbi', '(swir - nir) / (swir + nir)',
+                 'Índice de Construcción de Diferencia Normalizada')
+registrar_indice('ndwi', '(green - nir) / (green + nir)',
+                 'Índice de Agua de Diferencia Normalizada')
+registrar_indice('bsi', '((swir + red) - (nir + blue)) / ((swir + red) + (nir + blue))',
+                 'Índice de Suelo Desnudo')
+registrar_indice('savi', '1.5 * (nir - red) / (nir + red + 0.5)',
+                 'Índice de Vegetación Ajustado al Suelo')
+registrar_indice('evi', '2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)',
+                 'Índice de Vegetación Mejorado')
+registrar_indice('mndwi', '(green - swir) / (green + swir)',
+                 'Índice de Agua de Diferencia Normalizada Modificado')
+registrar_indice('ndmi', '(nir - swir) / (nir + swir)',
+                 'Índice de Humedad de Diferencia Normalizada')
+
+
+def bandas_requeridas(indices):
+    """
+    Bandas necesarias para un conjunto de índices, en el orden del archivo.
+
+    Retorna:
+    --------
+    tuple of str : nombres de banda ordenados según BANDAS_SENTINEL2
+    """
+    usadas = set()
+    for indice in indices:
+        if indice not in REGISTRO_INDICES:
+            raise ValueError(f"Índice no registrado: {indice}")
+        usadas |= _bandas_de(_parsear(REGISTRO_INDICES[indice]['expresion']))
+    return tuple(sorted(usadas, key=BANDAS_SENTINEL2.get))
+
+
+class MotorIndices:
+    """
+    Evalúa varios índices espectrales sobre buffers float32 reutilizables.
+
+    Al construirse compila las expresiones de los índices en un programa
+    lineal con eliminación de subexpresiones comunes; los buffers de
+    trabajo se reutilizan en cuanto un resultado intermedio deja de usarse.
+    Los buffers se asignan la primera vez y se reutilizan en las llamadas
+    siguientes (por ejemplo, ventana a ventana); solo crecen si llega un
+    bloque más grande. El array retornado por `calcular` es una vista de
+    esos buffers y se sobrescribe en la llamada siguiente.
+
+    Parámetros:
+    -----------
+    indices : sequence of str
+        Índices a calcular (claves de REGISTRO_INDICES), en orden de salida
+    eps : float
+        Término sumado a los denominadores para evitar división por cero
+    recortar : bool
+        Recortar cada índice a su rango registrado
+    relleno : float or None
+        Si no es None, reemplaza los valores no finitos por este valor
+    escala : float, dict or None
+        Escalado de las bandas de entrada a reflectancia: un factor común
+        (ej: 1e-4 para DN de Sentinel-2) o {banda: (escala, desplazamiento)}.
+        Se integra en las expresiones (ver _escalar), por lo que las bandas
+        se pasan sin escalar y los índices normalizados no hacen trabajo extra.
+    """
+
+    def __init__(self, indices=INDICES_BASE, eps=EPS, recortar=True, relleno=None,
+                 escala=None):
+        self.indices = tuple(indice.lower() for indice in indices)
+        self.bandas = bandas_requeridas(self.indices)
+        self.eps = eps
+        self.recortar = recortar
+        self.relleno = relleno
+        if escala is not None and not isinstance(escala, dict):
+            escala = {banda: (float(escala), 0.0) for banda in self.bandas}
+        self.escala = escala
+        self._compilar()
+        self._salida = None
+        self._trabajo = None
+
+    def _compilar(self):
+        """Genera la lista de operaciones y asigna buffers de trabajo."""
+        raices = [_parsear(REGISTRO_INDICES[i]['expresion']) for i in self.indices]
+        if self.escala:
+            escaladas = []
+            for raiz in raices:
+                nodo, k = _escalar(raiz, self.escala)
+                escaladas.append(_reescalar(nodo, k))
+            raices = escaladas
+
+        # Orden topológico de los nodos internos únicos (CSE)
+        orden = []
+        vistos = set()
+
+        def visitar(nodo):
+            if nodo[0] in ('banda', 'const') or nodo in vistos:
+                return
+            for hijo in nodo[1:]:
+                visitar(hijo)
+            vistos.add(nodo)
+            orden.append(nodo)
+
+        for raiz in raices:
+            visitar(raiz)
+
+        # Nodos que son resultado final se escriben directo en la salida
+        en_salida = {}
+        for i, raiz in enumerate(raices):
+            if raiz[0] not in ('banda', 'const'):
+                en_salida.setdefault(raiz, i)
+
+        # Último paso en que se usa cada nodo como operando
+        ultimo_uso = {}
+        for paso, nodo in enumerate(orden):
+            for hijo in nodo[1:]:
+                ultimo_uso[hijo] = paso
+
+        ubicacion = {}
+        libres = []
+        n_trabajo = 0
+        self._programa = []
+
+        def referencia(nodo):
+            if nodo[0] in ('banda', 'const'):
+                return nodo
+            return ubicacion[nodo]
+
+        for paso, nodo in enumerate(orden):
+            if nodo in en_salida:
+                destino = ('salida', en_salida[nodo])
+            elif libres:
+                destino = ('trabajo', libres.pop())
+            else:
+                destino = ('trabajo', n_trabajo)
+                n_trabajo += 1
+            ubicacion[nodo] = destino
+
+            self._programa.append((nodo[0], destino) + tuple(referencia(h) for h in nodo[1:]))
+
+            # Liberar buffers de operandos que ya no se usan
+            for hijo in set(nodo[1:]):
+                ref = ubicacion.get(hijo)
+                if ref and ref[0] == 'trabajo' and ultimo_uso.get(hijo) == paso:
+                    libres.append(ref[1])
+
+        # Índices repetidos o que son una banda/constante: copia final
+        self._copias = []
+        for i, raiz in enumerate(raices):
+            if raiz[0] in ('banda', 'const') or en_salida[raiz] != i:
+                self._copias.append((i, referencia(raiz)))
+
+        self._n_trabajo = n_trabajo
+
+    def _reservar(self, forma):
+        """Asegura buffers con capacidad para `forma` y retorna sus vistas."""
+        n = len(self.indices)
+        tamano = forma[0] * forma[1]
+        if self._salida is None or self._salida.shape[1] < tamano:
+            self._salida = np.empty((n, tamano), dtype=np.float32)
+            self._trabajo = np.empty((self._n_trabajo, tamano), dtype=np.float32)
+
+        salida = self._salida[:, :tamano].reshape((n,) + tuple(forma))
+        trabajo = self._trabajo[:, :tamano].reshape((self._n_trabajo,) + tuple(forma))
+        return salida, trabajo
+
+    def calcular(self, **bandas):
+        """
+        Calcula los índices configurados en una sola pasada.
+
+        Args:
+            **bandas: Bandas 2-D por nombre (blue, green, red, nir, swir,
+                swir2); basta con las listadas en `self.bandas`
+
+        Returns:
+            np.ndarray float32 de forma (n_indices, filas, columnas)
+        """
+        faltantes = [b for b in self.bandas if bandas.get(b) is None]
+        if faltantes:
+            raise ValueError(f"Faltan bandas para {list(self.indices)}: {faltantes}")
+
+        forma = bandas[self.bandas[0]].shape
+        salida, trabajo = self._reservar(forma)
+
+        def resolver(ref):
+            tipo, valor = ref
+            if tipo == 'banda':
+                return bandas[valor]
+            if tipo == 'const':
+                return valor
+            return salida[valor] if tipo == 'salida' else trabajo[valor]
+
+        f32 = np.float32
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for op, destino, *operandos in self._programa:
+                out = resolver(destino)
+                a = resolver(operandos[0])
+
+                if op == 'neg':
+                    np.negative(a, out=out, dtype=f32)
+                    continue
+
+                b = resolver(operandos[1])
+                if op == 'add':
+                    np.add(a, b, out=out, dtype=f32)
+                elif op == 'sub':
+                    np.subtract(a, b, out=out, dtype=f32)
+                elif op == 'mul':
+                    np.multiply(a, b, out=out, dtype=f32)
+                elif operandos[1][0] == 'const' or not self.eps:
+                    np.divide(a, b, out=out, dtype=f32)
+                else:
+                    # out = a / (b + eps); `out` nunca es a ni b
+                    np.add(b, self.eps, out=out, dtype=f32)
+                    np.divide(a, out, out=out, dtype=f32)
+
+            for i, ref in self._copias:
+                np.copyto(salida[i], resolver(ref), casting='unsafe')
+
+            if self.recortar:
+                for i, indice in enumerate(self.indices):
+                    rango = REGISTRO_INDICES[indice]['rango']
+                    if rango is not None:
+                        np.clip(salida[i], rango[0], rango[1], out=salida[i])
+
+            if self.relleno is not None:
+                np.nan_to_num(salida, copy=False, nan=self.relleno,
+                              posinf=self.relleno, neginf=self.relleno)
+
+        return salida
@@ -0,0 +1,419 @@
+"""
+Estadísticas Incrementales por Ventanas
+Proyecto: Detección de Cambios Urbanos - Peñaflor
+
+Acumulador de estadísticas que recibe los datos ventana a ventana y
+calcula en una sola pasada:
+- media y desviación estándar (Welford / Chan et al. para combinar lotes)
+- mínimo y máximo
+- cuantiles aproximados (mediana, etc.) a partir de un histograma fino
+- fracciones sobre umbrales (ej: % de píxeles con NDVI > 0.3)
+
+Incluye también un conteo de píxeles por clase (ConteoClases) para rasters
+categóricos, calculado con un único np.bincount por ventana, y un
+acumulador por píxel (AcumuladorPorPixel) para series temporales: media y
+varianza de cada píxel actualizadas imagen a imagen, con memoria constante
+sin importar el largo de la serie.
+
+Los acumuladores se pueden combinar (`fusionar`) entre ventanas, procesos
+o años, por lo que sirven tanto para el modo streaming como para el
+procesamiento paralelo.
+"""
+
+import math
+import operator
+
+import numpy as np
+
+_COMPARADORES = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+
+class AcumuladorEstadisticas:
+    """
+    Estadísticas de una variable acumuladas ventana a ventana.
+
+    Parámetros:
+    -----------
+    rango : tuple or None
+        Intervalo (min, max) cubierto por el histograma de cuantiles. Los
+        valores fuera del rango se cuentan en el bin extremo. Si es None el
+        rango es automático: los bins tienen un ancho potencia de 2 alineado
+        a sus múltiplos, y cuando llega un valor fuera del rango cubierto el
+        histograma se re-agrupa (bins de a pares) hasta contenerlo. Así
+        ningún valor se recorta y dos acumuladores automáticos siempre se
+        pueden fusionar.
+    n_bins : int
+        Número de bins del histograma (resolución de los cuantiles:
+        (max - min) / n_bins)
+    umbrales : dict
+        {nombre: (operador, valor)} con operador en '>', '>=', '<', '<=';
+        se cuenta exactamente cuántos valores cumplen cada condición
+    """
+
+    def __init__(self, rango=(-1, 1), n_bins=20000, umbrales=None):
+        self.rango = tuple(rango) if rango is not None else None
+        self.automatico = rango is None
+        # Rango automático: bins de ancho 2**exponente desde inicio * ancho
+        self.exponente = None
+        self.inicio = 0
+        self.n_bins = n_bins
+        self.umbrales = dict(umbrales or {})
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.minimo = np.inf
+        self.maximo = -np.inf
+        self.histograma = np.zeros(n_bins, dtype=np.int64)
+        self.conteos = {nombre: 0 for nombre in self.umbrales}
+
+    def agregar(self, valores, mascara=None):
+        """
+        Incorpora un lote de valores (se ignoran los no finitos).
+
+        Args:
+            valores: Array con los valores de la ventana
+            mascara: Array booleano opcional; solo se usan los True
+        """
+        valores = np.asarray(valores)
+        validos = np.isfinite(valores)
+        if mascara is not None:
+            validos &= mascara
+        x = valores[validos].astype(np.float64, copy=False)
+        n_b = x.size
+        if n_b == 0:
+            return
+
+        # Welford por lotes: combinar (n, media, M2) del lote con el acumulado
+        media_b = x.mean()
+        m2_b = np.square(x - media_b).sum()
+        self._combinar(n_b, media_b, m2_b)
+
+        self.minimo = min(self.minimo, x.min())
+        self.maximo = max(self.maximo, x.max())
+
+        if self.automatico:
+            self._cubrir(x.min(), x.max())
+        inicio, fin = self.rango
+        escala = self.n_bins / (fin - inicio) if fin > inicio else 0.0
+        bins = ((x - inicio) * escala).astype(np.int64)
+        np.clip(bins, 0, self.n_bins - 1, out=bins)
+        self.histograma += np.bincount(bins, minlength=self.n_bins)
+
+        for nombre, (op, valor) in self.umbrales.items():
+            self.conteos[nombre] += int(np.count_nonzero(_COMPARADORES[op](x, valor)))
+
+    def _cubrir(self, minimo, maximo):
+        """
+        Amplía el rango automático hasta contener [minimo, maximo],
+        re-agrupando el histograma si hace falta un ancho de bin mayor.
+        """
+        if self.exponente is not None:
+            minimo = min(minimo, self.rango[0])
+            maximo = max(maximo, self.rango[1] - math.ldexp(1, self.exponente - 1))
+        exponente = _exponente_cubre(minimo, maximo, self.n_bins)
+        if self.exponente is not None:
+            exponente = max(exponente, self.exponente)
+        inicio = math.floor(minimo / math.ldexp(1, exponente))
+        if self.exponente is not None and (exponente, inicio) != (self.exponente, self.inicio):
+            self.histograma = _reagrupar(self.histograma, self.inicio, self.exponente,
+                                         inicio, exponente, self.n_bins)
+        self._fijar_rango(exponente, inicio)
+
+    def _fijar_rango(self, exponente, inicio):
+        ancho = math.ldexp(1, exponente)
+        self.exponente = exponente
+        self.inicio = inicio
+        self.rango = (inicio * ancho, (inicio + self.n_bins) * ancho)
+
+    def _combinar(self, n_b, media_b, m2_b):
+        """Fórmula de Chan et al. para unir dos conjuntos (n, media, M2)."""
+        n_a = self.n
+        n = n_a + n_b
+        delta = media_b - self.media
+        self.media += delta * n_b / n
+        self.m2 += m2_b + delta ** 2 * n_a * n_b / n
+        self.n = n
+
+    def fusionar(self, otro):
+        """Combina las estadísticas de otro acumulador (otra ventana, proceso o año)."""
+        if otro.n == 0:
+            return
+        if (otro.automatico != self.automatico or otro.n_bins != self.n_bins
+                or set(otro.umbrales) != set(self.umbrales)
+                or (not self.automatico and otro.rango != self.rango)):
+            raise ValueError("Solo se pueden fusionar acumuladores con la misma configuración")
+
+        histograma = otro.histograma
+        if self.automatico:
+            # Llevar ambos histogramas a una grilla común que cubra los dos rangos
+            self._cubrir(otro.rango[0], otro.rango[1] - math.ldexp(1, otro.exponente - 1))
+            if (otro.exponente, otro.inicio) != (self.exponente, self.inicio):
+                histograma = _reagrupar(histograma, otro.inicio, otro.exponente,
+                                        self.inicio, self.exponente, self.n_bins)
+
+        self._combinar(otro.n, otro.media, otro.m2)
+        self.minimo = min(self.minimo, otro.minimo)
+        self.maximo = max(self.maximo, otro.maximo)
+        self.histograma += histograma
+        for nombre, conteo in otro.conteos.items():
+            self.conteos[nombre] += conteo
+
+    @property
+    def std(self):
+        """Desviación estándar poblacional (ddof=0, como np.std)."""
+        return float(np.sqrt(self.m2 / self.n)) if self.n else float('nan')
+
+    def cuantil(self, q):
+        """
+        Cuantil aproximado `q` (0-1), interpolado dentro de su bin.
+
+        El resultado se acota a [mínimo, máximo] observados.
+        """
+        if self.n == 0:
+            return float('nan')
+        objetivo = q * self.n
+        acumulado = np.cumsum(self.histograma)
+        i = int(np.searchsorted(acumulado, objetivo))
+        i = min(i, self.n_bins - 1)
+        previo = acumulado[i - 1] if i > 0 else 0
+        fraccion = (objetivo - previo) / self.histograma[i] if self.histograma[i] else 0.0
+        inicio, fin = self.rango
+        valor = inicio + (i + fraccion) * (fin - inicio) / self.n_bins
+        return float(min(max(valor, self.minimo), self.maximo))
+
+    def fraccion(self, nombre):
+        """Fracción (0-1) de valores que cumplen el umbral `nombre`."""
+        return self.conteos[nombre] / self.n if self.n else float('nan')
+
+    def resultado(self):
+        """
+        Retorna las estadísticas acumuladas.
+
+        Returns:
+            dict con mean, std, min, max, median y, por cada umbral,
+            la fracción de valores que lo cumple
+        """
+        stats = {
+            'mean': float(self.media) if self.n else float('nan'),
+            'std': self.std,
+            'min': float(self.minimo) if self.n else float('nan'),
+            'max': float(self.maximo) if self.n else float('nan'),
+            'median': self.cuantil(0.5),
+        }
+        for nombre in self.umbrales:
+            stats[nombre] = self.fraccion(nombre)
+        return stats
+
+
+def _exponente_cubre(minimo, maximo, n_bins):
+    """Menor exponente e tal que n_bins bins de ancho 2**e alineados cubren [minimo, maximo]."""
+    amplitud = float(maximo) - float(minimo)
+    if amplitud > 0:
+        exponente = math.ceil(math.log2(amplitud / n_bins))
+    else:
+        # Lote constante: bin fino relativo a la magnitud del valor
+        exponente = math.frexp(max(abs(float(minimo)), 1.0))[1] - 40
+    while (math.floor(maximo / math.ldexp(1, exponente))
+           - math.floor(minimo / math.ldexp(1, exponente))) >= n_bins:
+        exponente += 1
+    return exponente
+
+
+def _reagrupar(histograma, inicio, exponente, nuevo_inicio, nuevo_exponente, n_bins):
+    """
+    Traslada un histograma de bins 2**exponente a la grilla de bins
+    2**nuevo_exponente (nuevo_exponente >= exponente) que empieza en nuevo_inicio.
+    """
+    absolutos = inicio + np.arange(len(histograma), dtype=np.int64)
+    destino = (absolutos >> (nuevo_exponente - exponente)) - nuevo_inicio
+    return np.bincount(destino, weights=histograma, minlength=n_bins).astype(np.int64)
+
+
+class ConteoClases:
+    """
+    Conteo de píxeles por clase de un raster categórico, ventana a ventana.
+
+    Cada lote se cuenta en una sola pasada (np.bincount para clases de 8
+    bits, np.unique para el resto) en vez de una comparación por clase.
+
+    Si se entrega el área de cada píxel (`area` en agregar, ver
+    raster_io.area_filas_ha) las hectáreas son la suma ponderada de esas
+    áreas; si no, píxeles × area_pixel_ha.
+
+    Parámetros:
+    -----------
+    nodata : int, optional
+        Clase que no se cuenta como píxel válido
+    area_pixel_ha : float
+        Área de un píxel en hectáreas cuando no se entrega `area`
+        (Sentinel-2 en UTM: 10m × 10m = 0.01 ha)
+    """
+
+    def __init__(self, nodata=None, area_pixel_ha=0.01):
+        self.nodata = nodata
+        self.area_pixel_ha = area_pixel_ha
+        self.conteos = {}
+        self.areas = {}
+
+    def agregar(self, clases, mascara=None, area=None):
+        """
+        Incorpora los conteos de un lote de clases.
+
+        Args:
+            clases: Array entero con las clases de la ventana
+            mascara: Array booleano opcional; solo se cuentan los True
+            area: Área (ha) de cada píxel, o una columna (filas, 1) que se
+                expande por broadcasting (ver raster_io.area_ventana). Si
+                se usa, debe entregarse en todos los lotes.
+        """
+        clases = np.asarray(clases)
+        if area is not None:
+            area = np.broadcast_to(area, clases.shape)
+        if mascara is not None:
+            clases = clases[mascara]
+            area = area[mascara] if area is not None else None
+        if clases.size == 0:
+            return
+        pesos = area.ravel() if area is not None else None
+        if clases.dtype.itemsize == 1 and clases.dtype.kind in 'iu':
+            # 8 bits: histograma completo de 256 valores en una pasada
+            codigos = clases.ravel().view(np.uint8)
+            conteo = np.bincount(codigos, minlength=256)
+            valores = np.flatnonzero(conteo)
+            n = conteo[valores]
+            if pesos is not None:
+                ha = np.bincount(codigos, weights=pesos, minlength=256)[valores]
+            if clases.dtype.kind == 'i':
+                valores = np.where(valores > 127, valores - 256, valores)
+        else:
+            valores, inverso, n = np.unique(clases, return_inverse=True, return_counts=True)
+            if pesos is not None:
+                ha = np.bincount(inverso.ravel(), weights=pesos, minlength=len(valores))
+        self.agregar_conteos(zip(valores.tolist(), n.tolist()),
+                             zip(valores.tolist(), ha.tolist()) if pesos is not None else None)
+
+    def agregar_conteos(self, conteos, areas=None):
+        """
+        Suma conteos parciales {clase: píxeles} (o pares) ya calculados y,
+        opcionalmente, sus áreas {clase: hectáreas}.
+        """
+        if isinstance(conteos, dict):
+            conteos = conteos.items()
+        for clase, n in conteos:
+            clase = int(clase)
+            self.conteos[clase] = self.conteos.get(clase, 0) + int(n)
+        if isinstance(areas, dict):
+            areas = areas.items()
+        for clase, ha in areas or ():
+            clase = int(clase)
+            self.areas[clase] = self.areas.get(clase, 0.0) + float(ha)
+
+    def fusionar(self, otro):
+        """Combina los conteos de otro acumulador (otra ventana, proceso o año)."""
+        if otro.nodata != self.nodata:
+            raise ValueError("Solo se pueden fusionar conteos con el mismo nodata")
+        self.agregar_conteos(otro.conteos, otro.areas)
+
+    @property
+    def validos(self):
+        """Píxeles contados, sin el nodata."""
+        return sum(n for clase, n in self.conteos.items() if clase != self.nodata)
+
+    def pixeles(self, clase):
+        """Píxeles de la clase `clase`."""
+        return self.conteos.get(int(clase), 0)
+
+    def porcentaje(self, clase):
+        """Porcentaje (0-100) de la superficie válida que es de la clase `clase`."""
+        if self.areas:
+            total = sum(ha for c, ha in self.areas.items() if c != self.nodata)
+            return 100 * self.hectareas(clase) / total if total > 0 else 0
+        validos = self.validos
+        return 100 * self.pixeles(clase) / validos if validos > 0 else 0
+
+    def hectareas(self, clase):
+        """Superficie de la clase `clase` en hectáreas."""
+        if self.areas:
+            return self.areas.get(int(clase), 0.0)
+        return self.pixeles(clase) * self.area_pixel_ha
+
+    def tabla(self, nombres):
+        """
+        Resumen por clase para las estadísticas y el CSV.
+
+        Args:
+            nombres: {clase_id: nombre} de las clases a reportar
+
+        Returns:
+            list de dict con clase_id, nombre, pixeles, porcentaje, hectareas
+        """
+        return [{
+            'clase_id': clase_id,
+            'nombre': nombre,
+            'pixeles': self.pixeles(clase_id),
+            'porcentaje': self.porcentaje(clase_id),
+            'hectareas': self.hectareas(clase_id)
+        } for clase_id, nombre in nombres.items()]
+
+
+class AcumuladorPorPixel:
+    """
+    Media y varianza de cada píxel a lo largo de una serie de imágenes.
+
+    Cada imagen se incorpora con una actualización de Welford, por lo que
+    basta tener en memoria una imagen de la serie más tres arrays del
+    tamaño del bloque (n, media, M2), sin importar cuántas fechas tenga la
+    serie. Los valores NaN se ignoran (como np.nanmean / np.nanstd).
+
+    Parámetros:
+    -----------
+    forma : tuple
+        Forma (filas, columnas) del bloque
+    """
+
+    def __init__(self, forma):
+        self.n = np.zeros(forma, dtype=np.int32)
+        self.media = np.zeros(forma, dtype=np.float64)
+        self.m2 = np.zeros(forma, dtype=np.float64)
+
+    def agregar(self, imagen):
+        """
+        Incorpora una imagen de la serie.
+
+        Args:
+            imagen: Array (filas, columnas) de una fecha
+        """
+        x = np.asarray(imagen, dtype=np.float64)
+        validos = ~np.isnan(x)
+        self.n += validos
+        delta = np.where(validos, x - self.media, 0.0)
+        # n > 0 donde hay dato nuevo; en el resto delta es 0
+        self.media += delta / np.maximum(self.n, 1)
+        self.m2 += delta * np.where(validos, x - self.media, 0.0)
+
+    def fusionar(self, otro):
+        """Combina otro acumulador del mismo bloque (otra parte de la serie)."""
+        n = self.n + otro.n
+        delta = otro.media - self.media
+        peso = otro.n / np.maximum(n, 1)
+        self.media += delta * peso
+        self.m2 += otro.m2 + delta ** 2 * self.n * peso
+        self.n = n
+
+    def resultado(self):
+        """
+        Media y desviación estándar poblacional (ddof=0) por píxel.
+
+        Returns:
+            tuple (media, std) float64; NaN donde no hubo datos
+        """
+        sin_datos = self.n == 0
+        n = np.maximum(self.n, 1)
+        media = np.where(sin_datos, np.nan, self.media)
+        std = np.where(sin_datos, np.nan, np.sqrt(self.m2 / n))
+        return media, std
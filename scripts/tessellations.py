@@ -0,0 +1,323 @@
+"""
+Teselaciones Jerárquicas de Zonas
+Proyecto: Detección de Cambios Urbanos - Peñaflor
+
+Zonas alternativas a la grilla fija de crear_grilla_analisis:
+
+- cuadrícula regular (vectorizada, ver cuadricula)
+- pirámide de cuadrículas 2^k × 2^k y quadtree adaptativo, que subdivide
+  una celda solo mientras concentre más cambio que una capacidad dada
+- malla hexagonal (hexágonos "pointy-top") en varios niveles
+
+Los conteos de clases se calculan una sola vez, en una pasada por ventanas,
+en el nivel más fino de cada familia (cuadrícula 2^L y hexágonos finos). Los
+niveles gruesos se obtienen sumando conteos (son aditivos), sin volver a
+leer los rasters (lo mismo vale para las hectáreas):
+
+- cuadrícula: cada nivel suma bloques de 2 × 2 del siguiente
+- quadtree: sus hojas son celdas de la pirámide
+- hexágonos: cada hexágono fino se asigna al hexágono grueso que contiene
+  su centro; la geometría gruesa es la unión de sus hijos, por lo que las
+  cifras de cada nivel cuadran exactamente con las del nivel fino
+"""
+
+import numpy as np
+import pandas as pd
+import rasterio
+import shapely
+
+from raster_io import area_filas_ha, area_ventana, iterar_ventanas
+
+_RAIZ3 = np.sqrt(3)
+
+
+def _ids(prefijo, *indices):
+    """Identificadores 'P_ii_jj' (índices >= 0) con ceros a la izquierda, vectorizado."""
+    digitos = max(2, max(len(str(int(np.max(v, initial=0)))) for v in indices))
+    ids = pd.Series(prefijo, index=range(len(indices[0])))
+    for v in indices:
+        ids = ids + '_' + pd.Series(v).astype(str).str.zfill(digitos)
+    return ids.values
+
+
+def cajas(limites, n_x, n_y, i, j):
+    """
+    Polígonos de las celdas [i, j] de una cuadrícula n_x × n_y sobre
+    `limites`. Cada borde se calcula con la misma expresión en las dos
+    celdas que lo comparten, de modo que las vecinas se tocan exactamente
+    (sin huecos ni traslapes por redondeo).
+    """
+    xmin, ymin, xmax, ymax = limites
+    i, j = np.asarray(i), np.asarray(j)
+    ancho_celda = (xmax - xmin) / n_x
+    alto_celda = (ymax - ymin) / n_y
+    return shapely.box(xmin + i * ancho_celda, ymin + j * alto_celda,
+                       xmin + (i + 1) * ancho_celda, ymin + (j + 1) * alto_celda)
+
+
+def celdas_cuadricula(alto, ancho, n_x, n_y):
+    """
+    Celda de cada columna y de cada fila de un raster (norte arriba) para
+    una cuadrícula de n_x × n_y que cubre su extensión.
+
+    La celda de un píxel es la que contiene su centro (aritmética entera);
+    i se cuenta desde el oeste y j desde el sur, y la zona es i * n_y + j.
+
+    Retorna:
+    --------
+    tuple (i por columna, j por fila)
+    """
+    i = ((2 * np.arange(ancho) + 1) * n_x) // (2 * ancho)
+    j = ((2 * (alto - np.arange(alto)) - 1) * n_y) // (2 * alto)
+    return i, j
+
+
+def cuadricula(limites, n_x, n_y, prefijo='Z'):
+    """
+    Geometrías e identificadores de una cuadrícula regular, vectorizados.
+
+    Parámetros:
+    -----------
+    limites : tuple
+        (xmin, ymin, xmax, ymax)
+    n_x, n_y : int
+        Celdas en X e Y
+    prefijo : str
+        Prefijo de zona_id
+
+    Retorna:
+    --------
+    dict con zona_id, zona_x, zona_y y geometry (orden i * n_y + j)
+    """
+    zona_x, zona_y = np.divmod(np.arange(n_x * n_y), n_y)
+    return {
+        'zona_id': _ids(prefijo, zona_x, zona_y),
+        'zona_x': zona_x,
+        'zona_y': zona_y,
+        'geometry': cajas(limites, n_x, n_y, zona_x, zona_y),
+    }
+
+
+def piramide_cuadricula(conteo_fino):
+    """
+    Pirámide de conteos sumando bloques de 2 × 2.
+
+    Parámetros:
+    -----------
+    conteo_fino : ndarray (n, n, n_clases)
+        Conteos por celda [i, j] del nivel más fino (n = 2^L)
+
+    Retorna:
+    --------
+    list : conteos por nivel, de 1 × 1 (nivel 0) a n × n (nivel L)
+    """
+    niveles = [conteo_fino]
+    while niveles[0].shape[0] > 1:
+        n = niveles[0].shape[0] // 2
+        niveles.insert(0, niveles[0].reshape(n, 2, n, 2, -1).sum(axis=(1, 3)))
+    return niveles
+
+
+def hojas_quadtree(piramide, peso_cambio, capacidad):
+    """
+    Hojas de un quadtree adaptativo sobre la pirámide de conteos.
+
+    Una celda se subdivide mientras su cambio (conteos ponderados por
+    `peso_cambio`) supere `capacidad` y no esté en el nivel más fino.
+
+    Parámetros:
+    -----------
+    piramide : list
+        Salida de piramide_cuadricula
+    peso_cambio : ndarray (n_clases,)
+        Peso de cada clase en la medida de cambio (ej: 1 en las clases de
+        cambio, 0 en 'Sin cambio')
+    capacidad : float
+        Cambio máximo de una hoja (en las unidades de los conteos)
+
+    Retorna:
+    --------
+    tuple (nivel, i, j) de arrays, una entrada por hoja
+    """
+    nivel_max = len(piramide) - 1
+    hojas = []
+    i = j = np.zeros(1, dtype=np.int64)
+    for nivel, conteo in enumerate(piramide):
+        cambio = conteo[i, j] @ peso_cambio
+        dividir = (cambio > capacidad) & (nivel < nivel_max)
+        hojas.append((np.full((~dividir).sum(), nivel), i[~dividir], j[~dividir]))
+        # Hijos de las celdas divididas
+        i = (2 * i[dividir])[:, None] + np.array([0, 0, 1, 1])
+        j = (2 * j[dividir])[:, None] + np.array([0, 1, 0, 1])
+        i, j = i.ravel(), j.ravel()
+    return tuple(np.concatenate(partes) for partes in zip(*hojas))
+
+
+class MallaHexagonal:
+    """
+    Malla de hexágonos "pointy-top" en coordenadas axiales (q, r).
+
+    Cada hexágono de la extensión recibe una clave densa
+    (q - q_min) * n_r + (r - r_min), usable directamente en np.bincount.
+
+    Parámetros:
+    -----------
+    limites : tuple
+        (xmin, ymin, xmax, ymax) que debe cubrir la malla
+    lado : float
+        Lado (= radio) del hexágono en unidades del CRS
+    origen : tuple, optional
+        Centro del hexágono (0, 0); por defecto (xmin, ymin). Mallas con el
+        mismo origen y lados múltiplos quedan anidadas por centros.
+    """
+
+    def __init__(self, limites, lado, origen=None):
+        self.origen = np.array(limites[:2] if origen is None else origen, dtype=np.float64)
+        self.lado = float(lado)
+        xs = np.array([limites[0], limites[2], limites[0], limites[2]])
+        ys = np.array([limites[1], limites[1], limites[3], limites[3]])
+        q, r = self._fraccional(xs, ys)
+        self.q_min, self.r_min = int(np.floor(q.min())) - 1, int(np.floor(r.min())) - 1
+        self.n_q = int(np.ceil(q.max())) + 2 - self.q_min
+        self.n_r = int(np.ceil(r.max())) + 2 - self.r_min
+        self.n_claves = self.n_q * self.n_r
+
+    def _fraccional(self, x, y):
+        x = (np.asarray(x, dtype=np.float64) - self.origen[0]) / self.lado
+        y = (np.asarray(y, dtype=np.float64) - self.origen[1]) / self.lado
+        return _RAIZ3 / 3 * x - y / 3, 2 / 3 * y
+
+    def clave(self, x, y):
+        """Clave del hexágono que contiene cada punto (redondeo cúbico)."""
+        qf, rf = self._fraccional(x, y)
+        sf = -qf - rf
+        q, r, s = np.round(qf), np.round(rf), np.round(sf)
+        dq, dr, ds = np.abs(q - qf), np.abs(r - rf), np.abs(s - sf)
+        corregir_q = (dq > dr) & (dq > ds)
+        corregir_r = ~corregir_q & (dr > ds)
+        q = np.where(corregir_q, -r - s, q)
+        r = np.where(corregir_r, -q - s, r)
+        return (q.astype(np.int64) - self.q_min) * self.n_r + (r.astype(np.int64) - self.r_min)
+
+    def axiales(self, claves):
+        """Coordenadas axiales (q, r) de cada clave."""
+        q, r = np.divmod(np.asarray(claves), self.n_r)
+        return q + self.q_min, r + self.r_min
+
+    def centros(self, claves):
+        """Centro (x, y) de cada hexágono."""
+        q, r = self.axiales(claves)
+        x = self.origen[0] + self.lado * (_RAIZ3 * q + _RAIZ3 / 2 * r)
+        y = self.origen[1] + self.lado * 1.5 * r
+        return x, y
+
+    def poligonos(self, claves):
+        """Polígonos de los hexágonos (una llamada a shapely.polygons)."""
+        cx, cy = self.centros(claves)
+        angulos = np.deg2rad(30 + 60 * np.arange(6))
+        vertices = np.stack([cx[:, None] + self.lado * np.cos(angulos),
+                             cy[:, None] + self.lado * np.sin(angulos)], axis=-1)
+        return shapely.polygons(vertices)
+
+
+def conteo_teselaciones(ruta_clases, n_clases, n_cuadricula, malla):
+    """
+    Píxeles y hectáreas de cada clase en el nivel fino de la cuadrícula y
+    de la malla hexagonal, en una sola pasada por ventanas. Las hectáreas
+    suman el área real de cada píxel (ver raster_io.area_filas_ha).
+
+    Parámetros:
+    -----------
+    ruta_clases : Path
+        Raster categórico (clases 0..n_clases-1; el resto se ignora)
+    n_clases : int
+        Número de clases
+    n_cuadricula : int
+        Celdas por lado de la cuadrícula fina
+    malla : MallaHexagonal
+        Malla de hexágonos finos sobre la extensión del raster
+
+    Retorna:
+    --------
+    tuple (conteo_cuadricula (n, n, n_clases), conteo_hexagonos (n_claves, n_clases),
+           hectareas_cuadricula, hectareas_hexagonos)
+    """
+    conteo_cuad = np.zeros(n_cuadricula * n_cuadricula * n_clases, dtype=np.int64)
+    conteo_hex = np.zeros(malla.n_claves * n_clases, dtype=np.int64)
+    ha_cuad = np.zeros(conteo_cuad.size)
+    ha_hex = np.zeros(conteo_hex.size)
+
+    with rasterio.open(ruta_clases) as src:
+        i_col, j_fila = celdas_cuadricula(src.height, src.width, n_cuadricula, n_cuadricula)
+        # Coordenadas X de los centros de columna (comunes a todas las ventanas)
+        x_col = src.transform.c + (np.arange(src.width) + 0.5) * src.transform.a
+        area_filas = area_filas_ha(src.crs, src.transform, src.height)
+        for ventana in iterar_ventanas(src):
+            clases = src.read(1, window=ventana)
+            filas = np.arange(ventana.row_off, ventana.row_off + ventana.height)
+            valido = clases < n_clases
+            c = clases[valido].astype(np.int64)
+            area = np.broadcast_to(area_ventana(area_filas, ventana), valido.shape)[valido]
+
+            zona = (i_col[np.newaxis, :] * n_cuadricula + j_fila[filas][:, np.newaxis])[valido]
+            conteo_cuad += np.bincount(zona * n_clases + c, minlength=conteo_cuad.size)
+            ha_cuad += np.bincount(zona * n_clases + c, weights=area, minlength=ha_cuad.size)
+
+            y_fila = src.transform.f + (filas + 0.5) * src.transform.e
+            x, y = np.broadcast_arrays(x_col[np.newaxis, :], y_fila[:, np.newaxis])
+            hexagono = malla.clave(x[valido], y[valido])
+            conteo_hex += np.bincount(hexagono * n_clases + c, minlength=conteo_hex.size)
+            ha_hex += np.bincount(hexagono * n_clases + c, weights=area, minlength=ha_hex.size)
+
+    forma_cuad = (n_cuadricula, n_cuadricula, n_clases)
+    forma_hex = (malla.n_claves, n_clases)
+    return (conteo_cuad.reshape(forma_cuad), conteo_hex.reshape(forma_hex),
+            ha_cuad.reshape(forma_cuad), ha_hex.reshape(forma_hex))
+
+
+def niveles_hexagonales(malla, conteo_fino, n_niveles, factor=2):
+    """
+    Agrega los hexágonos finos en niveles cada vez más gruesos.
+
+    Parámetros:
+    -----------
+    malla : MallaHexagonal
+        Malla fina
+    conteo_fino : ndarray (n_claves, n_columnas)
+        Conteos (o hectáreas) por clave de la malla fina
+    n_niveles : int
+        Número de niveles (el primero es el fino)
+    factor : float
+        Razón entre los lados de niveles consecutivos
+
+    Retorna:
+    --------
+    list de dict (uno por nivel) con zona_id, conteo y geometry
+    """
+    presentes = np.flatnonzero(conteo_fino.sum(axis=1))
+    geometria_fina = malla.poligonos(presentes)
+    cx, cy = malla.centros(presentes)
+    limites = (cx.min(), cy.min(), cx.max(), cy.max())
+
+    niveles = []
+    for nivel in range(n_niveles):
+        gruesa = MallaHexagonal(limites, malla.lado * factor ** nivel, origen=malla.origen)
+        claves, grupo = np.unique(gruesa.clave(cx, cy), return_inverse=True)
+
+        conteo = np.zeros((len(claves), conteo_fino.shape[1]), dtype=conteo_fino.dtype)
+        np.add.at(conteo, grupo, conteo_fino[presentes])
+        if nivel == 0:
+            geometria = geometria_fina
+        else:
+            # Unión de los hijos de cada hexágono grueso
+            orden = np.argsort(grupo, kind='stable')
+            cortes = np.flatnonzero(np.diff(grupo[orden])) + 1
+            geometria = np.array([shapely.union_all(hijos)
+                                  for hijos in np.split(geometria_fina[orden], cortes)])
+        q, r = gruesa.axiales(claves)
+        niveles.append({
+            'zona_id': _ids(f'H{nivel}', q - q.min(), r - r.min()),
+            'conteo': conteo,
+            'geometry': geometria,
+        })
+    return niveles
@@ -6,7 +6,7 @@ Cuantifica cambios urbanos por zonas geográficas mediante:
 1. Creación de grilla de análisis espacial
 2. Estadísticas zonales de cambios por zona
 3. Análisis temporal de evolución de índices
-4. Identificación de hotspots de urbanización
+4. Identificación de hotspots de urbanización (ranking, Gi* y Moran local)
 5. Generación de mapas y tablas para dashboard
 
 Autor: Byron Caices
@@ -14,18 +14,28 @@ Fecha: Enero 2025
 Universidad de Santiago de Chile
 """
 
+import argparse
+import json
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 import rasterio
+import shapely
 from pathlib import Path
-from shapely.geometry import box
-from rasterstats import zonal_stats
 import matplotlib.pyplot as plt
 import seaborn as sns
-from scipy.spatial import distance
-from scipy.ndimage import label
 import glob
+from pyproj import CRS
+
+from change_patches import ParchesCambio
+from pipeline_manifest import NOMBRE_MANIFIESTO, Manifiesto, version_codigo
+from raster_io import area_filas_ha, area_ventana, escribir_cog, indice_banda, iterar_ventanas
+from spatial_stats import (CUADRANTES_MORAN, clases_gi, gi_estrella, moran_local,
+                           pesos_contiguidad, pesos_knn)
+from streaming_stats import AcumuladorEstadisticas
+from tessellations import (MallaHexagonal, cajas, conteo_teselaciones, cuadricula,
+                           hojas_quadtree, niveles_hexagonales, piramide_cuadricula)
+from zone_index import CoberturaZonas, IndiceZonas, ParcialesZonas
 
 # Configuración
 BASE_DIR = Path(__file__).parent.parent
@@ -53,8 +63,52 @@ CLASES_CAMBIO = {
     5: 'Pérdida agua'
 }
 
-# Conversión de píxel a hectáreas (Sentinel-2: 10m × 10m = 100 m² = 0.01 ha)
-PIXEL_AREA_HA = 0.01
+# Unidad mínima de mapeo: los parches de cambio más pequeños se asignan a
+# 'Sin cambio' antes del análisis zonal (0 desactiva el filtrado)
+UNIDAD_MINIMA_HA = 0.05
+
+# Vecindad de los parches de cambio (4 u 8)
+CONECTIVIDAD_PARCHES = 8
+
+# Tamaño de la grilla de análisis (celdas en X e Y)
+N_CELLS_X = 10
+N_CELLS_Y = 10
+
+# Teselaciones jerárquicas (--teselaciones): cuadrícula fina de
+# 2^TESELACION_NIVEL_MAX celdas por lado, quadtree que subdivide mientras una
+# celda tenga más de QUADTREE_CAPACIDAD_HA de cambio, y HEXAGONOS_NIVELES
+# niveles de hexágonos (el fino con HEXAGONOS_ANCHO hexágonos de ancho)
+TESELACION_NIVEL_MAX = 6
+QUADTREE_CAPACIDAD_HA = 25.0
+HEXAGONOS_ANCHO = 48
+HEXAGONOS_NIVELES = 3
+
+# Hotspots estadísticos (Gi* y Moran local): vecindad por defecto ('queen',
+# 'rook' o 'knn' con K_VECINOS), permutaciones del Moran local y nivel de
+# significancia de sus clusters
+VECINDAD_HOTSPOTS = 'queen'
+K_VECINOS = 8
+PERMUTACIONES_MORAN = 999
+ALFA_HOTSPOTS = 0.05
+
+# Coberturas por índice: (columna, operador, umbral). Definen los porcentajes
+# del análisis temporal y del cubo zona × año × índice
+UMBRALES_COBERTURA = {
+    'ndvi': ('pct_vegetacion', '>', 0.3),
+    'ndbi': ('pct_urbano', '>', 0),
+    'ndwi': ('pct_agua', '>', 0.1),
+}
+
+# Ejes del cubo zona × año × índice × estadístico (pct_umbral: % de píxeles
+# sobre el umbral de UMBRALES_COBERTURA; NaN si el índice no tiene umbral)
+INDICES_CUBO = ('ndvi', 'ndbi', 'ndwi', 'bsi')
+ESTADISTICOS_CUBO = ('media', 'std', 'pct_umbral')
+
+# Código del que dependen los productos de esta etapa (versión en el manifiesto)
+ARCHIVOS_CODIGO = [Path(__file__).resolve().parent / nombre
+                   for nombre in ('zonal_analysis.py', 'change_patches.py', 'raster_io.py',
+                                  'spatial_stats.py', 'streaming_stats.py', 'tessellations.py',
+                                  'zone_index.py')]
 
 print("="*70)
 print("📊  ANÁLISIS ZONAL DE CAMBIOS URBANOS")
@@ -63,6 +117,25 @@ print("="*70)
 print()
 
 
+def _area_ha(gdf):
+    """
+    Área de cada geometría en hectáreas.
+    
+    En un CRS geográfico se proyecta a una Lambert azimutal equivalente
+    centrada en la capa (conserva áreas); en uno proyectado se usa el área
+    planar en sus unidades.
+    """
+    crs = CRS.from_user_input(gdf.crs)
+    if crs.is_geographic:
+        lon, lat = np.mean(gdf.total_bounds.reshape(2, 2), axis=0)
+        elipsoide = crs.ellipsoid
+        laea = CRS.from_proj4(f'+proj=laea +lat_0={lat} +lon_0={lon} '
+                              f'+a={elipsoide.semi_major_metre} +rf={elipsoide.inverse_flattening}')
+        return gdf.geometry.to_crs(laea).area / 10000
+    factor = crs.axis_info[0].unit_conversion_factor if crs.axis_info else 1.0
+    return gdf.geometry.area * factor ** 2 / 10000
+
+
 def crear_grilla_analisis(ruta_raster, salida_vector, n_cells_x=10, n_cells_y=10):
     """
     Crea una grilla de análisis sobre el área de estudio.
@@ -70,6 +143,11 @@ def crear_grilla_analisis(ruta_raster, salida_vector, n_cells_x=10, n_cells_y=10
     Esta grilla simula unidades administrativas (barrios/distritos) cuando no se
     dispone de shapefiles censales oficiales. Cada celda representa una zona de análisis.
     
+    Las celdas se generan vectorizadas (shapely.box sobre arrays), por lo que
+    una grilla de 500 × 500 cuesta lo mismo que reservar sus arrays. El orden
+    de las zonas (i * n_cells_y + j) coincide con el índice raster de
+    IndiceZonas.desde_grilla.
+    
     Parámetros:
     -----------
     ruta_raster : Path
@@ -105,37 +183,15 @@ def crear_grilla_analisis(ruta_raster, salida_vector, n_cells_x=10, n_cells_y=10
     print(f"   Extensión: [{xmin:.2f}, {ymin:.2f}, {xmax:.2f}, {ymax:.2f}]")
     print(f"   CRS: {crs}")
     print(f"   Celdas: {n_cells_x} × {n_cells_y} = {n_cells_x * n_cells_y} zonas")
-    print(f"   Tamaño celda: {cell_width:.2f}m × {cell_height:.2f}m")
-    print(f"   Área celda: {(cell_width * cell_height) / 10000:.2f} ha")
-    
-    # Crear geometrías de celda
-    grid_cells = []
-    zona_ids = []
-    zona_x = []
-    zona_y = []
-    
-    for i in range(n_cells_x):
-        for j in range(n_cells_y):
-            x1 = xmin + i * cell_width
-            y1 = ymin + j * cell_height
-            x2 = x1 + cell_width
-            y2 = y1 + cell_height
-            
-            grid_cells.append(box(x1, y1, x2, y2))
-            zona_ids.append(f"Z_{i:02d}_{j:02d}")
-            zona_x.append(i)
-            zona_y.append(j)
-    
-    # Crear GeoDataFrame
-    gdf = gpd.GeoDataFrame({
-        'zona_id': zona_ids,
-        'zona_x': zona_x,
-        'zona_y': zona_y,
-        'geometry': grid_cells
-    }, crs=crs)
-    
-    # Calcular área de cada zona (en hectáreas)
-    gdf['area_ha'] = gdf.geometry.area / 10000
+    print(f"   Tamaño celda: {cell_width:.6g} × {cell_height:.6g} (unidades del CRS)")
+    
+    # Geometrías e identificadores Z_ii_jj en una sola llamada (i recorre X y
+    # es el más lento; más dígitos si la grilla supera 100 celdas por lado)
+    gdf = gpd.GeoDataFrame(cuadricula(bounds, n_cells_x, n_cells_y), crs=crs)
+    
+    # Calcular área de cada zona (en hectáreas, equivalente aunque el CRS sea geográfico)
+    gdf['area_ha'] = _area_ha(gdf)
+    print(f"   Área celda: {gdf['area_ha'].mean():.2f} ha (media)")
     
     # Guardar
     gdf.to_file(salida_vector, driver='GPKG')
@@ -146,18 +202,203 @@ def crear_grilla_analisis(ruta_raster, salida_vector, n_cells_x=10, n_cells_y=10
     return gdf
 
 
-def analisis_zonal_cambios(ruta_cambios, gdf_zonas, columna_zona='zona_id'):
+def cargar_zonas(ruta_zonas, ruta_raster, campo_zona='zona_id'):
+    """
+    Carga una capa de polígonos propia (manzanas censales, barrios,
+    distritos) como zonas de análisis, en lugar de la grilla.
+    
+    Los polígonos pueden ser irregulares o traslaparse: sus estadísticas se
+    calculan con CoberturaZonas (fracción exacta de cada píxel cubierta).
+    
+    Parámetros:
+    -----------
+    ruta_zonas : Path
+        Capa vectorial legible por geopandas (GeoPackage, shapefile, GeoJSON)
+    ruta_raster : Path
+        Raster de referencia (la capa se reproyecta a su CRS)
+    campo_zona : str
+        Columna con el identificador de cada zona; si no existe se numeran
+        Z_0001, Z_0002, ...
+        
+    Retorna:
+    --------
+    gdf : GeoDataFrame
+        Zonas con zona_id y area_ha
+    """
+    
+    print("="*70)
+    print("PASO 1: CARGA DE ZONAS")
+    print("="*70)
+    
+    with rasterio.open(ruta_raster) as src:
+        crs = src.crs
+    
+    gdf = gpd.read_file(ruta_zonas)
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty].reset_index(drop=True)
+    if gdf.crs is None:
+        print(f"   ⚠️  {Path(ruta_zonas).name} sin CRS: se asume el del raster")
+        gdf = gdf.set_crs(crs)
+    gdf = gdf.to_crs(crs)
+    
+    if campo_zona in gdf.columns:
+        gdf['zona_id'] = gdf[campo_zona].astype(str)
+    else:
+        digitos = max(4, len(str(len(gdf))))
+        gdf['zona_id'] = [f'Z_{k:0{digitos}d}' for k in range(1, len(gdf) + 1)]
+    if gdf['zona_id'].duplicated().any():
+        print(f"   ⚠️  Identificadores repetidos en '{campo_zona}'")
+    
+    gdf['area_ha'] = _area_ha(gdf)
+    
+    print(f"\n✓ {len(gdf)} zonas cargadas desde {Path(ruta_zonas).name}")
+    print(f"   Área: {gdf['area_ha'].sum():.2f} ha (media {gdf['area_ha'].mean():.2f} ha por zona)")
+    
+    return gdf
+
+
+def _rutas_indices_periodo(src_cambios):
+    """
+    Archivos de índices de los años comparados, leídos de la descripción de
+    banda del mapa de cambios (ej: 'Clasificacion_Cambio_2018_2024').
+    Retorna None si no se pueden ubicar.
+    """
+    descripcion = src_cambios.descriptions[0] or ''
+    years = [p for p in descripcion.split('_') if p.isdigit()][-2:]
+    rutas = [INPUT_DIR_PROC / f'indices_{year}.tif' for year in years]
+    if len(rutas) == 2 and all(r.exists() for r in rutas):
+        return rutas
+    return None
+
+
+def filtrar_parches_cambio(ruta_cambios, ruta_salida, unidad_minima_ha=UNIDAD_MINIMA_HA,
+                           conectividad=CONECTIVIDAD_PARCHES):
+    """
+    Identifica parches conexos de cambio y elimina los menores a la unidad
+    mínima de mapeo.
+    
+    Recorre el mapa de cambios por franjas (ver change_patches): la primera
+    pasada etiqueta cada franja y une los parches que cruzan las costuras;
+    la segunda escribe el mapa filtrado, donde los parches pequeños pasan a
+    'Sin cambio'. Memoria acotada por el número de parches, no por la escena.
+    
+    Parámetros:
+    -----------
+    ruta_cambios : Path
+        Ruta al raster de cambios clasificados (cambio_clasificado.tif)
+    ruta_salida : Path
+        Ruta del raster filtrado (COG)
+    unidad_minima_ha : float
+        Área mínima de un parche en hectáreas
+    conectividad : int
+        Vecindad de los parches (4 u 8)
+        
+    Retorna:
+    --------
+    df_parches : DataFrame
+        Un registro por parche: clase, área, caja envolvente, centroide,
+        ΔNDBI medio y si fue eliminado por la unidad mínima
+    """
+    
+    print("\n" + "="*70)
+    print("PASO 1b: FILTRADO DE PARCHES DE CAMBIO")
+    print("="*70)
+    
+    clases = [c for c in CLASES_CAMBIO if c != 0]
+    parches = ParchesCambio(clases, conectividad=conectividad)
+    
+    with rasterio.open(ruta_cambios) as src:
+        # Área real de los píxeles por fila: la unidad mínima se compara en hectáreas
+        area_filas = area_filas_ha(src.crs, src.transform, src.height)
+        print(f"\n🧩 Unidad mínima de mapeo: {unidad_minima_ha} ha "
+              f"(~{unidad_minima_ha / area_filas.mean():.1f} px), vecindad {conectividad}")
+        
+        ventanas = list(iterar_ventanas(src))
+        rutas_indices = _rutas_indices_periodo(src)
+        fuentes_ndbi = [rasterio.open(r) for r in rutas_indices] if rutas_indices else []
+        if not fuentes_ndbi:
+            print("   ⚠️  Índices del periodo no encontrados: ΔNDBI medio quedará vacío")
+        
+        try:
+            # Pasada 1: etiquetado por franjas + costuras
+            for ventana in ventanas:
+                clase = src.read(1, window=ventana)
+                delta_ndbi = None
+                if fuentes_ndbi:
+                    ndbi = [f.read(indice_banda(f, 'ndbi'), window=ventana).astype(np.float32)
+                            for f in fuentes_ndbi]
+                    delta_ndbi = np.where((ndbi[0] != -9999) & (ndbi[1] != -9999),
+                                          ndbi[1] - ndbi[0], np.nan)
+                parches.agregar(clase, ventana.row_off, delta_ndbi,
+                                area=area_ventana(area_filas, ventana))
+        finally:
+            for f in fuentes_ndbi:
+                f.close()
+        
+        tabla = parches.resolver()
+        
+        # Pasada 2: mapa filtrado
+        with escribir_cog(ruta_salida, src.profile) as dst:
+            dst.set_band_description(1, src.descriptions[0])
+            for i, ventana in enumerate(ventanas):
+                clase = src.read(1, window=ventana)
+                dst.write(parches.filtrar(clase, i, min_area=unidad_minima_ha), 1,
+                          window=ventana)
+        
+        transform = src.transform
+    
+    # Coordenadas de mapa: esquinas de la caja y centro de los píxeles
+    xmin, ymax = transform * (tabla['columna_min'], tabla['fila_min'])
+    xmax, ymin = transform * (tabla['columna_max'] + 1, tabla['fila_max'] + 1)
+    cx, cy = transform * (tabla['columna_media'] + 0.5, tabla['fila_media'] + 0.5)
+    
+    df_parches = pd.DataFrame({
+        'parche_id': tabla['parche_id'],
+        'clase_id': tabla['clase'],
+        'clase': [CLASES_CAMBIO[c] for c in tabla['clase']],
+        'pixeles': tabla['pixeles'],
+        'area_ha': tabla['area'],
+        'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax,
+        'centroide_x': cx,
+        'centroide_y': cy,
+        'delta_ndbi_medio': tabla['auxiliar_media'],
+        'eliminado': tabla['area'] < unidad_minima_ha * (1 - 1e-9),
+    })
+    
+    print(f"\n📊 Parches por clase (conservados / eliminados):")
+    for clase_id, grupo in df_parches.groupby('clase_id'):
+        eliminados = grupo['eliminado']
+        print(f"   {CLASES_CAMBIO[clase_id]:<22} {(~eliminados).sum():>7,} / {eliminados.sum():>7,} "
+              f"({grupo.loc[eliminados, 'area_ha'].sum():.2f} ha eliminadas)")
+    print(f"\n✓ Mapa filtrado: {Path(ruta_salida).name}")
+    
+    return df_parches
+
+
+def analisis_zonal_cambios(ruta_cambios, gdf_zonas, indice_zonas, columna_zona='zona_id',
+                           parciales=None):
     """
     Calcula estadísticas de cambio por zona usando análisis zonal.
     
+    Los conteos y superficies por clase salen del índice de zonas (ver
+    zone_index): una pasada por ventanas con un único bincount 2-D sobre
+    (zona, clase), ponderado por el área real de cada píxel y, con
+    polígonos propios, por la fracción del píxel dentro de la zona.
+    
+    Con `parciales` (ParcialesZonas de una corrida anterior) solo se
+    recalculan las teselas del raster de clases cuya firma cambió.
+    
     Parámetros:
     -----------
     ruta_cambios : Path
         Ruta al raster de cambios clasificados (cambio_clasificado.tif)
     gdf_zonas : GeoDataFrame
         Polígonos de zonas de análisis
+    indice_zonas : IndiceZonas o CoberturaZonas
+        Índice de `gdf_zonas` alineado a `ruta_cambios`
     columna_zona : str
         Nombre de la columna con identificador de zona
+    parciales : ParcialesZonas, opcional
+        Parciales por tesela; se actualizan en el lugar
         
     Retorna:
     --------
@@ -171,26 +412,51 @@ def analisis_zonal_cambios(ruta_cambios, gdf_zonas, columna_zona='zona_id'):
     
     print(f"\n📊 Calculando estadísticas para {len(gdf_zonas)} zonas...")
     
-    # Realizar estadísticas zonales categóricas
-    stats = zonal_stats(
-        gdf_zonas,
-        str(ruta_cambios),
-        stats=['count', 'sum', 'mean'],
-        categorical=True,
-        all_touched=True,
-        nodata=255
-    )
+    # Píxeles y hectáreas por (zona, clase) en una pasada; el nodata (255) queda fuera
+    if parciales is None:
+        conteo, hectareas = indice_zonas.superficie_clases(ruta_cambios, max(CLASES_CAMBIO) + 1)
+    else:
+        conteo, hectareas = parciales.actualizar(indice_zonas, ruta_cambios)
+        print(f"   🧩 Teselas recalculadas: {parciales.recalculadas} de {len(parciales.teselas)} "
+              f"({len(parciales.modificadas)} zonas con cambios)")
+    gdf_zonas = _agregar_columnas_cambio(gdf_zonas, conteo, hectareas)
+    
+    print(f"\n📈 Resumen Global:")
+    print(f"   Total urbanización:        {gdf_zonas['urbanizacion_ha'].sum():8.2f} ha")
+    print(f"   Total pérdida vegetación:  {gdf_zonas['perdida_vegetacion_ha'].sum():8.2f} ha")
+    print(f"   Total ganancia vegetación: {gdf_zonas['ganancia_vegetacion_ha'].sum():8.2f} ha")
+    print(f"   Cambio neto vegetación:    {(gdf_zonas['ganancia_vegetacion_ha'].sum() - gdf_zonas['perdida_vegetacion_ha'].sum()):8.2f} ha")
+    
+    return gdf_zonas
+
+
+def _agregar_columnas_cambio(gdf_zonas, conteo, hectareas):
+    """
+    Agrega a las zonas las columnas de cambio (_px, _ha, _pct por clase y
+    métricas agregadas) a partir de sus píxeles y hectáreas por clase. Los
+    porcentajes son sobre la superficie válida de la zona.
     
-    # Convertir a DataFrame
-    df_stats = pd.DataFrame(stats)
+    Parámetros:
+    -----------
+    gdf_zonas : GeoDataFrame
+        Zonas con columna area_ha
+    conteo : ndarray (n_zonas, n_clases)
+        Píxeles de cada clase por zona (fraccionales con CoberturaZonas;
+        las columnas _px se redondean)
+    hectareas : ndarray (n_zonas, n_clases)
+        Superficie de cada clase por zona (suma del área de sus píxeles)
+        
+    Retorna:
+    --------
+    gdf_zonas : GeoDataFrame
+    """
+    df_stats = pd.DataFrame(conteo, columns=range(conteo.shape[1]), index=gdf_zonas.index)
     
-    # Asegurar que todas las clases existan (rellenar con 0 si no hay datos)
-    for clase_id in CLASES_CAMBIO.keys():
-        if clase_id not in df_stats.columns:
-            df_stats[clase_id] = 0
+    df_ha = pd.DataFrame(hectareas, columns=range(hectareas.shape[1]), index=gdf_zonas.index)
     
-    # Calcular píxeles totales válidos por zona
-    df_stats['pixeles_validos'] = df_stats['count']
+    # Calcular píxeles y superficie válidos por zona
+    df_stats['pixeles_validos'] = conteo.sum(axis=1)
+    area_valida = hectareas.sum(axis=1)
     
     # Calcular hectáreas por clase
     for clase_id, clase_nombre in CLASES_CAMBIO.items():
@@ -211,18 +477,18 @@ def analisis_zonal_cambios(ruta_cambios, gdf_zonas, columna_zona='zona_id'):
                 gdf_zonas = gdf_zonas.drop(columns=col_full)
         
         # Píxeles
-        gdf_zonas[f'{col_name}_px'] = df_stats[clase_id].fillna(0).astype(int)
+        gdf_zonas[f'{col_name}_px'] = np.rint(df_stats[clase_id].fillna(0)).astype(int)
         
         # Hectáreas
-        gdf_zonas[f'{col_name}_ha'] = gdf_zonas[f'{col_name}_px'] * PIXEL_AREA_HA
+        gdf_zonas[f'{col_name}_ha'] = df_ha[clase_id]
         
         # Porcentaje
         gdf_zonas[f'{col_name}_pct'] = (
-            100 * gdf_zonas[f'{col_name}_px'] / df_stats['pixeles_validos']
+            100 * gdf_zonas[f'{col_name}_ha'] / area_valida
         ).fillna(0)
     
     # Calcular métricas agregadas
-    gdf_zonas['pixeles_validos'] = df_stats['pixeles_validos'].fillna(0).astype(int)
+    gdf_zonas['pixeles_validos'] = np.rint(df_stats['pixeles_validos'].fillna(0)).astype(int)
     gdf_zonas['cambio_total_ha'] = (
         gdf_zonas['urbanizacion_ha'] + 
         gdf_zonas['perdida_vegetacion_ha'] +
@@ -239,15 +505,94 @@ def analisis_zonal_cambios(ruta_cambios, gdf_zonas, columna_zona='zona_id'):
         gdf_zonas['ganancia_vegetacion_ha']
     )
     
-    print(f"\n📈 Resumen Global:")
-    print(f"   Total urbanización:        {gdf_zonas['urbanizacion_ha'].sum():8.2f} ha")
-    print(f"   Total pérdida vegetación:  {gdf_zonas['perdida_vegetacion_ha'].sum():8.2f} ha")
-    print(f"   Total ganancia vegetación: {gdf_zonas['ganancia_vegetacion_ha'].sum():8.2f} ha")
-    print(f"   Cambio neto vegetación:    {(gdf_zonas['ganancia_vegetacion_ha'].sum() - gdf_zonas['perdida_vegetacion_ha'].sum()):8.2f} ha")
-    
     return gdf_zonas
 
 
+def generar_teselaciones(ruta_cambios, salida_vector):
+    """
+    Genera teselaciones alternativas (cuadrículas jerárquicas, quadtree
+    adaptativo y hexágonos) con las mismas columnas que zonas_con_datos.
+    
+    Los conteos se calculan una sola vez en el nivel más fino (ver
+    tessellations) y los niveles gruesos se agregan sumando, de modo que el
+    dashboard puede cambiar de nivel sin volver a leer los rasters.
+    
+    Parámetros:
+    -----------
+    ruta_cambios : Path
+        Raster de cambios clasificados
+    salida_vector : Path
+        GeoPackage de salida (una capa por nivel)
+        
+    Retorna:
+    --------
+    list : nombres de las capas escritas
+    """
+    
+    print("\n" + "="*70)
+    print("PASO 2b: TESELACIONES JERÁRQUICAS")
+    print("="*70)
+    
+    n_clases = max(CLASES_CAMBIO) + 1
+    n_fino = 2 ** TESELACION_NIVEL_MAX
+    
+    with rasterio.open(ruta_cambios) as src:
+        limites = tuple(src.bounds)
+        crs = src.crs
+    lado_hex = (limites[2] - limites[0]) / (HEXAGONOS_ANCHO * np.sqrt(3))
+    malla = MallaHexagonal(limites, lado_hex)
+    
+    print(f"\n🧮 Nivel fino: cuadrícula {n_fino}×{n_fino} y {HEXAGONOS_ANCHO} hexágonos de ancho "
+          f"(una sola lectura de {Path(ruta_cambios).name})")
+    conteo_cuad, conteo_hex, ha_cuad, ha_hex = conteo_teselaciones(ruta_cambios, n_clases,
+                                                                   n_fino, malla)
+    # Píxeles y hectáreas se agregan juntos: columnas [píxeles | hectáreas]
+    conteo_cuad = np.concatenate([conteo_cuad, ha_cuad], axis=-1)
+    conteo_hex = np.concatenate([conteo_hex, ha_hex], axis=-1)
+    
+    capas = {}
+    
+    # Cuadrículas 2×2 ... n×n (pirámide)
+    piramide = piramide_cuadricula(conteo_cuad)
+    for nivel in range(1, TESELACION_NIVEL_MAX + 1):
+        n = 2 ** nivel
+        capas[f'cuadricula_{n}x{n}'] = (cuadricula(limites, n, n),
+                                        piramide[nivel].reshape(n * n, 2 * n_clases))
+    
+    # Quadtree adaptativo: subdivide mientras haya más hectáreas de cambio que la capacidad
+    peso_cambio = np.zeros(2 * n_clases)
+    peso_cambio[[n_clases + 1, n_clases + 2, n_clases + 3]] = 1
+    nivel, i, j = hojas_quadtree(piramide, peso_cambio, QUADTREE_CAPACIDAD_HA)
+    n_nivel = 2 ** nivel
+    capas['quadtree'] = (
+        {'zona_id': [f'Q{k}_{a:02d}_{b:02d}' for k, a, b in zip(nivel, i, j)],
+         'nivel': nivel,
+         'geometry': cajas(limites, n_nivel, n_nivel, i, j)},
+        np.stack([piramide[k][a, b] for k, a, b in zip(nivel, i, j)])
+    )
+    
+    # Hexágonos: el fino y sus agregaciones
+    for k, datos in enumerate(niveles_hexagonales(malla, conteo_hex, HEXAGONOS_NIVELES)):
+        capas[f'hexagonos_{k}'] = ({'zona_id': datos['zona_id'], 'geometry': datos['geometry']},
+                                   datos['conteo'])
+    
+    # Una capa por nivel; el archivo se reescribe completo
+    if Path(salida_vector).exists():
+        Path(salida_vector).unlink()
+    for nombre, (atributos, conteo) in capas.items():
+        gdf = gpd.GeoDataFrame(atributos, crs=crs)
+        gdf['area_ha'] = _area_ha(gdf)
+        gdf = _agregar_columnas_cambio(gdf, conteo[:, :n_clases].round().astype(np.int64),
+                                       conteo[:, n_clases:])
+        gdf.to_file(salida_vector, layer=nombre, driver='GPKG')
+        print(f"   ✓ {nombre:<18} {len(gdf):>6} zonas  "
+              f"(urbanización {gdf['urbanizacion_ha'].sum():.2f} ha)")
+    
+    print(f"\n✓ Teselaciones guardadas en: {Path(salida_vector).name}")
+    
+    return list(capas)
+
+
 def identificar_hotspots(gdf_zonas, columna_metrica, top_n=10):
     """
     Identifica zonas con mayor intensidad de cambio (hotspots).
@@ -298,6 +643,72 @@ def identificar_hotspots(gdf_zonas, columna_metrica, top_n=10):
     return df_ranking
 
 
+def hotspots_estadisticos(gdf_zonas, columna_metrica, vecindad=VECINDAD_HOTSPOTS,
+                          permutaciones=PERMUTACIONES_MORAN, alfa=ALFA_HOTSPOTS):
+    """
+    Hotspots con significancia estadística: Getis-Ord Gi* y Moran local
+    sobre la capa de zonas (ver spatial_stats).
+    
+    Parámetros:
+    -----------
+    gdf_zonas : GeoDataFrame
+        Zonas con estadísticas de cambio
+    columna_metrica : str
+        Variable a analizar (ej: 'urbanizacion_ha')
+    vecindad : str
+        'queen', 'rook' (contigüidad) o 'knn' (K_VECINOS más cercanos)
+    permutaciones : int
+        Permutaciones del Moran local
+    alfa : float
+        Nivel de significancia de los clusters de Moran
+        
+    Retorna:
+    --------
+    gdf_zonas : GeoDataFrame
+        Zonas con columnas gi_z, gi_p, gi_bin (±3/±2/±1 = hot/coldspot al
+        99/95/90 %), moran_i, moran_p y moran_cluster
+    """
+    
+    print("\n" + "="*70)
+    print("PASO 3b: HOTSPOTS ESTADÍSTICOS (Gi* y MORAN LOCAL)")
+    print("="*70)
+    
+    if vecindad == 'knn':
+        # Centroides en metros aunque la capa esté en coordenadas geográficas
+        metrica = gdf_zonas.to_crs(gdf_zonas.estimate_utm_crs()) if gdf_zonas.crs.is_geographic else gdf_zonas
+        centros = shapely.get_coordinates(metrica.geometry.centroid.values)
+        pesos = pesos_knn(centros, K_VECINOS)
+    else:
+        pesos = pesos_contiguidad(gdf_zonas, vecindad)
+    
+    cardinalidad = np.diff(pesos.indptr)
+    print(f"\n🕸️  Vecindad {vecindad}: {cardinalidad.mean():.1f} vecinos por zona en promedio "
+          f"({(cardinalidad == 0).sum()} zonas aisladas)")
+    
+    valores = gdf_zonas[columna_metrica].to_numpy(dtype=np.float64)
+    gi_z, gi_p = gi_estrella(valores, pesos)
+    moran = moran_local(valores, pesos, permutaciones=permutaciones, alfa=alfa)
+    
+    gdf_zonas = gdf_zonas.copy()
+    gdf_zonas['gi_z'] = gi_z
+    gdf_zonas['gi_p'] = gi_p
+    gdf_zonas['gi_bin'] = clases_gi(gi_z, gi_p)
+    gdf_zonas['moran_i'] = moran['I']
+    gdf_zonas['moran_p'] = moran['p']
+    gdf_zonas['moran_cluster'] = [CUADRANTES_MORAN[c] for c in moran['cluster']]
+    
+    print(f"\n🔥 Getis-Ord Gi* ({columna_metrica.replace('_', ' ')}):")
+    for nivel, confianza in ((3, 99), (2, 95), (1, 90)):
+        print(f"   Hotspots {confianza}%:  {(gdf_zonas['gi_bin'] == nivel).sum():>6}   "
+              f"Coldspots {confianza}%: {(gdf_zonas['gi_bin'] == -nivel).sum():>6}")
+    
+    print(f"\n🧭 Moran local ({permutaciones} permutaciones, α = {alfa}):")
+    for nombre, n in gdf_zonas['moran_cluster'].value_counts().items():
+        print(f"   {nombre:<17} {n:>6}")
+    
+    return gdf_zonas
+
+
 def analisis_temporal(patron_archivos, fechas=None):
     """
     Analiza la evolución temporal de índices espectrales.
@@ -329,48 +740,125 @@ def analisis_temporal(patron_archivos, fechas=None):
     print(f"\n📅 Procesando {len(archivos)} años...")
     
     resultados = []
+    umbrales = {indice: {columna: (operador, valor)}
+                for indice, (columna, operador, valor) in UMBRALES_COBERTURA.items()}
     
     for archivo in archivos:
         # Extraer año del nombre (ej: indices_2018.tif)
         nombre = Path(archivo).stem
         year = nombre.split('_')[-1]
         
+        # Estadísticas en una pasada por ventanas (ver streaming_stats)
+        acumuladores = {indice: AcumuladorEstadisticas(umbrales=umbrales.get(indice))
+                        for indice in ('ndvi', 'ndbi', 'ndwi', 'bsi')}
+        
         with rasterio.open(archivo) as src:
-            # Leer índices
-            ndvi = src.read(1).astype(np.float32)
-            ndbi = src.read(2).astype(np.float32)
-            ndwi = src.read(3).astype(np.float32)
-            bsi = src.read(4).astype(np.float32)
-            
-            # Aplicar máscara de nodata
-            mask_valido = ndvi != -9999
+            bandas = {indice: indice_banda(src, indice) for indice in acumuladores}
             
-            # Calcular estadísticas
-            stats = {
-                'fecha': int(year),
-                'ndvi_mean': float(np.nanmean(ndvi[mask_valido])),
-                'ndvi_std': float(np.nanstd(ndvi[mask_valido])),
-                'ndbi_mean': float(np.nanmean(ndbi[mask_valido])),
-                'ndbi_std': float(np.nanstd(ndbi[mask_valido])),
-                'ndwi_mean': float(np.nanmean(ndwi[mask_valido])),
-                'bsi_mean': float(np.nanmean(bsi[mask_valido])),
-                # Porcentajes
-                'pct_vegetacion': float(100 * np.sum((ndvi > 0.3) & mask_valido) / np.sum(mask_valido)),
-                'pct_urbano': float(100 * np.sum((ndbi > 0) & mask_valido) / np.sum(mask_valido)),
-                'pct_agua': float(100 * np.sum((ndwi > 0.1) & mask_valido) / np.sum(mask_valido)),
-            }
-            
-            resultados.append(stats)
-            
-            print(f"   {year}: NDVI={stats['ndvi_mean']:.3f}, "
-                  f"NDBI={stats['ndbi_mean']:.3f}, "
-                  f"Urbano={stats['pct_urbano']:.1f}%")
+            for ventana in iterar_ventanas(src):
+                # Leer índices de la ventana
+                ndvi = src.read(bandas['ndvi'], window=ventana).astype(np.float32)
+                
+                # Aplicar máscara de nodata
+                mask_valido = ndvi != -9999
+                
+                acumuladores['ndvi'].agregar(ndvi, mask_valido)
+                for indice in ('ndbi', 'ndwi', 'bsi'):
+                    valores = src.read(bandas[indice], window=ventana).astype(np.float32)
+                    acumuladores[indice].agregar(valores, mask_valido)
+        
+        ndvi, ndbi, ndwi, bsi = (acumuladores[i] for i in ('ndvi', 'ndbi', 'ndwi', 'bsi'))
+        
+        # Calcular estadísticas
+        stats = {
+            'fecha': int(year),
+            'ndvi_mean': ndvi.media,
+            'ndvi_std': ndvi.std,
+            'ndbi_mean': ndbi.media,
+            'ndbi_std': ndbi.std,
+            'ndwi_mean': ndwi.media,
+            'bsi_mean': bsi.media,
+            # Porcentajes
+            'pct_vegetacion': 100 * ndvi.fraccion('pct_vegetacion'),
+            'pct_urbano': 100 * ndbi.fraccion('pct_urbano'),
+            'pct_agua': 100 * ndwi.fraccion('pct_agua'),
+        }
+        
+        resultados.append(stats)
+        
+        print(f"   {year}: NDVI={stats['ndvi_mean']:.3f}, "
+              f"NDBI={stats['ndbi_mean']:.3f}, "
+              f"Urbano={stats['pct_urbano']:.1f}%")
     
     df_temporal = pd.DataFrame(resultados)
     
     return df_temporal
 
 
+def cubo_zonas_indices(archivos, indice_zonas, zona_ids, ruta_salida):
+    """
+    Construye el cubo zona × año × índice × estadístico (media, desviación
+    estándar y % de píxeles sobre el umbral de cobertura).
+    
+    Cada año se resume en una sola pasada por ventanas con el índice raster
+    de zonas (resumen_bandas). El cubo se guarda como .npy
+    float32 con la zona como primer eje, de modo que la serie de una zona
+    es un bloque contiguo que se lee con np.load(mmap_mode='r') sin cargar
+    el resto; un .json al lado describe los ejes.
+    
+    Parámetros:
+    -----------
+    archivos : list of Path
+        Rasters de índices por año (indices_YYYY.tif)
+    indice_zonas : IndiceZonas o CoberturaZonas
+        Índice de las zonas, alineado a los rasters de índices
+    zona_ids : list of str
+        Identificador de cada zona, en el orden del índice
+    ruta_salida : Path
+        Ruta del cubo (.npy); los ejes se escriben en la misma ruta con .json
+        
+    Retorna:
+    --------
+    cubo : ndarray float32 (n_zonas, n_años, n_índices, n_estadísticos)
+    """
+    
+    print("\n" + "="*70)
+    print("PASO 4b: CUBO ZONA × AÑO × ÍNDICE")
+    print("="*70)
+    
+    years = [int(Path(a).stem.split('_')[-1]) for a in archivos]
+    cubo = np.full((len(zona_ids), len(years), len(INDICES_CUBO), len(ESTADISTICOS_CUBO)),
+                   np.nan, dtype=np.float32)
+    umbrales = {indice: UMBRALES_COBERTURA[indice][1:]
+                for indice in INDICES_CUBO if indice in UMBRALES_COBERTURA}
+    
+    print(f"\n🧊 {len(zona_ids)} zonas × {len(years)} años × {len(INDICES_CUBO)} índices")
+    for t, (archivo, year) in enumerate(zip(archivos, years)):
+        resumen = indice_zonas.resumen_bandas(archivo, INDICES_CUBO, umbrales)
+        for k, indice in enumerate(INDICES_CUBO):
+            cubo[:, t, k, 0] = resumen[indice]['media']
+            cubo[:, t, k, 1] = resumen[indice]['std']
+            if 'fraccion' in resumen[indice]:
+                cubo[:, t, k, 2] = 100 * resumen[indice]['fraccion']
+        print(f"   ✓ {year}")
+    
+    np.save(ruta_salida, cubo)
+    ejes = {
+        'dimensiones': ['zona', 'year', 'indice', 'estadistico'],
+        'zona': [str(z) for z in zona_ids],
+        'year': years,
+        'indice': list(INDICES_CUBO),
+        'estadistico': list(ESTADISTICOS_CUBO),
+        'umbrales': {indice: list(UMBRALES_COBERTURA[indice]) for indice in umbrales},
+    }
+    Path(ruta_salida).with_suffix('.json').write_text(
+        json.dumps(ejes, ensure_ascii=False, indent=2), encoding='utf-8')
+    
+    print(f"\n✓ Cubo guardado en: {Path(ruta_salida).name} ({cubo.nbytes / 1024:.0f} KB)")
+    
+    return cubo
+
+
 def generar_mapas_coropleticos(gdf_zonas, columnas_mapear, output_dir):
     """
     Genera mapas coropléticos de intensidad de cambio.
@@ -521,9 +1009,42 @@ def main():
     Función principal: ejecuta análisis zonal completo.
     """
     
+    parser = argparse.ArgumentParser(description='Análisis zonal de cambios (Fase 4)')
+    parser.add_argument('--forzar', action='store_true',
+                        help='Recalcular aunque el manifiesto indique que los productos están al día')
+    parser.add_argument('--umm-ha', type=float, default=UNIDAD_MINIMA_HA,
+                        help='Unidad mínima de mapeo en hectáreas para los parches de cambio '
+                             f'(por defecto {UNIDAD_MINIMA_HA}; 0 desactiva el filtrado)')
+    parser.add_argument('--celdas', type=int, nargs=2, metavar=('NX', 'NY'),
+                        default=(N_CELLS_X, N_CELLS_Y),
+                        help=f'Celdas de la grilla en X e Y (por defecto {N_CELLS_X} {N_CELLS_Y})')
+    parser.add_argument('--teselaciones', action='store_true',
+                        help='Generar cuadrículas jerárquicas, quadtree adaptativo y hexágonos '
+                             '(teselaciones.gpkg, una capa por nivel para el dashboard)')
+    parser.add_argument('--vecindad', choices=['queen', 'rook', 'knn'], default=VECINDAD_HOTSPOTS,
+                        help='Vecinos para Gi* y Moran local: contigüidad queen / rook o '
+                             f'{K_VECINOS} vecinos más cercanos (por defecto {VECINDAD_HOTSPOTS})')
+    parser.add_argument('--zonas', type=Path, metavar='RUTA',
+                        help='Capa de polígonos propia (manzanas, barrios) en lugar de la grilla; '
+                             'cobertura fraccional exacta de cada píxel')
+    parser.add_argument('--campo-zona', default='zona_id',
+                        help="Columna identificadora de --zonas (por defecto 'zona_id')")
+    args = parser.parse_args()
+    n_cells_x, n_cells_y = args.celdas
+    
     # Rutas de archivos
     ruta_cambios = INPUT_DIR_PROC / 'cambio_clasificado.tif'
+    ruta_filtrado = INPUT_DIR_PROC / 'cambio_clasificado_filtrado.tif'
+    ruta_parches = INPUT_DIR_PROC / 'parches_cambio.csv'
     ruta_grilla = OUTPUT_DIR_VEC / 'grilla_zonas.gpkg'
+    ruta_indice_zonas = INPUT_DIR_PROC / 'indice_zonas.tif'
+    ruta_zonas_datos = OUTPUT_DIR_VEC / 'zonas_con_datos.gpkg'
+    ruta_parciales = INPUT_DIR_PROC / 'parciales_zonales.npz'
+    ruta_teselaciones = OUTPUT_DIR_VEC / 'teselaciones.gpkg'
+    ruta_stats_csv = INPUT_DIR_PROC / 'estadisticas_zonales.csv'
+    ruta_ranking = INPUT_DIR_PROC / 'ranking_zonas.csv'
+    ruta_temporal_csv = INPUT_DIR_PROC / 'evolucion_temporal.csv'
+    ruta_cubo = INPUT_DIR_PROC / 'cubo_zonas_indices.npy'
     
     # Verificar archivo de cambios
     if not ruta_cambios.exists():
@@ -531,70 +1052,204 @@ def main():
         print("   Ejecuta primero: python scripts/detect_changes.py")
         return
     
-    # PASO 1: Crear o cargar grilla
-    if not ruta_grilla.exists():
-        gdf_zonas = crear_grilla_analisis(
-            ruta_cambios, 
-            ruta_grilla, 
-            n_cells_x=10, 
-            n_cells_y=10
+    # Manifiesto: cada bloque se omite si sus entradas, parámetros y código no cambiaron
+    manifiesto = Manifiesto(INPUT_DIR_PROC / NOMBRE_MANIFIESTO, forzar=args.forzar)
+    codigo = version_codigo(*ARCHIVOS_CODIGO)
+    
+    with rasterio.open(ruta_cambios) as src:
+        grilla_raster = {'transform': list(src.transform)[:6], 'alto': src.height,
+                         'ancho': src.width, 'crs': str(src.crs)}
+    
+    if args.zonas:
+        # PASO 1: Capa de zonas propia (sin grilla ni índice raster)
+        if not args.zonas.exists():
+            print(f"❌ Error: No se encontró {args.zonas}")
+            return
+        gdf_zonas = cargar_zonas(args.zonas, ruta_cambios, args.campo_zona)
+        entradas_zonas = [args.zonas]
+        parametros_zonas = {'zonas': args.zonas.name, 'campo_zona': args.campo_zona}
+    else:
+        # PASO 1: Crear o cargar grilla (se regenera si cambia su resolución o el raster)
+        huella_grilla = manifiesto.huella([], dict(grilla_raster, n_cells_x=n_cells_x,
+                                                   n_cells_y=n_cells_y), codigo)
+        if not manifiesto.actualizado('grilla_zonas', huella_grilla, [ruta_grilla]):
+            gdf_zonas = crear_grilla_analisis(
+                ruta_cambios, 
+                ruta_grilla, 
+                n_cells_x=n_cells_x, 
+                n_cells_y=n_cells_y
+            )
+            manifiesto.registrar('grilla_zonas', huella_grilla, [ruta_grilla])
+            manifiesto.guardar()
+        else:
+            print("="*70)
+            print("PASO 1: CARGANDO GRILLA EXISTENTE")
+            print("="*70)
+            gdf_zonas = gpd.read_file(ruta_grilla)
+            print(f"\n✓ Grilla cargada: {len(gdf_zonas)} zonas desde {ruta_grilla.name}")
+    
+    # PASO 1b: Parches de cambio y unidad mínima de mapeo
+    ruta_cambios_zonal = ruta_cambios
+    if args.umm_ha > 0:
+        ruta_cambios_zonal = ruta_filtrado
+        salidas_parches = [ruta_filtrado, ruta_parches]
+        with rasterio.open(ruta_cambios) as src:
+            rutas_indices = _rutas_indices_periodo(src) or []
+        huella_parches = manifiesto.huella(
+            [ruta_cambios] + rutas_indices,
+            {'unidad_minima_ha': args.umm_ha, 'conectividad': CONECTIVIDAD_PARCHES},
+            codigo
         )
+        if manifiesto.actualizado('parches_cambio', huella_parches, salidas_parches):
+            print("\n✓ Parches de cambio al día (paso 1b omitido)")
+        else:
+            df_parches = filtrar_parches_cambio(ruta_cambios, ruta_filtrado, args.umm_ha)
+            df_parches.to_csv(ruta_parches, index=False)
+            print(f"✓ Tabla de parches: {ruta_parches.name} ({len(df_parches):,} parches)")
+            
+            manifiesto.registrar('parches_cambio', huella_parches, salidas_parches)
+            manifiesto.guardar()
+    
+    if args.zonas:
+        # Polígonos propios: STRtree ventana → polígonos y cobertura fraccional,
+        # calculada en la primera pasada y reutilizada por el cubo
+        indice_zonas = CoberturaZonas(gdf_zonas, ruta_cambios)
     else:
-        print("="*70)
-        print("PASO 1: CARGANDO GRILLA EXISTENTE")
-        print("="*70)
-        gdf_zonas = gpd.read_file(ruta_grilla)
-        print(f"\n✓ Grilla cargada: {len(gdf_zonas)} zonas desde {ruta_grilla.name}")
+        # Índice raster de zonas: se calcula una vez por grilla y se reutiliza
+        huella_indice = manifiesto.huella([ruta_grilla], grilla_raster, codigo)
+        if manifiesto.actualizado('indice_zonas', huella_indice, [ruta_indice_zonas]):
+            indice_zonas = IndiceZonas(ruta_indice_zonas)
+        else:
+            print(f"\n🗺️  Índice de {len(gdf_zonas)} zonas en {ruta_indice_zonas.name}...")
+            indice_zonas = IndiceZonas.desde_grilla(ruta_cambios, n_cells_x, n_cells_y,
+                                                    ruta_indice_zonas)
+            manifiesto.registrar('indice_zonas', huella_indice, [ruta_indice_zonas])
+            manifiesto.guardar()
+        entradas_zonas = [ruta_grilla, ruta_indice_zonas]
+        parametros_zonas = {'n_cells_x': n_cells_x, 'n_cells_y': n_cells_y}
+    
+    salidas_zonal = [ruta_zonas_datos, ruta_stats_csv, ruta_ranking,
+                     OUTPUT_DIR_FIG / 'mapas_coropleticos.png']
+    huella_zonal = manifiesto.huella(
+        [ruta_cambios_zonal] + entradas_zonas,
+        dict(parametros_zonas, unidad_minima_ha=args.umm_ha, vecindad=args.vecindad,
+             k_vecinos=K_VECINOS, permutaciones=PERMUTACIONES_MORAN, alfa=ALFA_HOTSPOTS),
+        codigo
+    )
     
-    # PASO 2: Análisis zonal de cambios
-    gdf_zonas = analisis_zonal_cambios(ruta_cambios, gdf_zonas)
+    # Parciales por tesela: válidos mientras no cambien las zonas ni el código
+    huella_parciales = manifiesto.huella(entradas_zonas,
+                                         dict(parametros_zonas, n_clases=max(CLASES_CAMBIO) + 1),
+                                         codigo)
     
-    # PASO 3: Identificar hotspots
-    df_ranking_urb = identificar_hotspots(gdf_zonas, 'urbanizacion_ha', top_n=10)
-    df_ranking_trans = identificar_hotspots(gdf_zonas, 'indice_transformacion', top_n=10)
+    if manifiesto.actualizado('zonas_con_datos', huella_zonal, salidas_zonal):
+        print("\n✓ Análisis zonal al día (pasos 2, 3 y 5 omitidos)")
+        gdf_zonas = gpd.read_file(ruta_zonas_datos)
+    else:
+        # PASO 2: Análisis zonal de cambios. Con las mismas zonas se reutilizan
+        # los parciales por tesela de la corrida anterior y solo se recalculan
+        # las teselas cuyo raster de clases cambió
+        incremental = manifiesto.actualizado('parciales_zonales', huella_parciales,
+                                             [ruta_parciales])
+        if incremental:
+            parciales = ParcialesZonas.cargar(ruta_parciales)
+        else:
+            parciales = ParcialesZonas(len(gdf_zonas), max(CLASES_CAMBIO) + 1)
+        gdf_zonas = analisis_zonal_cambios(ruta_cambios_zonal, gdf_zonas, indice_zonas,
+                                           parciales=parciales)
+        
+        # PASO 3: Identificar hotspots
+        df_ranking_urb = identificar_hotspots(gdf_zonas, 'urbanizacion_ha', top_n=10)
+        df_ranking_trans = identificar_hotspots(gdf_zonas, 'indice_transformacion', top_n=10)
+        gdf_zonas = hotspots_estadisticos(gdf_zonas, 'urbanizacion_ha', vecindad=args.vecindad)
+        
+        # PASO 5: Mapas coropléticos
+        columnas_mapear = [
+            'urbanizacion_ha',
+            'perdida_vegetacion_ha',
+            'ganancia_vegetacion_ha',
+            'cambio_total_pct'
+        ]
+        generar_mapas_coropleticos(gdf_zonas, columnas_mapear, OUTPUT_DIR_FIG)
+        
+        # EXPORTAR DATOS
+        print("\n" + "="*70)
+        print("EXPORTACIÓN DE RESULTADOS")
+        print("="*70)
+        
+        # 1. Zonas con datos (GeoPackage). Se reescribe completo: las columnas
+        # Gi*/Moran son globales y cambian en casi todas las zonas aunque
+        # solo hayan cambiado unas pocas teselas
+        gdf_zonas.to_file(ruta_zonas_datos, driver='GPKG')
+        print(f"\n✓ Zonas con datos: {ruta_zonas_datos.name}")
+        
+        # 2. Estadísticas zonales (CSV)
+        df_export = gdf_zonas.drop(columns='geometry')
+        df_export.to_csv(ruta_stats_csv, index=False)
+        print(f"✓ Estadísticas zonales: {ruta_stats_csv.name}")
+        
+        # 3. Ranking de zonas (CSV)
+        df_ranking_urb.to_csv(ruta_ranking, index=False)
+        print(f"✓ Ranking zonas: {ruta_ranking.name}")
+        
+        parciales.guardar(ruta_parciales)
+        manifiesto.registrar('parciales_zonales', huella_parciales, [ruta_parciales])
+        manifiesto.registrar('zonas_con_datos', huella_zonal, salidas_zonal)
+        manifiesto.guardar()
+    
+    # PASO 2b: Teselaciones jerárquicas (opcional)
+    if args.teselaciones:
+        huella_teselaciones = manifiesto.huella(
+            [ruta_cambios_zonal],
+            {'nivel_max': TESELACION_NIVEL_MAX, 'capacidad_ha': QUADTREE_CAPACIDAD_HA,
+             'hexagonos_ancho': HEXAGONOS_ANCHO, 'hexagonos_niveles': HEXAGONOS_NIVELES},
+            codigo
+        )
+        if manifiesto.actualizado('teselaciones', huella_teselaciones, [ruta_teselaciones]):
+            print("\n✓ Teselaciones al día (paso 2b omitido)")
+        else:
+            capas = generar_teselaciones(ruta_cambios_zonal, ruta_teselaciones)
+            manifiesto.registrar('teselaciones', huella_teselaciones, [ruta_teselaciones],
+                                 datos={'capas': capas})
+            manifiesto.guardar()
     
     # PASO 4: Análisis temporal
-    df_temporal = analisis_temporal('indices_*.tif')
-    
-    # PASO 5: Mapas coropléticos
-    columnas_mapear = [
-        'urbanizacion_ha',
-        'perdida_vegetacion_ha',
-        'ganancia_vegetacion_ha',
-        'cambio_total_pct'
-    ]
-    generar_mapas_coropleticos(gdf_zonas, columnas_mapear, OUTPUT_DIR_FIG)
-    
-    # PASO 6: Gráficos temporales
-    if df_temporal is not None:
-        generar_graficos_temporales(df_temporal, OUTPUT_DIR_FIG)
-    
-    # EXPORTAR DATOS
-    print("\n" + "="*70)
-    print("EXPORTACIÓN DE RESULTADOS")
-    print("="*70)
-    
-    # 1. Zonas con datos (GeoPackage)
-    ruta_zonas_datos = OUTPUT_DIR_VEC / 'zonas_con_datos.gpkg'
-    gdf_zonas.to_file(ruta_zonas_datos, driver='GPKG')
-    print(f"\n✓ Zonas con datos: {ruta_zonas_datos.name}")
+    archivos_indices = sorted(INPUT_DIR_PROC.glob('indices_*.tif'))
+    salidas_temporal = [ruta_temporal_csv, OUTPUT_DIR_FIG / 'evolucion_temporal.png']
+    huella_temporal = manifiesto.huella(archivos_indices, {}, codigo)
     
-    # 2. Estadísticas zonales (CSV)
-    ruta_stats_csv = INPUT_DIR_PROC / 'estadisticas_zonales.csv'
-    df_export = gdf_zonas.drop(columns='geometry')
-    df_export.to_csv(ruta_stats_csv, index=False)
-    print(f"✓ Estadísticas zonales: {ruta_stats_csv.name}")
-    
-    # 3. Ranking de zonas (CSV)
-    ruta_ranking = INPUT_DIR_PROC / 'ranking_zonas.csv'
-    df_ranking_urb.to_csv(ruta_ranking, index=False)
-    print(f"✓ Ranking zonas: {ruta_ranking.name}")
-    
-    # 4. Evolución temporal (CSV)
-    if df_temporal is not None:
-        ruta_temporal_csv = INPUT_DIR_PROC / 'evolucion_temporal.csv'
-        df_temporal.to_csv(ruta_temporal_csv, index=False)
-        print(f"✓ Evolución temporal: {ruta_temporal_csv.name}")
+    if archivos_indices and manifiesto.actualizado('evolucion_temporal', huella_temporal,
+                                                   salidas_temporal):
+        print("\n✓ Análisis temporal al día (pasos 4 y 6 omitidos)")
+    else:
+        df_temporal = analisis_temporal('indices_*.tif')
+        
+        # PASO 6: Gráficos temporales
+        if df_temporal is not None:
+            generar_graficos_temporales(df_temporal, OUTPUT_DIR_FIG)
+            
+            # 4. Evolución temporal (CSV)
+            df_temporal.to_csv(ruta_temporal_csv, index=False)
+            print(f"✓ Evolución temporal: {ruta_temporal_csv.name}")
+            
+            manifiesto.registrar('evolucion_temporal', huella_temporal, salidas_temporal)
+            manifiesto.guardar()
+    
+    # PASO 4b: Cubo zona × año × índice (índice de zonas ya calculado)
+    if archivos_indices:
+        salidas_cubo = [ruta_cubo, ruta_cubo.with_suffix('.json')]
+        huella_cubo = manifiesto.huella(
+            archivos_indices + entradas_zonas,
+            dict(parametros_zonas, indices=INDICES_CUBO, umbrales=UMBRALES_COBERTURA),
+            codigo
+        )
+        if manifiesto.actualizado('cubo_zonas_indices', huella_cubo, salidas_cubo):
+            print("\n✓ Cubo zona × año × índice al día (paso 4b omitido)")
+        else:
+            cubo_zonas_indices(archivos_indices, indice_zonas, list(gdf_zonas['zona_id']),
+                               ruta_cubo)
+            manifiesto.registrar('cubo_zonas_indices', huella_cubo, salidas_cubo)
+            manifiesto.guardar()
     
     # RESUMEN FINAL
     print("\n" + "="*70)
@@ -610,9 +1265,15 @@ def main():
     print(f"\n📁 Archivos generados:")
     archivos = [
         ruta_grilla,
+        ruta_indice_zonas,
+        ruta_parciales,
+        ruta_filtrado,
+        ruta_parches,
         ruta_zonas_datos,
+        ruta_teselaciones,
         ruta_stats_csv,
         ruta_ranking,
+        ruta_cubo,
         OUTPUT_DIR_FIG / 'mapas_coropleticos.png',
         OUTPUT_DIR_FIG / 'evolucion_temporal.png'
     ]
@@ -0,0 +1,640 @@
+"""
+Índice Raster de Zonas
+Proyecto: Detección de Cambios Urbanos - Peñaflor
+
+Resúmenes por zona de cualquier producto raster alineado (clases de cambio,
+índices, Z-score) en una sola pasada por ventanas:
+
+- conteo y superficie de clases por zona con un único np.bincount 2-D
+  sobre (zona, clase); la superficie suma el área real de cada píxel
+  (raster_io.area_filas_ha), que en coordenadas geográficas varía por fila
+- n, media y desviación estándar por zona con np.bincount ponderado,
+  combinando ventanas con la fórmula de Chan et al. (como streaming_stats)
+- lo mismo para varias bandas a la vez (resumen_bandas), más la fracción
+  de píxeles sobre un umbral, leyendo el índice una vez por ventana
+
+Dos formas de asignar píxeles a zonas, con la misma interfaz:
+
+- IndiceZonas: las zonas (grilla, teselaciones) se rasterizan una sola vez
+  en un raster de etiquetas enteras (1..n = posición de la zona en la capa,
+  0 = fuera de toda zona) guardado como COG. Cada píxel pertenece a una
+  sola zona (la que contiene su centro), por lo que las sumas por zona
+  cuadran con los totales de la escena.
+- CoberturaZonas: polígonos arbitrarios (manzanas censales, barrios), que
+  pueden ser irregulares o traslaparse. Un STRtree entrega, para cada
+  ventana, solo los polígonos que la intersectan, y cada píxel recibe la
+  fracción exacta de su área cubierta por el polígono, calculada
+  analíticamente desde las aristas (teorema de Green, sin intersecciones
+  píxel a píxel). El costo crece con las intersecciones polígono ×
+  ventana y el largo de los bordes, no con polígonos × escena. La
+  cobertura de cada ventana se guarda en disco (índice disperso en un
+  directorio temporal), no en RAM, y se reutiliza entre rasters.
+
+Todos los recorridos (resúmenes y ParcialesZonas) usan las mismas teselas
+(raster_io.iterar_teselas), de modo que una ventana cubierta una vez sirve
+para todas las pasadas.
+
+ParcialesZonas guarda los conteos de clases por tesela junto con una firma
+de los píxeles de cada tesela, para recalcular solo las teselas cuyo
+raster de clases cambió.
+"""
+
+import hashlib
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import shapely
+from affine import Affine
+from rasterio.features import rasterize
+from rasterio.windows import bounds as limites_ventana
+from rasterio.windows import transform as transform_ventana
+from shapely.geometry import box
+from shapely.geometry.polygon import orient
+
+from raster_io import (area_filas_ha, area_ventana, escribir_cog, indice_banda, iterar_teselas,
+                       iterar_ventanas)
+from tessellations import celdas_cuadricula
+
+_OPERADORES = {'>': np.greater, '>=': np.greater_equal, '<': np.less, '<=': np.less_equal}
+
+
+def _fracciones_poligono(poligono, transform, forma):
+    """
+    Fracción exacta de cada píxel de la grilla (transform, forma) cubierta
+    por un polígono, sin intersecciones geométricas.
+
+    En coordenadas de píxel (columna x, fila y) la celda (f, c) es el
+    cuadrado unitario [c, c+1] × [f, f+1] y, por el teorema de Green,
+
+        área(P ∩ celda) = ∮ clamp(x - c, 0, 1) dy   (borde de P en la fila f)
+
+    Cada arista se recorta a las filas que cruza; a las celdas a su
+    izquierda aporta dy completo (suma acumulada por fila) y a las pocas
+    que atraviesa, la integral cerrada de la rampa. El costo es del orden
+    de aristas × filas cruzadas + largo del borde en píxeles.
+    """
+    alto, ancho = forma
+    partes = [orient(p, 1.0) for p in shapely.get_parts(poligono) if not p.is_empty]
+    coords, anillo = shapely.get_coordinates(shapely.get_rings(partes), return_index=True)
+    x, y = ~transform * (coords[:, 0], coords[:, 1])
+    arista = anillo[1:] == anillo[:-1]
+    xa, ya, xb, yb = x[:-1][arista], y[:-1][arista], x[1:][arista], y[1:][arista]
+    no_horizontal = ya != yb
+    xa, ya, xb, yb = xa[no_horizontal], ya[no_horizontal], xb[no_horizontal], yb[no_horizontal]
+
+    # Aristas × filas que cruzan (tramo de la arista dentro de cada fila)
+    f0 = np.clip(np.floor(np.minimum(ya, yb)), 0, alto).astype(np.int64)
+    f1 = np.clip(np.ceil(np.maximum(ya, yb)), 0, alto).astype(np.int64)
+    n_filas = f1 - f0
+    k = np.repeat(np.arange(len(xa)), n_filas)
+    fila = f0[k] + np.arange(len(k)) - np.repeat(np.cumsum(n_filas) - n_filas, n_filas)
+    ta = np.clip(ya[k], fila, fila + 1)
+    tb = np.clip(yb[k], fila, fila + 1)
+    dy = tb - ta
+    pendiente = (xb - xa)[k] / (yb - ya)[k]
+    x_a = xa[k] + (ta - ya[k]) * pendiente
+    x_b = xa[k] + (tb - ya[k]) * pendiente
+    x_min = np.minimum(x_a, x_b)
+
+    # Celdas a la izquierda del tramo: dy completo
+    c0 = np.clip(np.floor(x_min), 0, ancho).astype(np.int64)
+    aporte = np.bincount(fila * (ancho + 1) + c0, weights=dy,
+                         minlength=alto * (ancho + 1)).reshape(alto, ancho + 1)
+    cobertura = np.cumsum(aporte[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+    # Celdas que atraviesa el tramo: integral de la rampa clamp(x - c, 0, 1)
+    c1 = np.clip(np.ceil(np.maximum(x_a, x_b)), 0, ancho).astype(np.int64)
+    n_celdas = np.maximum(c1 - c0, 0)
+    t = np.repeat(np.arange(len(c0)), n_celdas)
+    c = c0[t] + np.arange(len(t)) - np.repeat(np.cumsum(n_celdas) - n_celdas, n_celdas)
+    ua, ub = x_a[t] - c, x_b[t] - c
+    du = ub - ua
+    inclinada = np.abs(du) > 1e-9
+    primitiva = lambda u: np.where(u <= 0, 0.0, np.where(u >= 1, u - 0.5, u * u / 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rampa = np.where(inclinada, (primitiva(ub) - primitiva(ua)) / du,
+                         np.clip((ua + ub) / 2, 0, 1))
+    cobertura += np.bincount(fila[t] * ancho + c, weights=dy[t] * rampa,
+                             minlength=alto * ancho).reshape(alto, ancho)
+
+    # Los anillos exteriores son antihorarios en coordenadas del mapa; el
+    # paso a coordenadas de píxel invierte el sentido si el determinante es < 0
+    return np.clip(cobertura * np.sign(transform.determinant), 0, 1)
+
+
+class _MomentosZona:
+    """n, media y M2 por zona (ponderados), combinando ventanas con la fórmula de Chan et al."""
+
+    def __init__(self, tamano):
+        self.tamano = tamano
+        self.n = np.zeros(tamano)
+        self.media = np.zeros(tamano)
+        self.m2 = np.zeros(tamano)
+
+    def agregar(self, z, v, pesos=None):
+        """Incorpora los valores `v` de las zonas `z` (arrays 1D ya filtrados) con pesos opcionales."""
+        # Momentos de la ventana por zona
+        n_b = np.bincount(z, weights=pesos, minlength=self.tamano).astype(np.float64)
+        con_datos = n_b > 0
+        pv = v if pesos is None else v * pesos
+        media_b = np.zeros(self.tamano)
+        media_b[con_datos] = np.bincount(z, weights=pv, minlength=self.tamano)[con_datos] / n_b[con_datos]
+        desvio = (v - media_b[z]) ** 2
+        m2_b = np.bincount(z, weights=desvio if pesos is None else desvio * pesos,
+                           minlength=self.tamano)
+
+        # Combinación con lo acumulado (Chan et al.)
+        total = self.n + n_b
+        delta = media_b - self.media
+        with np.errstate(invalid='ignore', divide='ignore'):
+            peso = np.where(con_datos, n_b / total, 0)
+        self.media += delta * peso
+        self.m2 += m2_b + delta ** 2 * self.n * peso
+        self.n = total
+
+    def resultado(self, enteros=True):
+        """dict con 'pixeles', 'media' y 'std' sin la zona 0 (NaN en zonas sin datos)."""
+        n, media, m2 = self.n[1:], self.media[1:].copy(), self.m2[1:]
+        media[n == 0] = np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(m2 / n)
+        return {'pixeles': n.astype(np.int64) if enteros else n, 'media': media, 'std': std}
+
+
+class _ResumenZonas:
+    """
+    Resúmenes por zona comunes a IndiceZonas y CoberturaZonas. Las
+    subclases definen n_zonas, transform, forma, area_filas y
+    _entradas(ventana) -> (zonas 1..n, posiciones en la ventana, pesos).
+    """
+
+    # Pesos fraccionales (CoberturaZonas): los conteos de píxeles son float
+    fraccional = False
+
+    def _verificar_alineacion(self, src):
+        """ValueError si `src` no comparte grilla con las zonas."""
+        if (src.height, src.width) != self.forma or not src.transform.almost_equals(self.transform):
+            raise ValueError(f"{Path(src.name).name} no está alineado con el índice de zonas")
+
+    def _ventanas(self, src):
+        """
+        Teselas en que se recorre un raster alineado. Es el mismo recorrido
+        para los resúmenes y para ParcialesZonas, así la cobertura de cada
+        ventana (CoberturaZonas) se calcula una sola vez.
+        """
+        return iterar_teselas(src)
+
+    def _pixeles(self, ventana):
+        """(zonas, posiciones, pesos, área en ha) de los píxeles de la ventana que caen en alguna zona."""
+        zonas, posiciones, pesos = self._entradas(ventana)
+        area = np.broadcast_to(area_ventana(self.area_filas, ventana),
+                               (int(ventana.height), int(ventana.width))).ravel()[posiciones]
+        return zonas, posiciones, pesos, area
+
+    def _recorrer(self, ruta_raster, bandas):
+        """
+        Recorre un raster alineado por teselas; entrega (zonas, pesos,
+        área por píxel en ha, {banda: valores}, nodata) de los píxeles que
+        caen en alguna zona (pesos None = cobertura total).
+        """
+        with rasterio.open(ruta_raster) as src:
+            self._verificar_alineacion(src)
+            numeros = {banda: indice_banda(src, banda) if isinstance(banda, str) else banda
+                       for banda in bandas}
+            for ventana in self._ventanas(src):
+                zonas, posiciones, pesos, area = self._pixeles(ventana)
+                valores = {banda: src.read(n, window=ventana).ravel()[posiciones]
+                           for banda, n in numeros.items()}
+                yield zonas, pesos, area, valores, src.nodata
+
+    def conteo_clases(self, ruta_raster, n_clases, banda=1):
+        """
+        Píxeles de cada clase por zona.
+
+        Args:
+            ruta_raster: raster categórico alineado (ej: cambio_clasificado.tif)
+            n_clases: las clases válidas son 0..n_clases-1 (el resto, p. ej.
+                nodata 255, se ignora)
+            banda: número o nombre de banda
+
+        Returns:
+            Array (n_zonas, n_clases): int64, o float64 con cobertura fraccional
+        """
+        return self.superficie_clases(ruta_raster, n_clases, banda)[0]
+
+    def superficie_clases(self, ruta_raster, n_clases, banda=1):
+        """
+        Píxeles y hectáreas de cada clase por zona, en una sola pasada.
+
+        Args:
+            ruta_raster: raster categórico alineado
+            n_clases: las clases válidas son 0..n_clases-1
+            banda: número o nombre de banda
+
+        Returns:
+            Tupla (píxeles, hectáreas float64), ambos (n_zonas, n_clases)
+        """
+        conteo = np.zeros((self.n_zonas + 1) * n_clases)
+        hectareas = np.zeros(conteo.size)
+        for zonas, pesos, area, valores, _ in self._recorrer(ruta_raster, [banda]):
+            clases = valores[banda]
+            valido = clases < n_clases
+            celda = zonas[valido].astype(np.int64) * n_clases + clases[valido]
+            peso = None if pesos is None else pesos[valido]
+            conteo += np.bincount(celda, weights=peso, minlength=conteo.size)
+            hectareas += np.bincount(celda, weights=area[valido] if peso is None else area[valido] * peso,
+                                     minlength=conteo.size)
+        forma = (self.n_zonas + 1, n_clases)
+        conteo = conteo.reshape(forma)[1:]
+        return (conteo if self.fraccional else conteo.astype(np.int64)), hectareas.reshape(forma)[1:]
+
+    def estadisticas(self, ruta_raster, banda=1, nodata=None):
+        """
+        Número de píxeles válidos, media y desviación estándar por zona.
+
+        Args:
+            ruta_raster: raster continuo alineado (índices, Z-score, ...)
+            banda: número o nombre de banda
+            nodata: valor a ignorar (por defecto el del raster); NaN
+                siempre se ignora
+
+        Returns:
+            dict con 'pixeles', 'media' y 'std' (arrays de n_zonas; NaN en
+            zonas sin datos)
+        """
+        return self.resumen_bandas(ruta_raster, [banda], nodata=nodata)[banda]
+
+    def resumen_bandas(self, ruta_raster, bandas, umbrales=None, nodata=None):
+        """
+        Estadísticas por zona de varias bandas de un raster en una sola
+        pasada (las zonas de cada ventana se obtienen una vez).
+
+        Args:
+            ruta_raster: raster continuo alineado (ej: indices_2018.tif)
+            bandas: nombres o números de banda
+            umbrales: {banda: (operador, valor)} opcional, ej:
+                {'ndvi': ('>', 0.3)}; agrega la fracción (0-1) de píxeles
+                válidos de la zona que cumplen la condición
+            nodata: valor a ignorar (por defecto el del raster); NaN
+                siempre se ignora
+
+        Returns:
+            {banda: dict con 'pixeles', 'media', 'std' y, si tiene umbral,
+            'fraccion'} (arrays de n_zonas; con cobertura fraccional los
+            píxeles y momentos se ponderan por la fracción cubierta)
+        """
+        umbrales = umbrales or {}
+        tamano = self.n_zonas + 1
+        momentos = {banda: _MomentosZona(tamano) for banda in bandas}
+        sobre_umbral = {banda: np.zeros(tamano) for banda in umbrales if banda in momentos}
+
+        for zonas, pesos, _, valores, nodata_src in self._recorrer(ruta_raster, bandas):
+            excluir = nodata if nodata is not None else nodata_src
+            for banda in bandas:
+                v = valores[banda].astype(np.float64)
+                valido = ~np.isnan(v)
+                if excluir is not None:
+                    valido &= v != excluir
+                z, v = zonas[valido], v[valido]
+                peso = None if pesos is None else pesos[valido]
+                momentos[banda].agregar(z, v, peso)
+                if banda in sobre_umbral:
+                    operador, valor = umbrales[banda]
+                    cumple = _OPERADORES[operador](v, valor)
+                    sobre_umbral[banda] += np.bincount(z[cumple], minlength=tamano,
+                                                       weights=None if peso is None else peso[cumple])
+
+        resumen = {}
+        for banda, acumulado in momentos.items():
+            resumen[banda] = acumulado.resultado(enteros=not self.fraccional)
+            if banda in sobre_umbral:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    resumen[banda]['fraccion'] = sobre_umbral[banda][1:] / resumen[banda]['pixeles']
+        return resumen
+
+
+class IndiceZonas(_ResumenZonas):
+    """
+    Raster de etiquetas de zona y resúmenes por zona de rasters alineados.
+
+    Parámetros:
+    -----------
+    ruta : Path
+        Raster de etiquetas (ver IndiceZonas.construir)
+    """
+
+    def __init__(self, ruta):
+        self.ruta = Path(ruta)
+        with rasterio.open(self.ruta) as src:
+            self.n_zonas = int(src.tags()['n_zonas'])
+            self.transform = src.transform
+            self.forma = (src.height, src.width)
+            self.area_filas = area_filas_ha(src.crs, src.transform, src.height)
+
+    @classmethod
+    def construir(cls, gdf_zonas, ruta_referencia, ruta_salida):
+        """
+        Rasteriza las zonas sobre la grilla de `ruta_referencia`, por ventanas.
+
+        Parámetros:
+        -----------
+        gdf_zonas : GeoDataFrame
+            Zonas de análisis; la etiqueta de cada una es su posición + 1
+        ruta_referencia : Path
+            Raster que define la grilla (extensión, resolución y CRS)
+        ruta_salida : Path
+            Ruta del raster de etiquetas (COG int32)
+
+        Retorna:
+        --------
+        IndiceZonas
+        """
+        etiquetas = np.arange(1, len(gdf_zonas) + 1)
+
+        with rasterio.open(ruta_referencia) as ref:
+            gdf_zonas = gdf_zonas.to_crs(ref.crs) if ref.crs else gdf_zonas
+            geometrias = gdf_zonas.geometry.values
+            profile = ref.profile
+
+            with escribir_cog(ruta_salida, profile, count=1, dtype='int32', nodata=0) as dst:
+                dst.update_tags(n_zonas=len(gdf_zonas))
+                dst.set_band_description(1, 'Zona')
+                for ventana in iterar_ventanas(ref):
+                    # Solo las zonas que tocan la ventana
+                    cercanas = gdf_zonas.sindex.query(box(*limites_ventana(ventana, ref.transform)))
+                    forma = (int(ventana.height), int(ventana.width))
+                    bloque = np.zeros(forma, dtype=np.int32)
+                    if len(cercanas):
+                        bloque = rasterize(
+                            zip(geometrias[cercanas], etiquetas[cercanas]),
+                            out_shape=forma,
+                            transform=ref.window_transform(ventana),
+                            fill=0,
+                            dtype='int32',
+                        )
+                    dst.write(bloque, 1, window=ventana)
+
+        return cls(ruta_salida)
+
+    @classmethod
+    def desde_grilla(cls, ruta_referencia, n_cells_x, n_cells_y, ruta_salida):
+        """
+        Índice de una grilla regular que cubre la extensión de
+        `ruta_referencia` (ver zonal_analysis.crear_grilla_analisis),
+        calculado aritméticamente desde la posición de cada píxel, sin
+        rasterizar polígonos.
+
+        La zona de un píxel es la celda que contiene su centro; la etiqueta
+        es i * n_cells_y + j + 1, con i contado desde el oeste y j desde el sur.
+
+        Parámetros:
+        -----------
+        ruta_referencia : Path
+            Raster (norte arriba) cuya extensión cubre la grilla
+        n_cells_x, n_cells_y : int
+            Celdas en X e Y
+        ruta_salida : Path
+            Ruta del raster de etiquetas (COG int32)
+
+        Retorna:
+        --------
+        IndiceZonas
+        """
+        with rasterio.open(ruta_referencia) as ref:
+            # Celda de cada columna / fila (aritmética entera, sin redondeos)
+            i, j = celdas_cuadricula(ref.height, ref.width, n_cells_x, n_cells_y)
+
+            with escribir_cog(ruta_salida, ref.profile, count=1, dtype='int32', nodata=0) as dst:
+                dst.update_tags(n_zonas=n_cells_x * n_cells_y)
+                dst.set_band_description(1, 'Zona')
+                for ventana in iterar_ventanas(ref):
+                    filas = j[ventana.row_off:ventana.row_off + ventana.height]
+                    bloque = i[np.newaxis, :] * n_cells_y + filas[:, np.newaxis] + 1
+                    dst.write(bloque.astype(np.int32), 1, window=ventana)
+
+        return cls(ruta_salida)
+
+    def _entradas(self, ventana):
+        """Píxeles de la ventana con zona (etiqueta > 0), peso 1."""
+        with rasterio.open(self.ruta) as idx:
+            etiquetas = idx.read(1, window=ventana).ravel()
+        posiciones = np.flatnonzero(etiquetas > 0)
+        return etiquetas[posiciones], posiciones, None
+
+
+class CoberturaZonas(_ResumenZonas):
+    """
+    Cobertura fraccional exacta de polígonos arbitrarios sobre la grilla
+    de un raster, indexada por ventana con un STRtree.
+
+    El índice ventana → (zona, píxel, fracción) se calcula la primera vez
+    que se recorre cada ventana y se guarda en disco como arrays compactos
+    (zona int32, posición int32, fracción float64) en un directorio
+    temporal; las demás pasadas sobre rasters alineados (clases de cambio,
+    índices de cada año) lo leen de ahí. En memoria solo queda la ventana
+    en uso, y el disco ocupado es proporcional a las intersecciones
+    polígono × píxel. Los temporales se eliminan al cerrar (cerrar() o
+    bloque with) o al liberar el objeto.
+
+    Parámetros:
+    -----------
+    gdf_zonas : GeoDataFrame
+        Polígonos de las zonas (se reproyectan al CRS del raster); la
+        zona k es la fila k de la capa
+    ruta_referencia : Path
+        Raster que define la grilla (extensión, resolución y CRS)
+    directorio : str or Path, optional
+        Carpeta donde crear el índice temporal (por defecto, la del sistema)
+    """
+
+    fraccional = True
+
+    def __init__(self, gdf_zonas, ruta_referencia, directorio=None):
+        with rasterio.open(ruta_referencia) as ref:
+            self.crs = ref.crs
+            self.transform = ref.transform
+            self.forma = (ref.height, ref.width)
+            self.area_filas = area_filas_ha(ref.crs, ref.transform, ref.height)
+        gdf_zonas = gdf_zonas.to_crs(self.crs) if self.crs and gdf_zonas.crs else gdf_zonas
+        self.geometrias = np.asarray(gdf_zonas.geometry.values)
+        self.arbol = shapely.STRtree(self.geometrias)
+        self.n_zonas = len(self.geometrias)
+        self._tmp = tempfile.TemporaryDirectory(prefix='cobertura_zonas_', dir=directorio)
+        # Ventanas ya cubiertas (fila, columna, alto, ancho) -> archivo .npz
+        self._indice = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def cerrar(self):
+        """Elimina el índice temporal."""
+        self._indice.clear()
+        self._tmp.cleanup()
+
+    def _entradas(self, ventana):
+        """(zonas 1..n, posiciones en la ventana, fracción cubierta), del índice en disco."""
+        clave = (int(ventana.row_off), int(ventana.col_off), int(ventana.height), int(ventana.width))
+        if clave not in self._indice:
+            zonas, posiciones, pesos = self._cubrir(ventana)
+            ruta = Path(self._tmp.name) / ('_'.join(map(str, clave)) + '.npz')
+            with open(ruta, 'wb') as f:
+                np.savez(f, zonas=zonas.astype(np.int32), posiciones=posiciones.astype(np.int32),
+                         pesos=pesos)
+            self._indice[clave] = ruta
+            return zonas, posiciones, pesos
+        with np.load(self._indice[clave]) as datos:
+            return datos['zonas'], datos['posiciones'], datos['pesos']
+
+    def _cubrir(self, ventana):
+        """Cobertura exacta de los polígonos que intersectan la ventana."""
+        alto, ancho = int(ventana.height), int(ventana.width)
+        transform = transform_ventana(ventana, self.transform)
+        cercanos = self.arbol.query(box(*limites_ventana(ventana, self.transform)),
+                                    predicate='intersects')
+
+        zonas, posiciones, pesos = [], [], []
+        for k in cercanos:
+            poligono = self.geometrias[k]
+            # Sub-ventana: caja del polígono recortada a la ventana
+            xmin, ymin, xmax, ymax = poligono.bounds
+            col0, fila0 = ~transform * (xmin, ymax)
+            col1, fila1 = ~transform * (xmax, ymin)
+            col0, fila0 = max(int(np.floor(col0)), 0), max(int(np.floor(fila0)), 0)
+            col1, fila1 = min(int(np.ceil(col1)), ancho), min(int(np.ceil(fila1)), alto)
+            if col1 <= col0 or fila1 <= fila0:
+                continue
+            forma = (fila1 - fila0, col1 - col0)
+            sub = transform * Affine.translation(col0, fila0)
+
+            fracciones = _fracciones_poligono(poligono, sub, forma)
+            f, c = np.nonzero(fracciones > 1e-12)
+            zonas.append(np.full(len(f), k + 1, dtype=np.int64))
+            posiciones.append((f + fila0) * ancho + c + col0)
+            pesos.append(np.minimum(fracciones[f, c], 1.0))
+
+        if not zonas:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(zonas), np.concatenate(posiciones), np.concatenate(pesos)
+
+
+class ParcialesZonas:
+    """
+    Píxeles y hectáreas por (tesela, zona, clase) de un raster categórico,
+    con la firma BLAKE2b de los píxeles de cada tesela.
+
+    Al actualizar con una nueva versión del raster (otro umbral, un año
+    nuevo) solo se recalculan las teselas cuya firma cambió; las demás
+    reutilizan sus parciales, por lo que el costo es proporcional al área
+    modificada. Los parciales son dispersos (solo las celdas zona × clase
+    presentes en cada tesela) y se guardan en un .npz.
+
+    Parámetros:
+    -----------
+    n_zonas : int
+        Número de zonas del índice
+    n_clases : int
+        Las clases válidas son 0..n_clases-1
+    """
+
+    def __init__(self, n_zonas, n_clases):
+        self.n_zonas = n_zonas
+        self.n_clases = n_clases
+        # (fila, columna, alto, ancho) -> (firma, celdas zona·n_clases+clase, píxeles, hectáreas)
+        self.teselas = {}
+        self.recalculadas = 0
+        self.modificadas = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def cargar(cls, ruta):
+        """Parciales guardados con guardar()."""
+        with np.load(ruta) as datos:
+            parciales = cls(int(datos['n_zonas']), int(datos['n_clases']))
+            inicio, celdas = datos['inicio'], datos['celdas']
+            pixeles, hectareas = datos['pixeles'], datos['hectareas']
+            for k, (clave, firma) in enumerate(zip(datos['claves'], datos['firmas'])):
+                tramo = slice(inicio[k], inicio[k + 1])
+                parciales.teselas[tuple(int(v) for v in clave)] = (
+                    str(firma), celdas[tramo], pixeles[tramo], hectareas[tramo])
+        return parciales
+
+    def guardar(self, ruta):
+        """Escribe los parciales en `ruta` (.npz)."""
+        claves = list(self.teselas)
+        partes = [self.teselas[clave] for clave in claves]
+        largos = [len(parte[1]) for parte in partes]
+        unir = lambda i, dtype: (np.concatenate([parte[i] for parte in partes]) if partes
+                                 else np.zeros(0, dtype=dtype))
+        with open(ruta, 'wb') as f:
+            np.savez(f, n_zonas=self.n_zonas, n_clases=self.n_clases,
+                     claves=np.array(claves, dtype=np.int64).reshape(-1, 4),
+                     firmas=np.array([parte[0] for parte in partes], dtype='U32'),
+                     inicio=np.concatenate([[0], np.cumsum(largos)]).astype(np.int64),
+                     celdas=unir(1, np.int64), pixeles=unir(2, np.float64),
+                     hectareas=unir(3, np.float64))
+
+    def totales(self):
+        """Tupla (píxeles, hectáreas) float64 (n_zonas, n_clases), suma de las teselas."""
+        tamano = (self.n_zonas + 1) * self.n_clases
+        forma = (self.n_zonas + 1, self.n_clases)
+        if not self.teselas:
+            return np.zeros(forma)[1:], np.zeros(forma)[1:]
+        partes = list(self.teselas.values())
+        celdas = np.concatenate([parte[1] for parte in partes])
+        pixeles = np.bincount(celdas, weights=np.concatenate([parte[2] for parte in partes]),
+                              minlength=tamano)
+        hectareas = np.bincount(celdas, weights=np.concatenate([parte[3] for parte in partes]),
+                                minlength=tamano)
+        return pixeles.reshape(forma)[1:], hectareas.reshape(forma)[1:]
+
+    def actualizar(self, indice_zonas, ruta_raster, banda=1):
+        """
+        Recalcula las teselas de `ruta_raster` cuya firma cambió (todas la
+        primera vez) y deja en `recalculadas` cuántas fueron y en
+        `modificadas` las zonas (0..n-1) cuyos totales cambiaron.
+
+        Args:
+            indice_zonas: IndiceZonas o CoberturaZonas alineado al raster
+            ruta_raster: raster categórico (ej: cambio_clasificado.tif)
+            banda: número o nombre de banda
+
+        Returns:
+            Tupla (píxeles, hectáreas) (n_zonas, n_clases), como
+            superficie_clases
+        """
+        anteriores = self.totales()
+        teselas = {}
+        self.recalculadas = 0
+        with rasterio.open(ruta_raster) as src:
+            indice_zonas._verificar_alineacion(src)
+            numero = indice_banda(src, banda) if isinstance(banda, str) else banda
+            for ventana in indice_zonas._ventanas(src):
+                clases = src.read(numero, window=ventana)
+                firma = hashlib.blake2b(clases.tobytes(), digest_size=16).hexdigest()
+                clave = (int(ventana.row_off), int(ventana.col_off),
+                         int(ventana.height), int(ventana.width))
+                if clave in self.teselas and self.teselas[clave][0] == firma:
+                    teselas[clave] = self.teselas[clave]
+                    continue
+
+                zonas, posiciones, pesos, area = indice_zonas._pixeles(ventana)
+                clases = clases.ravel()[posiciones]
+                valido = clases < self.n_clases
+                celda = zonas[valido].astype(np.int64) * self.n_clases + clases[valido]
+                peso = np.ones(len(celda)) if pesos is None else pesos[valido]
+                celdas, inverso = np.unique(celda, return_inverse=True)
+                teselas[clave] = (firma, celdas, np.bincount(inverso, weights=peso),
+                                  np.bincount(inverso, weights=area[valido] * peso))
+                self.recalculadas += 1
+        self.teselas = teselas
+
+        pixeles, hectareas = self.totales()
+        distinto = (pixeles != anteriores[0]) | (hectareas != anteriores[1])
+        self.modificadas = np.flatnonzero(distinto.any(axis=1))
+        if not indice_zonas.fraccional:
+            pixeles = np.rint(pixeles).astype(np.int64)
+        return pixeles, hectareas